@@ -0,0 +1,144 @@
+import json
+import random
+import socket
+import ipaddress
+import logging
+
+from util.hop import Hop
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+_CITIES = [("Ashburn", "US", "Virginia"), ("Frankfurt", "DE", "Hesse"), ("Singapore", "SG", "Singapore"),
+           ("Amsterdam", "NL", "North Holland"), ("Sao Paulo", "BR", "Sao Paulo"), ("Tokyo", "JP", "Tokyo")]
+
+
+# Special purpose ranges never drawn as public addresses
+_RESERVED = [ipaddress.IPv4Network(network) for network in ("0.0.0.0/8", "10.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8",
+             "169.254.0.0/16", "172.16.0.0/12", "192.0.0.0/24", "192.168.0.0/16", "198.18.0.0/15", "224.0.0.0/3")]
+_RESERVED = [(int(network.network_address), int(network.broadcast_address)) for network in _RESERVED]
+
+
+def _random_public_address(rng:random.Random) -> int:
+    while True:
+        address = rng.getrandbits(32)
+        if not any(start <= address <= end for start, end in _RESERVED):
+            return address
+
+
+def make_prefixes(prefix_count:int, seed:int=0) -> list[str]:
+    """
+    Synthetic IXP peering LAN prefixes, shaped like the CAIDA dataset: mostly /22 to /24 networks, a few
+    larger networks with more specific prefixes inside them.
+
+    :param prefix_count: Number of distinct prefixes.
+    :param seed: Seed of the random generator, the same seed always gives the same prefixes.
+    """
+    rng = random.Random(seed)
+    prefixes = []
+    seen = set()
+    while len(prefixes) < prefix_count:
+        if prefixes and rng.random() < 0.05:
+            # More specific prefix inside one already generated
+            parent = ipaddress.IPv4Network(rng.choice(prefixes))
+            length = min(30, parent.prefixlen + rng.randint(1, 6))
+            offset = rng.getrandbits(length - parent.prefixlen) << (32 - length)
+            network = ipaddress.IPv4Network((int(parent.network_address) + offset, length))
+        else:
+            length = rng.choice([16, 20, 21, 22, 22, 23, 23, 24, 24, 24, 24, 24, 25, 26, 27, 28])
+            network = ipaddress.IPv4Network((_random_public_address(rng), length), strict=False)
+        if str(network) not in seen:
+            seen.add(str(network))
+            prefixes.append(str(network))
+    return prefixes
+
+
+def write_ixp_dataset(filename:str, prefix_count:int, seed:int=0, prefixes_per_ix:int=4) -> list[str]:
+    """
+    Write a synthetic dataset in the format of the CAIDA `ixs_yyyymm.jsonl` files: a comment line,
+    then one IX per line with its IPv4 and IPv6 prefixes. A few prefixes are listed by two IXs, as in
+    the real dataset.
+
+    :param filename: JSONL file written.
+    :param prefix_count: Number of distinct IPv4 prefixes.
+    :return: the IPv4 prefixes written.
+    """
+    rng = random.Random(seed)
+    prefixes = make_prefixes(prefix_count, seed)
+    shuffled = list(prefixes)
+    rng.shuffle(shuffled)
+    with open(filename, 'w') as file:
+        file.write('# ' + json.dumps({"description": "synthetic IXP dataset for benchmarks", "prefixes": prefix_count}) + '\n')
+        for ix_id, start in enumerate(range(0, len(shuffled), prefixes_per_ix), 1):
+            ipv4 = shuffled[start:start + prefixes_per_ix]
+            if rng.random() < 0.02:
+                ipv4 = ipv4 + [rng.choice(prefixes)]
+            city, country, region = rng.choice(_CITIES)
+            file.write(json.dumps({
+                "pch_id": ix_id,
+                "ix_id": ix_id,
+                "name": f"IX-{ix_id}",
+                "name_long": f"Synthetic Internet Exchange {ix_id}",
+                "city": city,
+                "country": country,
+                "region": region,
+                "sources": ["pch", "pdb"],
+                "prefixes": {"ipv4": ipv4, "ipv6": [f"2001:7f8:{ix_id:x}::/64"]}
+            }) + '\n')
+    return prefixes
+
+
+def make_ip_list(prefixes:list[str], ip_count:int, seed:int=0, exact_share:float=0.2, inside_share:float=0.4) -> list[str]:
+    """
+    Synthetic IP list: a share of prefix network addresses (matched by the exact matching of
+    `caida.ip_map_ixp`), a share of addresses inside the prefixes and random public addresses.
+    """
+    rng = random.Random(seed)
+    networks = [(int(network.network_address), network.num_addresses) for network in map(ipaddress.IPv4Network, prefixes)]
+    ips = []
+    for _ in range(ip_count):
+        draw = rng.random()
+        if draw < exact_share:
+            address = rng.choice(networks)[0]
+        elif draw < exact_share + inside_share:
+            start, size = rng.choice(networks)
+            address = start + rng.randrange(size)
+        else:
+            address = _random_public_address(rng)
+        ips.append(socket.inet_ntoa(address.to_bytes(4, 'big')))
+    return ips
+
+
+def make_org_details(range_count:int, seed:int=0) -> list[dict]:
+    """
+    Synthetic organization details, as identified by `util.gpt_whois`. Half of the network ranges are in
+    the "start - end" format of ARIN and RIPE whois records, the other half in CIDR format.
+    """
+    rng = random.Random(seed)
+    org_details = []
+    for index, prefix in enumerate(make_prefixes(range_count, seed + 1)):
+        network = ipaddress.IPv4Network(prefix)
+        network_range = str(network) if index % 2 else f"{network.network_address} - {network.broadcast_address}"
+        org_details.append({
+            'Regional Registry': rng.choice(['ARIN', 'RIPE', 'APNIC', 'LACNIC', 'AFRINIC']),
+            'Network Range': network_range,
+            'Organization': f"Organization {index}",
+            'Address': f"{index} Example Street, {rng.choice(_CITIES)[0]}"
+        })
+    return org_details
+
+
+def make_hops(org_details:list[dict], hop_count:int, seed:int=0) -> list[Hop]:
+    """
+    Synthetic hops of a traceroute with their location, most of them inside the network ranges of org_details.
+    """
+    rng = random.Random(seed)
+    hops = []
+    for number in range(1, hop_count + 1):
+        if rng.random() < 0.8:
+            # Network ranges start with their first address, in CIDR and "start - end" formats alike
+            start = rng.choice(org_details)['Network Range'].split(' - ')[0].split('/')[0]
+            ip = int(ipaddress.IPv4Address(start)) + rng.randrange(4)
+        else:
+            ip = _random_public_address(rng)
+        hops.append(Hop(number, ip, location=f"AS{number} Example, City, Region, CC"))
+    return hops
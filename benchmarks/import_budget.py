@@ -0,0 +1,71 @@
+"""
+Import-time budget check of the program's entry points.
+
+Each module is imported in a fresh interpreter, from an empty working directory, and must:
+    - import within the time budget (median of several runs)
+    - not import the heavy optional dependencies, loaded only by the runs that use them
+    - not create any file, such as a log file, in the working directory
+
+    python -m benchmarks.import_budget --budget-ms 100
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ['main', 'util.gpt_whois', 'util.llm_batch', 'util.trace_route', 'util.speed_test', 'util.batch',
+                   'util.pipeline', 'caida.map_ixp', 'caida.ip_map_ixp', 'caida.ixp_snapshot']
+HEAVY_MODULES = ['openai', 'requests', 'speedtest', 'numpy', 'pyarrow']
+
+
+def measure_import(module_name:str, working_dir:str) -> tuple[float, list[str]]:
+    """
+    Import a module in a fresh interpreter.
+
+    :return: (import time of the module and everything it imports in ms, heavy modules it imported)
+    """
+    script = (f"import sys, time; started = time.perf_counter(); import {module_name}; elapsed = time.perf_counter() - started; "
+              f"import json; print(json.dumps([elapsed * 1000, sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)]))")
+    environment = dict(os.environ, PYTHONPATH=PROJECT_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    completed = subprocess.run([sys.executable, '-c', script], cwd=working_dir, env=environment, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module_name} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+    import_time, heavy_modules = json.loads(completed.stdout.strip().splitlines()[-1])
+    return import_time, heavy_modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the entry points import quickly and without side effects.")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help="Modules to check")
+    parser.add_argument('--budget-ms', type=float, default=100, help="Largest median import time of a module, in ms")
+    parser.add_argument('-n', dest='repeats', type=int, default=5, help="Imports measured per module")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<24} {'median ms':>10} {'max ms':>8}  heavy modules imported")
+    for module_name in args.modules:
+        with tempfile.TemporaryDirectory(prefix="import-budget-") as working_dir:
+            times = []
+            heavy_modules = []
+            for _ in range(args.repeats):
+                import_time, heavy_modules = measure_import(module_name, working_dir)
+                times.append(import_time)
+            created_files = os.listdir(working_dir)
+
+        median = statistics.median(times)
+        print(f"{module_name:<24} {median:>10.1f} {max(times):>8.1f}  {', '.join(heavy_modules) or '-'}")
+        if median > args.budget_ms:
+            failures.append(f"{module_name} imports in {median:.1f} ms, over the {args.budget_ms:g} ms budget")
+        if heavy_modules:
+            failures.append(f"{module_name} imports {', '.join(heavy_modules)} on import")
+        if created_files:
+            failures.append(f"{module_name} creates {', '.join(created_files)} on import")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
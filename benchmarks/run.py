@@ -0,0 +1,271 @@
+"""
+Benchmarks of the IXP matching and IP enrichment hot paths, on synthetic CAIDA shaped datasets.
+
+Every benchmark reports the throughput, the latency percentiles of single calls and the peak memory
+allocated, and can be compared against a baseline saved by an earlier run:
+
+    python -m benchmarks.run --save-baseline baseline.json
+    python -m benchmarks.run --baseline baseline.json
+
+Everything runs offline: whois is replaced by `benchmarks.stubs.fake_whois`, and ipinfo and the
+OpenAI API by a local `benchmarks.stubs.StubServer`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from benchmarks import datasets, stubs
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_PREFIX_COUNTS = [1000, 10000, 100000]
+DEFAULT_IP_COUNT = 100000
+
+
+def percentile(sorted_values:list[float], fraction:float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def measure(function, inputs:list, budget:float, items_per_call:int=1, memory_sample:int=1000) -> dict:
+    """
+    Call function on each input in turn, until every input was used or the time budget is spent.
+
+    :param function: Function of one argument.
+    :param inputs: Arguments, one per call.
+    :param budget: Seconds after which no more calls are made.
+    :param items_per_call: Items (IP addresses, prefixes...) processed by one call, for the throughput.
+    :param memory_sample: Number of calls repeated under tracemalloc to find the peak memory.
+    :return: Dictionary of calls, seconds, throughput (items per second), latency percentiles (ms) and peak memory (bytes).
+    """
+    latencies = []
+    clock = time.perf_counter_ns
+    deadline = clock() + int(budget * 1e9)
+    for argument in inputs:
+        start = clock()
+        function(argument)
+        end = clock()
+        latencies.append(end - start)
+        if end > deadline:
+            break
+    seconds = sum(latencies) / 1e9
+
+    # tracemalloc slows every allocation down, the peak is measured on a separate, shorter, run
+    tracemalloc.start()
+    try:
+        for argument in inputs[:min(memory_sample, len(latencies))]:
+            function(argument)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'seconds': round(seconds, 6),
+        'throughput': round(len(latencies) * items_per_call / seconds, 3) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) / 1e6, 6),
+        'p90_ms': round(percentile(latencies, 0.90) / 1e6, 6),
+        'p99_ms': round(percentile(latencies, 0.99) / 1e6, 6),
+        'max_ms': round(latencies[-1] / 1e6, 6) if latencies else 0.0,
+        'peak_memory': peak_memory
+    }
+
+
+def ixp_benchmarks(prefix_count:int, ip_count:int, budget:float, scratch_dir:str) -> dict[str, dict]:
+    """
+    Benchmarks of the IXP dataset loading and the exact and longest prefix matching of IP addresses.
+    """
+    from caida import ip_map_ixp, map_ixp
+
+    jsonl_file_name = os.path.join(scratch_dir, f"ixs_{prefix_count}.jsonl")
+    prefixes = datasets.write_ixp_dataset(jsonl_file_name, prefix_count)
+    ips = datasets.make_ip_list(prefixes, ip_count)
+
+    results = {}
+    results['parseJSONL'] = measure(ip_map_ixp.parseJSONL, [jsonl_file_name] * 5, budget, prefix_count, memory_sample=1)
+    results['extract_ipv4_name_dict_from'] = measure(map_ixp.extract_ipv4_name_dict_from, [jsonl_file_name] * 5, budget,
+                                                     prefix_count, memory_sample=1)
+
+    ixs, ip_index = ip_map_ixp.parseJSONL(jsonl_file_name)
+    prefix_dict = map_ixp.extract_ipv4_name_dict_from(jsonl_file_name)
+    results['findIndex'] = measure(lambda ip: ip_map_ixp.findIndex(ip, ixs), ips, budget, memory_sample=10)
+    results['findIX'] = measure(lambda ip: ip_map_ixp.findIX(ip, ip_index), ips, budget)
+    results['longest_prefix_match'] = measure(lambda ip: map_ixp.longest_prefix_match(ip, prefix_dict), ips, budget,
+                                              memory_sample=10)
+
+    results['PrefixTrie.from_jsonl'] = measure(map_ixp.PrefixTrie.from_jsonl, [jsonl_file_name] * 3, budget, prefix_count,
+                                               memory_sample=1)
+    trie = map_ixp.PrefixTrie.from_jsonl(jsonl_file_name)
+    results['PrefixTrie.match'] = measure(trie.match, ips, budget)
+
+    try:
+        from caida import bulk_match
+    except ImportError as e:
+        logger.warning(f"Skipping the bulk matching benchmark: {e}")
+    else:
+        matcher = bulk_match.BulkMatcher(ixs)
+        results['BulkMatcher.exact_match'] = measure(lambda chunk: matcher.exact_match(*bulk_match.ips_to_array(chunk)),
+                                                     [ips], budget, len(ips), memory_sample=1)
+        results['BulkMatcher.longest_prefix_match'] = measure(
+            lambda chunk: matcher.longest_prefix_match(*bulk_match.ips_to_array(chunk)), [ips], budget, len(ips), memory_sample=1)
+    return results
+
+
+def enrichment_benchmarks(range_count:int, budget:float, trace_hops:int=30) -> dict[str, dict]:
+    """
+    Benchmarks of the conversion of whois network ranges, and of the matching of hops to the organizations found.
+    """
+    from util import gpt_whois
+    from util.hop import OrgRecord
+    org_details = datasets.make_org_details(range_count)
+    ranges = [org_detail['Network Range'] for org_detail in org_details]
+
+    results = {}
+    results['to_cidr'] = measure(gpt_whois.to_cidr, ranges, budget)
+
+    range_dict = {gpt_whois.to_cidr(network_range): org_detail['Organization'] for network_range, org_detail in zip(ranges, org_details)}
+    results['build_ip_range_index'] = measure(gpt_whois.build_ip_range_index, [range_dict] * 3, budget, len(range_dict),
+                                              memory_sample=1)
+    ip_range_index = gpt_whois.build_ip_range_index(range_dict)
+    hop_ips = [hop.ip_address for hop in datasets.make_hops(org_details, 10000)]
+    results['match_ip_to_org'] = measure(lambda ip: gpt_whois.match_ip_to_org(ip_range_index, ip), hop_ips, budget)
+
+    # One call per traceroute: its hops against the organizations found
+    rng = random.Random(0)
+    cidr_details = [dict(org_detail, **{'Network Range': gpt_whois.to_cidr(org_detail['Network Range'])}) for org_detail in org_details]
+    org_records = [OrgRecord.from_dict(org_detail) for org_detail in cidr_details]
+    traces = []
+    for seed in range(200):
+        found = rng.sample(range(len(cidr_details)), min(len(cidr_details), trace_hops))
+        traces.append((datasets.make_hops([cidr_details[index] for index in found], trace_hops, seed), [org_records[index] for index in found]))
+    results['integrate_ip_info'] = measure(lambda trace: gpt_whois.integrate_ip_info(*trace), traces, budget, trace_hops)
+    all_hops = datasets.make_hops(cidr_details, 10000)
+    results['integrate_ip_info.all_ranges'] = measure(lambda hops: gpt_whois.integrate_ip_info(hops, org_records),
+                                                      [all_hops] * 3, budget, len(all_hops), memory_sample=1)
+    return results
+
+
+def pipeline_benchmark(ip_count:int, latency:float) -> dict:
+    """
+    Resolve the location and organization of IP addresses through LocationClient and OrgResolver, against
+    the stub ipinfo and OpenAI servers and the stub whois, each answering after `latency` seconds.
+    """
+    from util import gpt_whois
+    from util.trace_route import LocationClient
+    from util.llm_batch import LLMBatcher
+    from util.openai_client import set_api_key
+
+    # Placeholder key: the LLM requests go to the stub server, never to OpenAI
+    set_api_key("sk-offline-benchmark")
+
+    ips = datasets.make_ip_list([], ip_count, exact_share=0, inside_share=0)
+    latencies = []
+    with stubs.StubServer(ipinfo_latency=latency, llm_latency=latency) as server, stubs.offline_whois(latency):
+        llm_batcher = LLMBatcher(api_base=server.llm_api_base)
+        started = time.perf_counter_ns()
+        with LocationClient(base_url=server.base_url) as location_client, gpt_whois.OrgResolver(llm_batcher=llm_batcher) as org_resolver:
+            futures = [(location_client.submit(ip), org_resolver.submit(ip)) for ip in ips]
+            for location_future, org_future in futures:
+                location_future.result()
+                org_future.result()
+                latencies.append(time.perf_counter_ns() - started)
+            resolver_stats = org_resolver.stats()
+        llm_batcher.close()
+        seconds = (time.perf_counter_ns() - started) / 1e9
+
+    latencies.sort()
+    return {
+        'calls': ip_count,
+        'seconds': round(seconds, 6),
+        'throughput': round(ip_count / seconds, 3),
+        'p50_ms': round(percentile(latencies, 0.50) / 1e6, 6),
+        'p90_ms': round(percentile(latencies, 0.90) / 1e6, 6),
+        'p99_ms': round(percentile(latencies, 0.99) / 1e6, 6),
+        'max_ms': round(latencies[-1] / 1e6, 6),
+        'peak_memory': None,
+        'ipinfo_requests': server.ipinfo_requests,
+        'llm_requests': server.llm_requests,
+        **resolver_stats
+    }
+
+
+def compare(results:dict[str, dict], baseline:dict[str, dict], tolerance:float) -> list[str]:
+    """
+    Compare the throughput of each benchmark with the baseline.
+
+    :return: names of the benchmarks whose throughput dropped by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference or not reference.get('throughput'):
+            continue
+        result['vs_baseline'] = round(result['throughput'] / reference['throughput'], 3)
+        if result['vs_baseline'] < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def print_table(results:dict[str, dict]) -> None:
+    print(f"{'benchmark':<48} {'calls':>8} {'items/s':>14} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'peak MiB':>9} {'vs base':>8}")
+    for name, result in results.items():
+        peak = f"{result['peak_memory'] / 2 ** 20:.2f}" if result.get('peak_memory') is not None else "-"
+        ratio = f"{result['vs_baseline']:.2f}x" if 'vs_baseline' in result else "-"
+        print(f"{name:<48} {result['calls']:>8} {result['throughput']:>14,.1f} {result['p50_ms']:>10.4f} "
+              f"{result['p90_ms']:>10.4f} {result['p99_ms']:>10.4f} {peak:>9} {ratio:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the IXP matching and IP enrichment hot paths on synthetic data, offline.")
+    parser.add_argument('--prefixes', type=int, nargs='+', default=DEFAULT_PREFIX_COUNTS, help="Dataset sizes, in IPv4 prefixes (and organization ranges)")
+    parser.add_argument('--ips', type=int, default=DEFAULT_IP_COUNT, help="Number of IP addresses matched, up to millions")
+    parser.add_argument('--budget', type=float, default=2.0, help="Seconds spent at most on each benchmark")
+    parser.add_argument('--pipeline-ips', type=int, default=200, help="IP addresses resolved by the offline enrichment pipeline, 0 to skip it")
+    parser.add_argument('--pipeline-latency', type=float, default=0.01, help="Seconds each stub whois, ipinfo and LLM request takes")
+    parser.add_argument('-o', dest='output', type=str, required=False, help="Save the results to this JSON file")
+    parser.add_argument('--save-baseline', type=str, required=False, help="Save the results as the baseline JSON file")
+    parser.add_argument('--baseline', type=str, required=False, help="Compare the results with this baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Throughput drop, as a fraction, reported as a regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="benchmarks-") as scratch_dir:
+        for prefix_count in args.prefixes:
+            print(f"Running the benchmarks with {prefix_count} prefixes and {args.ips} IP addresses", file=sys.stderr)
+            for name, result in ixp_benchmarks(prefix_count, args.ips, args.budget, scratch_dir).items():
+                results[f"{name}[{prefix_count}]"] = result
+            for name, result in enrichment_benchmarks(prefix_count, args.budget).items():
+                results[f"{name}[{prefix_count}]"] = result
+        if args.pipeline_ips:
+            print(f"Running the offline enrichment pipeline on {args.pipeline_ips} IP addresses", file=sys.stderr)
+            results[f"pipeline[{args.pipeline_ips}]"] = pipeline_benchmark(args.pipeline_ips, args.pipeline_latency)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.tolerance)
+    print_table(results)
+
+    report = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'created_at': time.time(),
+                 'ips': args.ips, 'budget': args.budget},
+        'results': results
+    }
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as file:
+                json.dump(report, file, indent=2)
+
+    if regressions:
+        print(f"Throughput regressions of more than {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,227 @@
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+import ipaddress
+import socketserver
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+_REGISTRIES = ['RIPE', 'APNIC', 'AFRINIC', 'ARIN', 'LACNIC']
+_RECORD_PATTERN = re.compile(r'^### Record (\d+) \(IP address ([^)]+)\)$', re.MULTILINE)
+
+
+def fake_whois(ip_address:str, unparsed_share:float=0.3) -> str:
+    """
+    Offline stand-in for the whois command: a registry record for the /24 of the IP address.
+
+    A share of the records is missing the source and address attributes, so that the deterministic parser
+    is not confident enough and the record goes to the LLM, as happens with real whois responses.
+    The same IP address always gets the same record.
+    """
+    network = ipaddress.ip_network(f"{ip_address}/24", strict=False)
+    draw = zlib.crc32(str(network).encode())
+    registry = _REGISTRIES[draw % len(_REGISTRIES)]
+    organization = f"Synthetic Networks {draw % 997}"
+    lines = [
+        f"% This is the {registry} Database query service (stub).",
+        "",
+        f"inetnum:        {network.network_address} - {network.broadcast_address}",
+        f"netname:        SYNTH-{draw % 997}",
+        f"org-name:       {organization}",
+        "country:        SG",
+    ]
+    if (draw % 1000) / 1000 >= unparsed_share:
+        lines += [f"address:        {draw % 97} Example Road", "address:        Singapore", f"source:         {registry}"]
+    return '\n'.join(lines) + '\n'
+
+
+def _location(ip_address:str) -> dict:
+    draw = zlib.crc32(ip_address.encode())
+    return {'ip': ip_address, 'city': f"City {draw % 50}", 'region': f"Region {draw % 10}", 'country': 'SG',
+            'org': f"AS{draw % 65000} Synthetic Networks"}
+
+
+def _chat_answer(prompt:str) -> str:
+    # Batched prompts of util.llm_batch ask for a JSON array, the single prompt of util.gpt_whois for "Field:Value" lines
+    records = _RECORD_PATTERN.findall(prompt)
+    if records:
+        answers = []
+        for record_id, ip_address in records:
+            network = ipaddress.ip_network(f"{ip_address}/24", strict=False)
+            answers.append({'id': int(record_id), 'Regional Registry': 'RIPE', 'Network Range': str(network),
+                            'Organization': f"Synthetic Networks {zlib.crc32(str(network).encode()) % 997}",
+                            'Address': 'Singapore'})
+        return json.dumps(answers)
+    match = re.search(r'for ip address (\S+),', prompt)
+    ip_address = match.group(1) if match else '0.0.0.0'
+    network = ipaddress.ip_network(f"{ip_address}/24", strict=False)
+    return (f"Regional Registry:RIPE\nOrganization:Synthetic Networks {zlib.crc32(str(network).encode()) % 997}\n"
+            f"Network Range:{network}\nAddress:Singapore")
+
+
+class StubServer:
+    """
+    Local HTTP server answering like ipinfo.io (`GET /<ip>/json`) and like the OpenAI chat completion API
+    (`POST /v1/chat/completions`), so that the enrichment pipeline can be benchmarked without network access.
+
+    :param ipinfo_latency: Seconds every ipinfo request takes.
+    :param llm_latency: Seconds every chat completion request takes.
+    """
+
+    def __init__(self, ipinfo_latency:float=0.0, llm_latency:float=0.0):
+        self.ipinfo_requests = 0
+        self.llm_requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, body:dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                server.ipinfo_requests += 1
+                time.sleep(ipinfo_latency)
+                self._reply(_location(self.path.strip('/').split('/')[0]))
+
+            def do_POST(self):
+                server.llm_requests += 1
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                time.sleep(llm_latency)
+                content = _chat_answer(request['messages'][-1]['content'])
+                self._reply({'id': 'stub', 'object': 'chat.completion', 'model': request.get('model'),
+                             'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+                             'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}})
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-server", daemon=True)
+
+    @property
+    def llm_api_base(self) -> str:
+        return f"{self.base_url}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+_REGISTRY_SERVERS = {'RIPE': "whois.ripe.net", 'APNIC': "whois.apnic.net", 'AFRINIC': "whois.afrinic.net",
+                      'ARIN': "whois.arin.net", 'LACNIC': "whois.lacnic.net"}
+
+
+def _iana_answer(query:str) -> str:
+    # IANA delegates whole /8 blocks of IPv4 to the registries
+    try:
+        network = ipaddress.ip_network(f"{query}/{8 if ipaddress.ip_address(query).version == 4 else 12}", strict=False)
+    except ValueError:
+        return "% IANA WHOIS server (stub)\n\n% This query returned 0 objects.\n"
+    registry = _REGISTRIES[zlib.crc32(str(network).encode()) % len(_REGISTRIES)]
+    return (f"% IANA WHOIS server (stub)\n\nrefer:        {_REGISTRY_SERVERS[registry]}\n\n"
+            f"inetnum:      {network.network_address} - {network.broadcast_address}\n"
+            f"organisation: {registry}\nstatus:       ALLOCATED\n")
+
+
+class StubWhoisServer:
+    """
+    Local whois servers on TCP, standing in for IANA and the registries: IANA refers each /8 to a registry,
+    and the registries answer with `fake_whois` records. Like the RIPE database, the registries keep the
+    connection open for further queries when the first one starts with "-k".
+
+    :param whois_latency: Seconds every registry query takes.
+    :param unparsed_share: See fake_whois.
+    """
+
+    def __init__(self, whois_latency:float=0.0, unparsed_share:float=0.3):
+        self.queries = 0
+        self.connections = 0
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.connections += 1
+                keep_alive = False
+                for line in self.rfile:
+                    query = line.decode('utf-8').strip()
+                    if query.startswith('-k '):
+                        keep_alive, query = True, query[3:]
+                    # Query formats such as "n + 1.2.3.4" of ARIN: the address is the last word
+                    query = query.split()[-1] if query else query
+                    server.queries += 1
+                    if self.server.root:
+                        self.wfile.write(_iana_answer(query).encode())
+                        return
+                    time.sleep(whois_latency)
+                    try:
+                        answer = fake_whois(query, unparsed_share)
+                    except ValueError:
+                        answer = "% No entries found.\n"
+                    self.wfile.write(answer.encode() + (b"\n\n" if keep_alive else b""))
+                    if not keep_alive:
+                        return
+
+        self._servers = []
+        for root in (True, False):
+            tcp_server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+            tcp_server.daemon_threads = True
+            tcp_server.root = root
+            self._servers.append(tcp_server)
+        self._threads = [threading.Thread(target=tcp_server.serve_forever, name="stub-whois", daemon=True)
+                         for tcp_server in self._servers]
+
+    def servers(self) -> dict:
+        """
+        Server map of `util.whois_client.WhoisClient` sending the queries to IANA and the registries here.
+        """
+        from util.whois_client import DEFAULT_SERVERS, WhoisServer
+        root_port, registry_port = (tcp_server.server_address[1] for tcp_server in self._servers)
+        servers = {}
+        for name, default in DEFAULT_SERVERS.items():
+            port = root_port if name == "whois.iana.org" else registry_port
+            servers[name] = WhoisServer("127.0.0.1", port, default.query_format, default.keep_alive, default.max_connections)
+        return servers
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for tcp_server in self._servers:
+            tcp_server.shutdown()
+            tcp_server.server_close()
+
+
+@contextmanager
+def offline_whois(whois_latency:float=0.0, unparsed_share:float=0.3):
+    """
+    Send the whois queries of `util.gpt_whois` to a StubWhoisServer, through a `util.whois_client.WhoisClient`.
+
+    :param whois_latency: Seconds every whois query takes.
+    """
+    from util.whois_client import WhoisClient, set_client
+
+    with StubWhoisServer(whois_latency, unparsed_share) as server, WhoisClient(server.servers()) as client:
+        previous = set_client(client)
+        try:
+            yield server
+        finally:
+            set_client(previous)
@@ -0,0 +1,169 @@
+"""
+Vectorized bulk matching of IP addresses against a CAIDA IXP dataset, for IP lists of millions of lines.
+
+IP addresses are loaded as a uint32 NumPy array, and matched with `searchsorted` against the sorted
+prefix addresses (exact matching, as `caida.ip_map_ixp`) or against sorted prefix start/end arrays
+(longest prefix matching, as `caida.map_ixp`).
+"""
+import socket
+import itertools
+
+import numpy as np
+
+from caida.ip_map_ixp import writeCSV
+
+
+def ips_to_array(ips:list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert IPv4 address strings into a uint32 array, parsing all of them at once.
+
+    :param ips: List of IP address strings.
+    :return: (addresses, valid) where valid is False for lines that are not a canonical dotted quad
+        (the only form the CSV export matches).
+    """
+    addresses = np.zeros(len(ips), dtype=np.uint32)
+    if not ips:
+        return addresses, np.zeros(0, dtype=bool)
+    # Fixed width byte strings viewed as a (len(ips), 16) matrix of characters.
+    # Longer lines are truncated, but then have no terminating null and are rejected.
+    try:
+        text = np.array(ips, dtype='S16')
+    except UnicodeEncodeError:
+        text = np.array([ip.encode('ascii', 'replace') for ip in ips], dtype='S16')
+    chars = np.zeros((len(ips), 16), dtype=np.uint8)
+    chars[:, :text.itemsize] = text.view(np.uint8).reshape(len(ips), text.itemsize)
+
+    # Only digits and exactly three dots before the terminating null
+    is_dot = chars == 46
+    is_end = chars == 0
+    lengths = is_end.argmax(axis=1)
+    valid = is_end[:, -1] & (np.count_nonzero(is_dot, axis=1) == 3)
+    valid &= np.count_nonzero(is_dot | ((chars >= 48) & (chars <= 57)), axis=1) == lengths
+
+    # Bounds of the four octets of the remaining lines, from the positions of their dots
+    rows = np.flatnonzero(valid)
+    chars = chars[rows]
+    dots = np.nonzero(is_dot[rows])[1].reshape(-1, 3)
+    starts = np.empty((len(rows), 4), dtype=np.intp)
+    starts[:, 0] = 0
+    starts[:, 1:] = dots + 1
+    digits = np.empty((len(rows), 4), dtype=np.intp)
+    digits[:, :3] = dots
+    digits[:, 3] = lengths[rows]
+    digits -= starts
+
+    octets = np.zeros(starts.shape, dtype=np.int32)
+    for position in range(3):
+        digit = np.take_along_axis(chars, np.minimum(starts + position, 15), axis=1).astype(np.int32) - 48
+        octets = np.where(position < digits, octets * 10 + digit, octets)
+    leading_zero = (digits > 1) & (np.take_along_axis(chars, starts, axis=1) == 48)
+    canonical = ((digits >= 1) & (digits <= 3) & (octets <= 255) & ~leading_zero).all(axis=1)
+
+    valid[rows] = canonical
+    octets = octets.astype(np.uint32)
+    addresses[rows] = np.where(canonical, (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3], 0)
+    return addresses, valid
+
+
+class BulkMatcher:
+    """
+    Sorted NumPy arrays over the IPv4 prefixes of the IXPs parsed by `caida.ip_map_ixp.parseJSONL`.
+    """
+
+    def __init__(self, ixs:dict):
+        self.ixs = [ixs[i] for i in range(len(ixs))]
+
+        exact = {}
+        entries = []
+        for slot, ix in enumerate(self.ixs):
+            for prefix in ix['prefixes']['ipv4']:
+                address, _, length = prefix.partition('/')
+                try:
+                    start = int.from_bytes(socket.inet_aton(address), 'big')
+                except OSError:
+                    continue
+                if socket.inet_ntoa(socket.inet_aton(address)) == address:
+                    # The first IX listing an address wins, as in findIX
+                    exact.setdefault(start, slot)
+                length = int(length) if length.isdigit() else 32
+                start &= (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+                entries.append((start, length, slot, start | (0xFFFFFFFF >> length)))
+
+        exact_addresses = sorted(exact)
+        self.exact_addresses = np.array(exact_addresses, dtype=np.uint32)
+        self.exact_slots = np.array([exact[address] for address in exact_addresses], dtype=np.int64)
+
+        # More specific prefixes sort after the prefixes that enclose them, see caida.ixp_snapshot
+        entries.sort()
+        parents = []
+        stack = []
+        for index, (start, _, _, end) in enumerate(entries):
+            while stack and entries[stack[-1]][3] < start:
+                stack.pop()
+            parent = stack[-1] if stack else -1
+            # Prefixes listed by several IXs link straight to the prefix enclosing all of them
+            if parent >= 0 and entries[parent][0] == start and entries[parent][3] == end:
+                parent = parents[parent]
+            parents.append(parent)
+            stack.append(index)
+        self.starts = np.array([entry[0] for entry in entries], dtype=np.uint32)
+        self.lengths = np.array([entry[1] for entry in entries], dtype=np.uint8)
+        self.slots = np.array([entry[2] for entry in entries], dtype=np.int64)
+        self.ends = np.array([entry[3] for entry in entries], dtype=np.uint32)
+        self.parents = np.array(parents, dtype=np.int64)
+
+    def exact_match(self, addresses:np.ndarray, valid:np.ndarray=None) -> np.ndarray:
+        """
+        :return: IX slot (index into ixs) of each address, -1 where there is no exact match.
+        """
+        if len(self.exact_addresses) == 0:
+            return np.full(len(addresses), -1, dtype=np.int64)
+        positions = np.searchsorted(self.exact_addresses, addresses)
+        positions = np.minimum(positions, len(self.exact_addresses) - 1)
+        matched = self.exact_addresses[positions] == addresses
+        if valid is not None:
+            matched &= valid
+        return np.where(matched, self.exact_slots[positions], -1)
+
+    def longest_prefix_match(self, addresses:np.ndarray, valid:np.ndarray=None) -> np.ndarray:
+        """
+        :return: index of the longest prefix containing each address, -1 where none does.
+        """
+        indexes = np.searchsorted(self.starts, addresses, side='right').astype(np.int64) - 1
+        if valid is not None:
+            indexes[~valid] = -1
+        # Walk up the enclosing prefixes, at most 33 steps as distinct prefixes nest at most 33 deep
+        while True:
+            outside = indexes >= 0
+            outside[outside] = self.ends[indexes[outside]] < addresses[outside]
+            if not outside.any():
+                break
+            indexes[outside] = self.parents[indexes[outside]]
+        return indexes
+
+    def iter_matches(self, ips, chunk_size:int=1 << 20):
+        """
+        Exact match IP addresses chunk by chunk, so that memory stays bounded for any number of IPs.
+
+        :param ips: Iterable of IP address strings.
+        :return: Generator of (ip, ix_id, name) for every matched IP address, in input order.
+        """
+        ips = iter(ips)
+        while True:
+            chunk = list(itertools.islice(ips, chunk_size))
+            if not chunk:
+                return
+            addresses, valid = ips_to_array(chunk)
+            slots = self.exact_match(addresses, valid)
+            matched = np.flatnonzero(slots >= 0)
+            for i, slot in zip(matched.tolist(), slots[matched].tolist()):
+                ix = self.ixs[slot]
+                yield chunk[i], ix['ix_id'], ix['name']
+
+    def export_csv(self, ips, filename:str) -> int:
+        """
+        Write the exact matches to a CSV file, identical to `caida.ip_map_ixp.exportCSV`.
+
+        :return: number of matched IP addresses.
+        """
+        return writeCSV(self.iter_matches(ips), filename)
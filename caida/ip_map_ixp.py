@@ -10,47 +10,97 @@ def findIndex(ip, ixs):
         for x in ixs[i]['prefixes']['ipv4']:
             if ip == x.split('/')[0]:
                 return i
-            
 
-def exportCSV(ips, ixs):
-    data = "ip,ixID,ixName\n"
+
+
+#Look up the IX record of an IP through the index built by parseJSONL:
+def findIX(ip, ipIndex):
+    return ipIndex.get(ip)
+
+
+#Yield the (ip, ixID, ixName) row of every IP matching an IX, as they are matched:
+def matchIXs(ips, ipIndex):
     for ip in ips:
-        if findIndex(ip, ixs) is not None:
-            data += str(ip)
-            data += ','
-            data += str(ixs[findIndex(ip, ixs)]['ix_id'])
-            data += ','
-            data += str(ixs[findIndex(ip, ixs)]['name'])
-            data += '\n'
-    file = open(args.ixp_list, "w")
-    file.write(data)
-
-
-def printIXs(ips:list[str], ixs:dict[str, str]) -> tuple:
+        ix = findIX(ip, ipIndex)
+        if ix is not None:
+            yield ip, ix['ix_id'], ix['name']
+
+
+#Write match rows to a CSV file one at a time, so memory stays bounded however many IPs match:
+def writeCSV(matches, filename):
+    count = 0
+    with open(filename, "w") as file:
+        file.write("ip,ixID,ixName\n")
+        for ip, ixID, ixName in matches:
+            file.write(f"{ip},{ixID},{ixName}\n")
+            count += 1
+    return count
+
+
+#Write match rows to a Parquet or Arrow IPC file in record batches of batchSize rows. Needs pyarrow.
+def writeColumnar(matches, filename, fileFormat="parquet", batchSize=65536):
+    import pyarrow
+
+    schema = pyarrow.schema([('ip', pyarrow.string()), ('ixID', pyarrow.int64()), ('ixName', pyarrow.string())])
+    if fileFormat == "parquet":
+        import pyarrow.parquet
+        writer = pyarrow.parquet.ParquetWriter(filename, schema)
+    elif fileFormat == "arrow":
+        import pyarrow.ipc
+        writer = pyarrow.ipc.new_file(filename, schema)
+    else:
+        raise ValueError(f"Unknown columnar format: {fileFormat}")
+
+    count = 0
+    columns = ([], [], [])
+    with writer:
+        for row in matches:
+            for column, value in zip(columns, row):
+                column.append(value)
+            if len(columns[0]) >= batchSize:
+                writer.write_batch(pyarrow.record_batch(list(columns), schema=schema))
+                count += len(columns[0])
+                columns = ([], [], [])
+        if columns[0]:
+            writer.write_batch(pyarrow.record_batch(list(columns), schema=schema))
+            count += len(columns[0])
+    return count
+
+
+def exportCSV(ips, ipIndex, filename):
+    return writeCSV(matchIXs(ips, ipIndex), filename)
+
+
+def printIXs(ips:list[str], ipIndex:dict[str, dict]) -> tuple:
     for ip in ips:
-        if findIndex(ip, ixs) is not None:
-            return (ip, "|", ixs[findIndex(ip, ixs)]['ix_id'], "|", ixs[findIndex(ip, ixs)]['name'])
+        ix = findIX(ip, ipIndex)
+        if ix is not None:
+            return (ip, "|", ix['ix_id'], "|", ix['name'])
 
 
-#Open ixp jsonl and convert into dictionary entries:
+#Open ixp jsonl and convert into dictionary entries, together with an ip -> ix record index:
 def parseJSONL(ixpJSONL):
     ixs = {}
+    ipIndex = {}
     index = 0
     #Test if file exists.
     try:
         open(ixpJSONL)
     except:
         print("Failed to open file:", ixpJSONL)
-        return
+        return None, None
 
     #Reads every line in JSONL file.
     for line in open(ixpJSONL):
         #Add dictionary index if line is not a comment.
         if line[0] != '#':
             ixs[index] = json.loads(line)
+            #Index every IPv4 prefix address, keeping the first IX that lists it.
+            for x in ixs[index]['prefixes']['ipv4']:
+                ipIndex.setdefault(x.split('/')[0], ixs[index])
             index += 1
-    #Return completed dictionary
-    return ixs
+    #Return completed dictionary and index
+    return ixs, ipIndex
 
 
 #Make IP file into a list of IPs:
@@ -61,40 +111,43 @@ def parseIPs(ipFile):
         print("Failed to open file:", ipFile)
         return
 
-    ips = []
-    for line in open(args.ip_list):
-        ips.append(line.rstrip('\n\r'))
-    return ips
+    return list(iterIPs(ipFile))
+
+
+#Read an IP file lazily, one IP per line:
+def iterIPs(ipFile):
+    with open(ipFile) as file:
+        for line in file:
+            yield line.rstrip('\n\r')
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--in', dest='ip_list', type=str, required=True, help="Path to IP list.")
-    parser.add_argument('-o', '--out', dest='ixp_list', type=str, required=False, help="Path to save as CSV.")
+    parser.add_argument('-o', '--out', dest='ixp_list', type=str, required=False, help="Path to save the matches to.")
     parser.add_argument('-ix', dest='ix_file', type=str, required=True, help="Path to IXP data.")
+    parser.add_argument('-f', '--format', dest='out_format', choices=['csv', 'parquet', 'arrow'], default='csv', required=False,
+                        help="Format of the output file: csv (default), or columnar parquet or arrow (Arrow IPC), which need pyarrow.")
+    parser.add_argument('--bulk', action='store_true', required=False, help="Match with the vectorized NumPy engine (for very large IP lists).")
     args = parser.parse_args()
 
-    ixs = parseJSONL(args.ix_file)
-    ips = parseIPs(args.ip_list)
+    ixs, ipIndex = parseJSONL(args.ix_file)
 
-    #If -o argument is selected export to CSV with selected name and print values to terminal:
-    ip_ixs = {}
+    #If -o argument is selected stream the matches to the output file:
     if args.ixp_list is not None:
-        exportCSV(ips, ixs)
-
-        for ip in ips:
-            ip_ixs[ip] = {
-                'ip' : ip,
-                'name' : ixs[findIndex(ip, ixs)]['name'],
-                'ix_id' : ixs[findIndex(ip, ixs)]['ix_id']
-            }
+        if args.bulk:
+            #The bulk engine matches the same IPs as exportCSV, and is only loaded when asked for as it needs NumPy.
+            from caida.bulk_match import BulkMatcher
+            matches = BulkMatcher(ixs).iter_matches(iterIPs(args.ip_list))
+        else:
+            matches = matchIXs(iterIPs(args.ip_list), ipIndex)
+
+        if args.out_format == 'csv':
+            writeCSV(matches, args.ixp_list)
+        else:
+            writeColumnar(matches, args.ixp_list, args.out_format)
 
     #If -o argument is not selected only print values to terminal:
-    if args.ixp_list is None:
-        for ip in ips:
-            ip_ixs[ip] = {
-                'ip' : ip,
-                'name' : ixs[findIndex(ip, ixs)]['name'],
-                'ix_id' : ixs[findIndex(ip, ixs)]['ix_id']
-            }
-        printIXs(ips, ixs)
\ No newline at end of file
+    else:
+        ips = parseIPs(args.ip_list)
+        printIXs(ips, ipIndex)
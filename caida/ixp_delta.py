@@ -0,0 +1,230 @@
+"""
+Differences between two monthly CAIDA IXP datasets, applied to the matching structures already loaded
+instead of rebuilding them from the new dataset.
+
+    python -m caida.ixp_delta ixs_202307.jsonl ixs_202308.jsonl
+    python -m caida.ixp_delta ixs_202307.jsonl ixs_202308.jsonl -d trace_history.sqlite
+"""
+import os
+import csv
+import sys
+import time
+import bisect
+import logging
+import argparse
+import ipaddress
+
+from caida.ixp_snapshot import IXPSnapshot, load_snapshot
+from util.timing import timed
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+
+def _entries(snapshot:IXPSnapshot) -> dict[tuple, str]:
+    """
+    (start, prefix length, ix_id) of every prefix listed in a snapshot, with the name of its IX.
+    """
+    names = {}
+    entries = {}
+    starts, lengths, ix_slots, ix_ids = snapshot.starts, snapshot.lengths, snapshot.ix_slots, snapshot.ix_ids
+    for index in range(len(snapshot)):
+        ix_slot = ix_slots[index]
+        name = names.get(ix_slot)
+        if name is None:
+            name = names[ix_slot] = snapshot.ix_name(ix_slot)
+        entries[(starts[index], lengths[index], ix_ids[ix_slot])] = name
+    return entries
+
+
+def owner_of(snapshot:IXPSnapshot, start:int, length:int):
+    """
+    IX record a prefix is matched to in a snapshot, or None if no IX lists it.
+    A prefix listed by several IXs is matched to the last one in the dataset, as by `IXPSnapshot.lookup`.
+    """
+    index = bisect.bisect_left(snapshot.starts, start)
+    best = None
+    while index < len(snapshot) and snapshot.starts[index] == start:
+        if snapshot.lengths[index] == length and (best is None or snapshot.ix_slots[index] > best):
+            best = snapshot.ix_slots[index]
+        index += 1
+    return None if best is None else snapshot.ix_record(best)
+
+
+def _prefix_string(start:int, length:int) -> str:
+    return f"{ipaddress.IPv4Address(start)}/{length}"
+
+
+class SnapshotDelta:
+    """
+    Prefixes added, removed and changed between two snapshots, compared by ix_id and prefix.
+
+    added: (prefix, ix_id, name) listed by an IX in the new snapshot only
+    removed: (prefix, ix_id, name) listed by an IX in the old snapshot only
+    changed: (prefix, ix_id, old name, new name) listed by the same IX in both, which was renamed
+    owners: IX record each of these prefixes is matched to in the new snapshot, None if it is gone
+
+    :param old_checksum, new_checksum: checksums of the datasets the snapshots were compiled from.
+    """
+
+    def __init__(self, old_checksum:bytes, new_checksum:bytes):
+        self.old_checksum = old_checksum
+        self.new_checksum = new_checksum
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.owners = {}
+        self._ranges = []
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def ranges(self) -> list[tuple[int, int]]:
+        """
+        Sorted, disjoint (first address, last address) ranges covering every prefix of the delta:
+        the addresses whose match may differ between the two snapshots.
+        """
+        return self._ranges
+
+    def summary(self) -> dict[str, int]:
+        return {'added': len(self.added), 'removed': len(self.removed), 'changed': len(self.changed),
+                'prefixes': len(self.owners), 'ranges': len(self._ranges)}
+
+    def rows(self) -> list[tuple]:
+        """
+        Changes as (change, prefix, ix_id, old name, new name) rows, in prefix order.
+        """
+        rows = [("added", prefix, ix_id, None, name) for prefix, ix_id, name in self.added]
+        rows += [("removed", prefix, ix_id, name, None) for prefix, ix_id, name in self.removed]
+        rows += [("changed", prefix, ix_id, old_name, new_name) for prefix, ix_id, old_name, new_name in self.changed]
+        return sorted(rows, key=lambda row: (ipaddress.IPv4Network(row[1]), row[2]))
+
+    def apply_to_trie(self, trie) -> None:
+        """
+        Bring a `caida.map_ixp.PrefixTrie` built from the old dataset up to date with the new one.
+        """
+        for prefix, owner in self.owners.items():
+            if owner is None:
+                trie.remove(prefix)
+            else:
+                trie.insert(prefix, owner['name'])
+
+
+@timed(category="load")
+def diff_snapshots(old:IXPSnapshot, new:IXPSnapshot) -> SnapshotDelta:
+    """
+    Compare two snapshots by ix_id and prefix.
+
+    Only the compiled arrays are read, so the datasets are not parsed again.
+    """
+    delta = SnapshotDelta(old.checksum, new.checksum)
+    if old.checksum == new.checksum:
+        return delta
+
+    old_entries, new_entries = _entries(old), _entries(new)
+    touched = set()
+    for key, name in new_entries.items():
+        old_name = old_entries.get(key)
+        start, length, ix_id = key
+        if old_name is None:
+            delta.added.append((_prefix_string(start, length), ix_id, name))
+        elif old_name != name:
+            delta.changed.append((_prefix_string(start, length), ix_id, old_name, name))
+        else:
+            continue
+        touched.add((start, length))
+    for key, name in old_entries.items():
+        if key not in new_entries:
+            start, length, ix_id = key
+            delta.removed.append((_prefix_string(start, length), ix_id, name))
+            touched.add((start, length))
+
+    # Nested prefixes are merged into the range of the outermost one
+    ranges = []
+    for start, length in sorted(touched):
+        delta.owners[_prefix_string(start, length)] = owner_of(new, start, length)
+        end = start + (1 << (32 - length)) - 1
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    delta._ranges = ranges
+    return delta
+
+
+class SnapshotWatcher:
+    """
+    Follow a dataset file that is replaced every month, e.g. a `ixs_latest.jsonl` link to the latest
+    `ixs_yyyymm.jsonl`, for a long running process.
+
+    `poll` loads the new snapshot when the file changed, and applies the delta from the current one to
+    the trace store: the store matches the next traces against the new snapshot, and re-matches only
+    the recorded hops inside the changed prefixes.
+
+    :param jsonl_file_name: path of the dataset file.
+    :param trace_store: `util.trace_store.TraceStore` matching its traces against the dataset.
+    """
+
+    def __init__(self, jsonl_file_name:str, trace_store):
+        self.jsonl_file_name = jsonl_file_name
+        self.trace_store = trace_store
+        self._stat = self._stat_of()
+
+    def _stat_of(self):
+        try:
+            status = os.stat(self.jsonl_file_name)
+        except OSError:
+            return None
+        return (status.st_ino, status.st_size, status.st_mtime_ns)
+
+    def poll(self):
+        """
+        :return: the delta applied, or None if the dataset did not change.
+        """
+        stat = self._stat_of()
+        if stat is None or stat == self._stat:
+            return None
+        self._stat = stat
+        current = self.trace_store.ixp_snapshot
+
+        started = time.perf_counter()
+        # The snapshot is named after the file the link points to. It only hashes the dataset if it
+        # has to compile it, or if its size or mtime changed since it was compiled.
+        snapshot = load_snapshot(os.path.realpath(self.jsonl_file_name))
+        if current is not None and snapshot.checksum == current.checksum:
+            snapshot.close()
+            return None
+        delta = diff_snapshots(current, snapshot) if current is not None else None
+        self.trace_store.set_ixp_snapshot(snapshot, delta)
+        if current is not None:
+            current.close()
+        logger.info(f"IXP dataset {self.jsonl_file_name} reloaded in {time.perf_counter() - started:.2f} s"
+                    + (f": {delta.summary()}" if delta is not None else ""))
+        return delta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two CAIDA IXP datasets by ix_id and prefix.")
+    parser.add_argument('old', type=str, help="Previous dataset, ixs_yyyymm.jsonl")
+    parser.add_argument('new', type=str, help="New dataset, ixs_yyyymm.jsonl")
+    parser.add_argument('-d', dest='database', type=str, required=False,
+                        help="Trace history to re-match against the new dataset, see `python -m util.trace_store -h`")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    old_snapshot, new_snapshot = load_snapshot(args.old), load_snapshot(args.new)
+    started = time.perf_counter()
+    delta = diff_snapshots(old_snapshot, new_snapshot)
+    print(f"{delta.summary()} in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+    if args.database:
+        from util.trace_store import TraceStore
+        started = time.perf_counter()
+        with TraceStore(args.database, old_snapshot) as store:
+            rematched = store.set_ixp_snapshot(new_snapshot, delta)
+        print(f"{rematched} hops re-matched in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['Change', 'Prefix', 'ix_id', 'Old Name', 'New Name'])
+        writer.writerows(delta.rows())
+    old_snapshot.close()
+    new_snapshot.close()
@@ -0,0 +1,293 @@
+"""
+Compiled, memory-mapped snapshot of a CAIDA `ixs_yyyymm.jsonl` dataset.
+
+Layout (native byte order, every section padded to 4 bytes):
+    header      magic, byte order mark, SHA-256, size and mtime of the source JSONL, counts
+    starts      uint32[n_prefixes]  first address of each prefix, sorted
+    ends        uint32[n_prefixes]  last address of each prefix
+    parents     int32[n_prefixes]   index of the enclosing prefix, -1 if none
+    ix_slots    uint32[n_prefixes]  position of the owning IX in the JSONL file
+    lengths     uint8[n_prefixes]   prefix length
+    ix_ids      int32[n_ixs]        CAIDA ix_id of each IX
+    name_offs   uint32[n_ixs + 1]   offsets of each IX name in the string table
+    strings     utf-8 IX names
+"""
+import os
+import json
+import mmap
+import array
+import bisect
+import struct
+import hashlib
+import argparse
+import ipaddress
+
+from util.timing import timed
+
+
+MAGIC = b"IXPSNAP2"
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct("=8sI32sQqIII")
+# Offset of the source size and mtime in the header, refreshed in place when only the mtime of the JSONL changed
+SOURCE_STAT = struct.Struct("=Qq")
+SOURCE_STAT_OFFSET = struct.calcsize("=8sI32s")
+
+
+def _pad(length:int) -> int:
+    return (length + 3) & ~3
+
+
+def checksum_of(jsonl_file_name:str) -> bytes:
+    """
+    SHA-256 digest of the JSONL file, used to detect a stale snapshot.
+    """
+    digest = hashlib.sha256()
+    with open(jsonl_file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def source_stat_of(jsonl_file_name:str) -> tuple[int, int]:
+    """
+    (size, mtime in ns) of the JSONL file, so that a snapshot is only hashed again when they differ.
+    """
+    status = os.stat(jsonl_file_name)
+    return status.st_size, status.st_mtime_ns
+
+
+def default_snapshot_path(jsonl_file_name:str) -> str:
+    root, _ = os.path.splitext(jsonl_file_name)
+    return f"{root}.ixsnap"
+
+
+def compile_snapshot(jsonl_file_name:str, snapshot_file_name:str=None) -> str:
+    """
+    Compile a CAIDA IXP JSONL file into a binary snapshot.
+
+    :param jsonl_file_name: path of the `ixs_yyyymm.jsonl` file.
+    :param snapshot_file_name: output path, defaults to `ixs_yyyymm.ixsnap`.
+    :return: path of the written snapshot.
+    """
+    snapshot_file_name = snapshot_file_name or default_snapshot_path(jsonl_file_name)
+    # Taken before reading, so that a file changed while it is compiled is hashed again on the next load
+    source_stat = source_stat_of(jsonl_file_name)
+
+    ix_ids = array.array('i')
+    names = []
+    entries = []
+    with open(jsonl_file_name, 'r') as file:
+        for line in file:
+            if not line.strip() or line[0] == '#':
+                continue
+            data = json.loads(line)
+            ix_slot = len(ix_ids)
+            ix_ids.append(int(data.get("ix_id", -1)))
+            names.append(str(data.get("name", None)))
+            for prefix in data.get("prefixes", {}).get("ipv4", []):
+                try:
+                    network = ipaddress.IPv4Network(prefix, strict=False)
+                except ValueError:
+                    continue
+                entries.append((int(network.network_address), network.prefixlen, ix_slot, int(network.broadcast_address)))
+    return write_snapshot(snapshot_file_name, checksum_of(jsonl_file_name), entries, ix_ids, names, source_stat)
+
+
+def write_snapshot(snapshot_file_name:str, checksum:bytes, entries:list[tuple], ix_ids, names:list[str],
+                   source_stat:tuple[int, int]=(0, 0)) -> str:
+    """
+    Write (start, length, ix_slot, end) prefix entries and the IX table to a snapshot file.
+
+    :param source_stat: (size, mtime in ns) of the source JSONL, (0, 0) if there is none.
+    """
+    # More specific prefixes sort after the prefixes that enclose them
+    entries = sorted(entries)
+
+    starts = array.array('I')
+    ends = array.array('I')
+    parents = array.array('i')
+    ix_slots = array.array('I')
+    lengths = bytearray()
+    stack = []
+    for index, (start, length, ix_slot, end) in enumerate(entries):
+        while stack and ends[stack[-1]] < start:
+            stack.pop()
+        parent = stack[-1] if stack else -1
+        # Prefixes listed by several IXs link straight to the prefix enclosing all of them
+        if parent >= 0 and starts[parent] == start and ends[parent] == end:
+            parent = parents[parent]
+        starts.append(start)
+        ends.append(end)
+        parents.append(parent)
+        ix_slots.append(ix_slot)
+        lengths.append(length)
+        stack.append(index)
+
+    strings = bytearray()
+    name_offsets = array.array('I', [0])
+    for name in names:
+        strings += name.encode('utf-8')
+        name_offsets.append(len(strings))
+
+    header = HEADER.pack(MAGIC, BYTE_ORDER_MARK, checksum, *source_stat, len(entries), len(ix_ids), len(strings))
+
+    # Write to a temporary file first so that concurrent readers never see a partial snapshot
+    temporary_file_name = f"{snapshot_file_name}.{os.getpid()}.tmp"
+    with open(temporary_file_name, 'wb') as file:
+        for section in (header, starts.tobytes(), ends.tobytes(), parents.tobytes(), ix_slots.tobytes(),
+                        bytes(lengths), ix_ids.tobytes(), name_offsets.tobytes(), bytes(strings)):
+            file.write(section)
+            file.write(b'\0' * (_pad(len(section)) - len(section)))
+    os.replace(temporary_file_name, snapshot_file_name)
+    return snapshot_file_name
+
+
+class IXPSnapshot:
+    """
+    Read-only view over a compiled snapshot. Nothing is parsed on load: the arrays are
+    memoryviews into the mapped file, so processes loading the same snapshot share pages.
+    """
+
+    def __init__(self, snapshot_file_name:str):
+        self.snapshot_file_name = snapshot_file_name
+        with open(snapshot_file_name, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._mmap)
+        (magic, byte_order_mark, self.checksum, source_size, source_mtime,
+         n_prefixes, n_ixs, strings_len) = HEADER.unpack_from(view, 0)
+        self.source_stat = (source_size, source_mtime)
+        if magic != MAGIC or byte_order_mark != BYTE_ORDER_MARK:
+            view.release()
+            self._mmap.close()
+            raise ValueError(f"{snapshot_file_name} is not a compatible IXP snapshot")
+
+        offset = _pad(HEADER.size)
+
+        def section(length:int, fmt:str) -> memoryview:
+            nonlocal offset
+            data = view[offset:offset + length]
+            offset += _pad(length)
+            return data.cast(fmt) if fmt != 'B' else data
+
+        self.starts = section(4 * n_prefixes, 'I')
+        self.ends = section(4 * n_prefixes, 'I')
+        self.parents = section(4 * n_prefixes, 'i')
+        self.ix_slots = section(4 * n_prefixes, 'I')
+        self.lengths = section(n_prefixes, 'B')
+        self.ix_ids = section(4 * n_ixs, 'i')
+        self.name_offsets = section(4 * (n_ixs + 1), 'I')
+        self.strings = section(strings_len, 'B')
+        self._views = [view, self.starts, self.ends, self.parents, self.ix_slots, self.lengths,
+                       self.ix_ids, self.name_offsets, self.strings]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def close(self) -> None:
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+    def ix_name(self, ix_slot:int) -> str:
+        return bytes(self.strings[self.name_offsets[ix_slot]:self.name_offsets[ix_slot + 1]]).decode('utf-8')
+
+    def ix_record(self, ix_slot:int) -> dict:
+        return {'ix_id': self.ix_ids[ix_slot], 'name': self.ix_name(ix_slot)}
+
+    def prefix_string(self, index:int) -> str:
+        return f"{ipaddress.IPv4Address(self.starts[index])}/{self.lengths[index]}"
+
+    def find_ix(self, ip:str):
+        """
+        Exact matching: the IX record of the first IX (in file order) listing a prefix whose
+        address equals ip, as `caida.ip_map_ixp.findIX` does. None if no IX matches.
+        """
+        try:
+            address = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return None
+        index = bisect.bisect_left(self.starts, address)
+        best = None
+        while index < len(self.starts) and self.starts[index] == address:
+            if best is None or self.ix_slots[index] < best:
+                best = self.ix_slots[index]
+            index += 1
+        return None if best is None else self.ix_record(best)
+
+    def lookup(self, ip:str):
+        """
+        Index of the longest prefix containing ip, or None.
+        """
+        try:
+            address = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return None
+        # The longest match is the rightmost prefix starting at or before the address,
+        # or one of the prefixes enclosing it.
+        index = bisect.bisect_right(self.starts, address) - 1
+        while index >= 0:
+            if self.ends[index] >= address:
+                return index
+            index = self.parents[index]
+        return None
+
+    def match(self, ip:str) -> dict:
+        """
+        Longest prefix match in the same format as `caida.map_ixp.longest_prefix_match`.
+        """
+        index = self.lookup(ip)
+        if index is None:
+            return {
+                "Input IP": ip,
+                "Matched IPv4": "NIL",
+                "Name": "NIL"
+            }
+        return {
+            "Input IP": ip,
+            "Matched IPv4": self.prefix_string(index),
+            "Name": self.ix_name(self.ix_slots[index])
+        }
+
+    def match_many(self, ips:list[str]) -> list[dict]:
+        return [self.match(ip) for ip in ips]
+
+
+@timed(category="load")
+def load_snapshot(jsonl_file_name:str, snapshot_file_name:str=None) -> IXPSnapshot:
+    """
+    Map the snapshot of a JSONL file, compiling it first if it is missing or if the
+    JSONL file has changed since it was compiled.
+
+    The JSONL file is only hashed when its size or mtime differ from those recorded in the snapshot.
+    """
+    snapshot_file_name = snapshot_file_name or default_snapshot_path(jsonl_file_name)
+    source_stat = source_stat_of(jsonl_file_name)
+    try:
+        snapshot = IXPSnapshot(snapshot_file_name)
+        if snapshot.source_stat == source_stat:
+            return snapshot
+        if snapshot.checksum == checksum_of(jsonl_file_name):
+            # Touched or copied but unchanged: record the new mtime rather than compiling again
+            snapshot.close()
+            with open(snapshot_file_name, 'r+b') as file:
+                file.seek(SOURCE_STAT_OFFSET)
+                file.write(SOURCE_STAT.pack(*source_stat))
+            return IXPSnapshot(snapshot_file_name)
+        snapshot.close()
+    except (OSError, ValueError, struct.error):
+        pass
+    compile_snapshot(jsonl_file_name, snapshot_file_name)
+    return IXPSnapshot(snapshot_file_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a CAIDA IXP dataset into a memory-mapped snapshot.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compile_parser = subparsers.add_parser('compile', help="Compile a JSONL dataset.")
+    compile_parser.add_argument('-ix', dest='ix_file', type=str, required=True, help="Path to IXP data.")
+    compile_parser.add_argument('-o', '--out', dest='snapshot_file', type=str, required=False, help="Path to save the snapshot.")
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        print(compile_snapshot(args.ix_file, args.snapshot_file))
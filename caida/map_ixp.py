@@ -1,6 +1,8 @@
 import json
 import ipaddress
-import subprocess
+
+from util.timing import timed
+from util.whois_client import whois
 
 def extract_ipv4_name_dict_from(jsonl_file_name:str) -> dict:
     result_dict = {}
@@ -23,7 +25,7 @@ def longest_prefix_match(ip: str, prefix_dict:dict) -> dict:
     target_ip = ipaddress.ip_address(ip)
     
     # Sort the prefixes by length in descending order for longest match
-    sorted_prefixes = sorted(prefix_dict.keys(), key=lambda x: x.split('/')[1], reverse=True)
+    sorted_prefixes = sorted(prefix_dict.keys(), key=lambda x: int(x.split('/')[1]), reverse=True)
     
     for prefix in sorted_prefixes:
         network = ipaddress.ip_network(prefix, strict=False)
@@ -33,19 +35,130 @@ def longest_prefix_match(ip: str, prefix_dict:dict) -> dict:
                 "Matched IPv4": prefix,
                 "Name": prefix_dict[prefix]
             }
-        else:
+
+    return {
+        "Input IP": ip, 
+        "Matched IPv4": "NIL",
+        "Name": "NIL"
+    }
+
+
+class PrefixTrie:
+    """
+    Binary radix trie over IPv4 prefixes for longest prefix matching.
+
+    Each node is a list of [zero_child, one_child, (prefix, name)], so a lookup walks
+    at most 32 nodes regardless of how many prefixes have been loaded.
+    """
+
+    def __init__(self, prefix_dict:dict=None):
+        self.root = [None, None, None]
+        self.size = 0
+        for prefix, name in (prefix_dict or {}).items():
+            self.insert(prefix, name)
+
+    @classmethod
+    @timed(category="load")
+    def from_jsonl(cls, jsonl_file_name:str) -> "PrefixTrie":
+        return cls(extract_ipv4_name_dict_from(jsonl_file_name))
+
+    def insert(self, prefix:str, name:str) -> None:
+        """
+        Insert an IPv4 prefix (e.g. "206.51.34.0/24") with the name it maps to.
+        """
+        try:
+            network = ipaddress.IPv4Network(prefix, strict=False)
+        except ValueError:
+            return
+        address = int(network.network_address)
+        node = self.root
+        for shift in range(31, 31 - network.prefixlen, -1):
+            bit = (address >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            self.size += 1
+        node[2] = (prefix, name)
+
+    def remove(self, prefix:str) -> bool:
+        """
+        Remove an IPv4 prefix, and the nodes left without any prefix below them.
+
+        :return: True if the prefix was in the trie.
+        """
+        try:
+            network = ipaddress.IPv4Network(prefix, strict=False)
+        except ValueError:
+            return False
+        address = int(network.network_address)
+        path = []
+        node = self.root
+        for shift in range(31, 31 - network.prefixlen, -1):
+            bit = (address >> shift) & 1
+            if node[bit] is None:
+                return False
+            path.append((node, bit))
+            node = node[bit]
+        if node[2] is None:
+            return False
+        node[2] = None
+        self.size -= 1
+        while path and node[0] is None and node[1] is None and node[2] is None:
+            parent, bit = path.pop()
+            parent[bit] = None
+            node = parent
+        return True
+
+    def lookup(self, ip:str):
+        """
+        Return the (prefix, name) pair of the longest prefix containing ip, or None.
+        """
+        try:
+            address = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return None
+        node = self.root
+        best = node[2]
+        shift = 31
+        while shift >= 0:
+            node = node[(address >> shift) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                best = node[2]
+            shift -= 1
+        return best
+
+    def match(self, ip:str) -> dict:
+        """
+        Longest prefix match of a single IP, in the same format as `longest_prefix_match`.
+        """
+        best = self.lookup(ip)
+        if best is None:
             return {
                 "Input IP": ip, 
                 "Matched IPv4": "NIL",
                 "Name": "NIL"
             }
+        return {
+            "Input IP": ip, 
+            "Matched IPv4": best[0],
+            "Name": best[1]
+        }
+
+    def match_many(self, ips:list[str]) -> list[dict]:
+        """
+        Longest prefix match of a batch of IPs, preserving the input order.
+        """
+        return [self.match(ip) for ip in ips]
 
 
+@timed("whois", "network")
 def get_organization(ip:str)->str:
     try:
-        # Run the whois command and get the output
-        result = subprocess.run(['whois', ip], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result_str = result.stdout.decode('utf-8')
+        # Query the whois record
+        result_str = whois(ip)
 
         # Split the result into lines and look for 'organisation:'
         for line in result_str.split('\n'):
@@ -1,104 +1,227 @@
 from datetime import datetime
+from contextlib import contextmanager
+import os
 import logging
 import argparse
 
-from util.speed_test import ping_test, speed_test
-from util.trace_route import trace_route, get_locations
-from util.network import get_wifi_info_macos
-from util.gpt_whois import identify_org_details, filter_private_ips, integrate_ip_info
+from util.speed_test import ping_test_async, speed_test
+from util.trace_route import LocationClient
+from util.network import get_wifi_info_macos_async
+from util.gpt_whois import OrgResolver, integrate_ip_info
+from util.llm_batch import LLMBatcher
+from util.llm_cache import LLMCache
+from util.pipeline import trace_and_enrich_async
+from util.batch import read_targets, run_batch
+from util.monitor import PathMonitor
 from util.csv_helper import write_summary_stats_to, write_ip_info
+from util.org_cache import OrgCache
+from util.trace_store import TraceStore
+from util import whois_client
+from util import timing
+from util.timing import span
 
 # Create a logger 
 logger = logging.getLogger()
-# Set Logging level 
-logger.setLevel(logging.INFO)
 
 # Get the current date and time and format it as desired for the log filename
 time_stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 log_filename = f"{time_stamp}.log"
 output_filename = f"{time_stamp}_"
 
-# Create a file handler for writing the logs to a file
-file_handler = logging.FileHandler(log_filename)
-file_handler.setFormatter(logging.Formatter("%(asctime)s: %(funcName)s(): %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
 
-# Create a stream handler for writing the logs to the console
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(logging.Formatter("%(asctime)s: %(funcName)s(): %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+def configure_logging(log_filename:str) -> None:
+    """
+    Log to the console and to log_filename. Called when the program starts rather than on import,
+    so that importing main neither creates a log file nor changes the logging of the importer.
+    """
+    # Set Logging level 
+    logger.setLevel(logging.INFO)
+
+    # Create a file handler for writing the logs to a file
+    file_handler = logging.FileHandler(log_filename)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s: %(funcName)s(): %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+
+    # Create a stream handler for writing the logs to the console
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s: %(funcName)s(): %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+
+    # Add the handlers to the logger
+    logger.addHandler(file_handler)
+    logger.addHandler(stream_handler)
+
 
-# Add the handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+@contextmanager
+def lookup_services(org_cache_filename:str=None, llm_cache_filename:str=None, max_workers:int=4, fast_path:bool=True,
+                    llm_api_base:str=None):
+    """
+    Create the location client and organization resolver, with their caches, shared by every trace of a run.
+
+    :return: context manager of (location_client, org_resolver), logging the cache statistics on exit.
+        If the block raises, e.g. when a stage is cancelled, the lookups in flight are abandoned rather
+        than waited for, so that an event loop closing them is not blocked.
+    """
+    org_cache = OrgCache(org_cache_filename) if org_cache_filename else None
+    llm_cache = LLMCache(llm_cache_filename) if llm_cache_filename else None
+    llm_batcher = LLMBatcher(api_base=llm_api_base)
+    completed = False
+    try:
+        with LocationClient() as location_client, OrgResolver(org_cache, max_workers, fast_path, llm_batcher, llm_cache) as org_resolver:
+            yield location_client, org_resolver
+        completed = True
+        logger.info(f"Whois parsing: {org_resolver.stats()}, GPT: {llm_batcher.stats()}")
+        logger.info(f"Whois queries: {whois_client.get_client().stats()}")
+    finally:
+        llm_batcher.close(wait=completed)
+        if llm_cache is not None:
+            logger.info(f"GPT summary cache: {llm_cache.stats()}")
+            llm_cache.close()
+        if org_cache is not None:
+            logger.info(f"Organization cache: {org_cache.stats()}")
+            org_cache.close()
 
+# Seconds each stage of main may take before it is cancelled, overridden with --stage-timeout STAGE=SECONDS
+STAGE_TIMEOUTS = {
+    'wifi_info': 10,
+    'speed_test': 120,
+    'ping_test': 30,
+    'trace_and_enrich': 600,
+    'write_results': 60
+}
+
+def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool, engine:str="system", trace_store:TraceStore=None,
+         stage_timeouts:dict=None, **lookup_options) -> None:
+    """
+    Run the stages of a single trace concurrently: the WiFi information, ping test and traceroute
+    start together, and the speed test once the SSID is known. The results are written once every
+    stage is done, so the run takes about as long as its slowest stage rather than the sum of them.
+    Each stage is cancelled after its timeout (STAGE_TIMEOUTS), and all of them on Ctrl+C.
+    """
+    import asyncio
+    from util.orchestrator import Stage, run_stages, run_until_interrupted, run_in_thread
 
-def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool) -> None:
     target_url = target_url or "cmu.edu"
-    # Get the WiFi information
+    stage_timeouts = {**STAGE_TIMEOUTS, **(stage_timeouts or {})}
     logger.info("------------------------------------------------------------")
-    logger.info(f"Getting WiFi Information: ")
-    network_info = get_wifi_info_macos()
-    for key, value in network_info.items():
-        logger.info(f"{key}: {value}")
+    logger.info(f"Target URL: {target_url}")
     logger.info("------------------------------------------------------------")
 
-    # Speed Test
-    download, upload = ("NA", "NA")
-    if speed_test_flag: 
-        logger.info(f"Testing network speed for: {network_info['SSID']}")
-        download, upload = speed_test()
+    # Get the WiFi information
+    async def wifi_info():
+        network_info = await get_wifi_info_macos_async()
+        for key, value in network_info.items():
+            logger.info(f"{key}: {value}")
+        return network_info
+
+    # Speed Test, in a thread as speedtest only blocks. Its traffic shares the link with the ping
+    # test and traceroute running meanwhile, and may add to the latencies they measure
+    async def run_speed_test(wifi_info):
+        logger.info(f"Testing network speed for: {wifi_info['SSID']}")
+        download, upload = await run_in_thread(speed_test)
         logger.info(f"Download Speed: {download:.2f} Mbps")
         logger.info(f"Upload Speed: {upload:.2f} Mbps")
-        logger.info("------------------------------------------------------------")
-
+        return download, upload
 
-    logger.info(f"Target URL: {target_url}")
-    logger.info("------------------------------------------------------------")
-    
-    
     # Ping Test
-    latency = "NA"
-    if ping_test_flag: 
+    async def run_ping_test():
         logger.info(f"Ping Test to {target_url}")
-        latency = ping_test(target_url)
+        latency = await ping_test_async(target_url)
         if latency:
             logger.info(f"Average latency to {target_url} is: {latency} ms")
+        return latency
+
+    # Trace Route, the location and organization of each hop are looked up while traceroute is still running
+    async def run_trace_and_enrich():
+        logger.info(f"Trace Route to {target_url}")
+        with lookup_services(**lookup_options) as (location_client, org_resolver):
+            return await trace_and_enrich_async(target_url, location_client, org_resolver, engine)
+
+    async def write_results(speed_test=("NA", "NA"), ping_test="NA", trace_and_enrich=([], [], 0)):
+        download, upload = speed_test
+        latency = ping_test
+        hops, org_record_list, hop_count = trace_and_enrich
+
+        logger.info("List of hops identified and their locations: ")
+        for hop in hops:
+            logger.info(f"{hop.ip_address} : {hop.location}")
+
+        # Write summary stats into csv file
+        write_summary_stats_to(f"{output_filename}summary.csv", download, upload, latency, hop_count)
+
         logger.info("------------------------------------------------------------")
 
-    # Trace Route
-    logger.info(f"Trace Route to {target_url}")
-    identified_hops, hop_count = trace_route(target_url)
+        """
+        Analyse IXPs between orgs (Deduce from `whois` query)
+        """
+        # Find out the organization which the ip address belongs to. 
+        logger.info("List of hops identified and their organization with whois and GPT: ")
+        for org_record in org_record_list:
+            logger.info(f"{org_record.network_range} : {org_record.organization}")
 
-    # filter out the private ip addresses 
-    public_ip_address_list = filter_private_ips(identified_hops)
+        logger.info(f"Recording the organizations found to a {output_filename}summary.csv")
 
-    ip_address_location_list = get_locations(public_ip_address_list) 
-    logger.info("------------------------------------------------------------")
-    
-    logger.info("List of hops identified and their locations: ")
-    for ip_address, location in ip_address_location_list:
-        logger.info(f"{ip_address} : {location}")
+        with span("integrate_ip_info"):
+            hops = integrate_ip_info(hops, org_record_list)
 
-    # Write summary stats into csv file
-    write_summary_stats_to(f"{output_filename}summary.csv", download, upload, latency, hop_count)
+        write_ip_info(f"{output_filename}summary.csv", hops)
+        if trace_store is not None:
+            trace_store.add_trace(target_url, hops, hop_count, download=download, upload=upload, latency=latency)
 
+    stages = [
+        Stage('wifi_info', wifi_info, timeout=stage_timeouts['wifi_info'], default={'SSID': None, 'IPv4 Address': None}),
+        Stage('trace_and_enrich', run_trace_and_enrich, timeout=stage_timeouts['trace_and_enrich'], default=([], [], 0))
+    ]
+    if speed_test_flag:
+        stages.append(Stage('speed_test', run_speed_test, depends_on=['wifi_info'], timeout=stage_timeouts['speed_test'],
+                            default=("NA", "NA"), skip_on_failure=False))
+    if ping_test_flag:
+        # A failed ping gives None, written as an empty latency as before
+        stages.append(Stage('ping_test', run_ping_test, timeout=stage_timeouts['ping_test'], default=None))
+    # The results are written even if the speed test or the ping test failed, with what is known
+    stages.append(Stage('write_results', write_results, depends_on=[stage.name for stage in stages if stage.name != 'wifi_info'],
+                        timeout=stage_timeouts['write_results'], skip_on_failure=False))
+
+    try:
+        run_until_interrupted(run_stages(stages))
+    except asyncio.CancelledError:
+        logger.error("Keyboard Interrupted. Stages cancelled, nothing written for this run. ")
+        return
     logger.info("------------------------------------------------------------")
 
-    """
-    Analyse IXPs between orgs (Deduce from `whois` query)
-    """
-    # Find out the organization which the ip address belongs to. 
-    logger.info("List of hops identified and their organization with whois and GPT: ")
+def batch_main(targets_filename:str, batch_output_filename:str, max_parallel:int, resume:bool, engine:str="system",
+               trace_store:TraceStore=None, **lookup_options) -> None:
+    targets = read_targets(targets_filename)
+    batch_output_filename = batch_output_filename or f"{output_filename}batch_summary.csv"
+    logger.info("------------------------------------------------------------")
+    logger.info(f"Batch Trace Route to {len(targets)} targets from {targets_filename}, {max_parallel} at a time")
+    logger.info("------------------------------------------------------------")
 
-    org_detail_list = identify_org_details(public_ip_address_list)
+    # One cache and one set of lookup pools shared by every target
+    with span("batch", targets=len(targets)), lookup_services(**lookup_options) as (location_client, org_resolver):
+        hop_counts = run_batch(targets, batch_output_filename, location_client, org_resolver, max_parallel, resume, engine,
+                               trace_store)
 
-    logger.info(f"Recording the organizations found to a {output_filename}summary.csv")
+    logger.info("------------------------------------------------------------")
+    logger.info(f"{len(hop_counts)} targets recorded to {batch_output_filename}")
+    logger.info("------------------------------------------------------------")
 
-    data: list[list[str]] = integrate_ip_info(ip_address_location_list, org_detail_list)
-    
-    write_ip_info(f"{output_filename}summary.csv", data)
-    
+def monitor_main(targets:list[str], interval:float, events_filename:str, max_parallel:int, iterations:int=None,
+                 rtt_threshold:float=None, engine:str="system", trace_store:TraceStore=None, ixp_dataset:str=None,
+                 **lookup_options) -> None:
+    events_filename = events_filename or f"{output_filename}events.jsonl"
+    logger.info("------------------------------------------------------------")
+    logger.info(f"Monitoring the paths to {len(targets)} targets every {interval:g} s, path changes recorded to {events_filename}")
     logger.info("------------------------------------------------------------")
 
+    # A new dataset written to the -x file (e.g. a link to the latest ixs_yyyymm.jsonl) is applied between rounds
+    ixp_watcher = None
+    if ixp_dataset and trace_store is not None:
+        from caida.ixp_delta import SnapshotWatcher
+        ixp_watcher = SnapshotWatcher(ixp_dataset, trace_store)
+
+    with lookup_services(**lookup_options) as (location_client, org_resolver):
+        monitor = PathMonitor(location_client, org_resolver, events_filename, engine, rtt_threshold, trace_store, ixp_watcher)
+        monitor.run(targets, interval, max_parallel, iterations)
+
 if __name__ == "__main__":
     
     # Set up the argument flags 
@@ -106,19 +229,96 @@ if __name__ == "__main__":
     parser.add_argument('-u', dest='target_url', type=str, required=False, help="Target URL for investigation")
     parser.add_argument('-s', action='store_true', required=False, help="Perform Speed Test for current network")
     parser.add_argument('-p', action='store_true', required=False, help="Perform Ping Test to target URL")
+    parser.add_argument('-c', dest='org_cache', type=str, default="org_cache.sqlite", help="Organization cache file, shared across runs")
+    parser.add_argument('--llm-cache', dest='llm_cache', type=str, default="llm_cache.sqlite", help="Cache file of GPT whois summaries, shared across runs")
+    parser.add_argument('--no-cache', action='store_true', required=False, help="Do not use the organization and GPT summary caches")
+    parser.add_argument('-w', dest='max_workers', type=int, default=4, help="Number of whois lookups run concurrently")
+    parser.add_argument('--no-fast-path', action='store_true', required=False, help="Send every whois response to GPT instead of parsing it first")
+    parser.add_argument('--llm-api-base', dest='llm_api_base', type=str, required=False, help="OpenAI compatible API endpoint, e.g. a local stub server")
+    parser.add_argument('-e', dest='engine', choices=['system', 'probe'], default="system", help="Traceroute engine: the traceroute command, or the in-process prober (needs root)")
+    parser.add_argument('-f', dest='targets_file', type=str, required=False, help="File of target URLs, one per line, for a batch run")
+    parser.add_argument('-j', dest='max_parallel', type=int, default=4, help="Number of traceroutes run concurrently in a batch run")
+    parser.add_argument('-o', dest='batch_output', type=str, required=False, help="Combined summary CSV file of a batch run")
+    parser.add_argument('--resume', action='store_true', required=False, help="Resume an interrupted batch run into the same -o file")
+    parser.add_argument('-m', '--monitor', dest='monitor_interval', type=float, required=False, help="Keep re-tracing the targets (-u or -f) every this many seconds, recording path changes")
+    parser.add_argument('--events', dest='events_file', type=str, required=False, help="JSONL file the path changes of the monitor are appended to")
+    parser.add_argument('--rounds', dest='monitor_rounds', type=int, required=False, help="Stop monitoring after this many rounds")
+    parser.add_argument('--rtt-threshold', dest='rtt_threshold', type=float, required=False, help="Also record RTT changes of this many ms or more on unchanged paths")
+    parser.add_argument('--history', dest='history', type=str, default="trace_history.sqlite", help="Database every trace is recorded to, see `python -m util.trace_store -h`")
+    parser.add_argument('--no-history', action='store_true', required=False, help="Do not record the traces to the history database")
+    parser.add_argument('-x', dest='ixp_dataset', type=str, required=False, help="CAIDA IXP dataset (ixs_yyyymm.jsonl) the recorded hops are matched against")
+    parser.add_argument('--whois-server', dest='whois_servers', action='append', default=[], metavar='NAME=HOST[:PORT]', help="Send the whois queries meant for NAME (e.g. whois.iana.org, whois.ripe.net) to another server, e.g. a local stand-in")
+    parser.add_argument('--stage-timeout', dest='stage_timeouts', action='append', default=[], metavar='STAGE=SECONDS', help=f"Cancel a stage after this many seconds, stages: {', '.join(STAGE_TIMEOUTS)}")
+    parser.add_argument('-t', '--timing', action='store_true', required=False, help="Record the time spent in each stage and external call, to *_timing.json and *_trace.json (Chrome trace)")
 
     # Pass in the arguments 
     arguments = parser.parse_args()
     input_target_url = arguments.target_url
     speed_test_flag = arguments.s 
     ping_test_flag = arguments.p
+    lookup_options = {
+        'org_cache_filename': None if arguments.no_cache else arguments.org_cache,
+        'llm_cache_filename': None if arguments.no_cache else arguments.llm_cache,
+        'max_workers': arguments.max_workers,
+        'fast_path': not arguments.no_fast_path,
+        'llm_api_base': arguments.llm_api_base
+    }
+
+    stage_timeouts = {}
+    for option in arguments.stage_timeouts:
+        stage, _, seconds = option.partition('=')
+        if stage not in STAGE_TIMEOUTS:
+            parser.error(f"--stage-timeout: unknown stage {stage}, expected one of {', '.join(STAGE_TIMEOUTS)}")
+        try:
+            stage_timeouts[stage] = float(seconds) if seconds.lower() not in ('', 'none') else None
+        except ValueError:
+            parser.error(f"--stage-timeout: invalid number of seconds {seconds!r} for {stage}")
+
+    if arguments.whois_servers:
+        whois_servers = dict(whois_client.DEFAULT_SERVERS)
+        try:
+            whois_servers.update(whois_client.parse_server_option(option) for option in arguments.whois_servers)
+        except ValueError as e:
+            parser.error(f"--whois-server: {e}")
+        whois_client.set_client(whois_client.WhoisClient(whois_servers))
+
+    configure_logging(log_filename)
+    if arguments.timing:
+        timing.enable()
+
+    trace_store = None
+    if not arguments.no_history:
+        ixp_snapshot = None
+        if arguments.ixp_dataset:
+            from caida.ixp_snapshot import load_snapshot
+            # Through links such as ixs_latest.jsonl, so that the snapshot is named after the month it holds
+            ixp_snapshot = load_snapshot(os.path.realpath(arguments.ixp_dataset))
+        trace_store = TraceStore(arguments.history, ixp_snapshot)
 
     # Invoke main function 
     try: 
-        main(input_target_url, speed_test_flag, ping_test_flag)
-    # Graceful exit with keyboard interruption 
+        if arguments.monitor_interval:
+            monitor_targets = read_targets(arguments.targets_file) if arguments.targets_file else [input_target_url or "cmu.edu"]
+            monitor_main(monitor_targets, arguments.monitor_interval, arguments.events_file, arguments.max_parallel,
+                         arguments.monitor_rounds, arguments.rtt_threshold, arguments.engine, trace_store, arguments.ixp_dataset,
+                         **lookup_options)
+        elif arguments.targets_file:
+            batch_main(arguments.targets_file, arguments.batch_output, arguments.max_parallel, arguments.resume,
+                       arguments.engine, trace_store, **lookup_options)
+        else:
+            main(input_target_url, speed_test_flag, ping_test_flag, arguments.engine, trace_store, stage_timeouts, **lookup_options)
+    # Graceful exit with keyboard interruption, the stages of a single trace are cancelled by main instead
     except KeyboardInterrupt:
         logger.error("Keyboard Interrupted. Exiting the program. ")
         logger.info("============================================================")
 
-        exit(0)
\ No newline at end of file
+        exit(0)
+    finally:
+        if trace_store is not None:
+            trace_store.close()
+        recorder = timing.disable()
+        if recorder is not None:
+            report_filename, trace_filename = recorder.write(output_filename)
+            for entry in recorder.summary()[:10]:
+                logger.info(f"{entry['name']}: {entry['count']} x, {entry['total_ms']:.1f} ms in total")
+            logger.info(f"Timing report written to {report_filename}, Chrome trace to {trace_filename}")
\ No newline at end of file
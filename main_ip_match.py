@@ -30,7 +30,7 @@ logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
 
-def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool) -> None:
+def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool, ixp_dataset:str="ixs_202307.jsonl") -> None:
     target_url = target_url or "cmu.edu"
     # Get the WiFi information
     logger.info("------------------------------------------------------------")
@@ -66,6 +66,7 @@ def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool) -> None:
     # Trace Route
     logger.info(f"Trace Route to {target_url}")
     traceroute_hops, hop_count = trace_route(target_url)
+    traceroute_ips = [hop.ip_address for hop in traceroute_hops]
 
     # ip_address_location_dict = get_locations(traceroute_hops) 
     # logger.info("------------------------------------------------------------")
@@ -84,12 +85,18 @@ def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool) -> None:
     Analyse IXPs (Exact IP Matching)
     """
     logger.info("Matching the IP found in traceroute with the IXP database via Exact Matching")
-    from caida.ip_map_ixp import parseJSONL, printIXs
-    with open("ixs_202307.jsonl") as ixp_jsonl: 
-        print("List of IXP found: ")
-        ixs = parseJSONL("ixs_202307.jsonl")
-        result = printIXs(traceroute_hops, ixs)
-        logger.info(result)
+    # Load the compiled snapshot once for both matching passes (recompiled if the dataset changed)
+    from caida.ixp_snapshot import load_snapshot
+    ixp_snapshot = load_snapshot(ixp_dataset)
+
+    print("List of IXP found: ")
+    result = None
+    for ip_address in traceroute_ips:
+        ix = ixp_snapshot.find_ix(ip_address)
+        if ix is not None:
+            result = (ip_address, "|", ix['ix_id'], "|", ix['name'])
+            break
+    logger.info(result)
     
     logger.info("------------------------------------------------------------")
 
@@ -97,11 +104,8 @@ def main(target_url:str, speed_test_flag:bool, ping_test_flag:bool) -> None:
     Analyse IXPs (Longest Prefix Matching)
     """
     logger.info("Matching the IP found in traceroute with the IXP database via Longest Prefix Matching")
-    from caida.map_ixp import extract_ipv4_name_dict_from, longest_prefix_match
-    prefix_dict = extract_ipv4_name_dict_from("ixs_202307.jsonl")
-
-    for ip_address in traceroute_hops:
-        logger.info(longest_prefix_match(ip_address, prefix_dict))
+    for match in ixp_snapshot.match_many(traceroute_ips):
+        logger.info(match)
 
     logger.info("------------------------------------------------------------")
 
@@ -112,6 +116,7 @@ if __name__ == "__main__":
     parser.add_argument('-u', dest='target_url', type=str, required=False, help="Target URL for investigation")
     parser.add_argument('-s', action='store_true', required=False, help="Perform Speed Test for current network")
     parser.add_argument('-p', action='store_true', required=False, help="Perform Ping Test to target URL")
+    parser.add_argument('-ix', dest='ixp_dataset', type=str, default="ixs_202307.jsonl", help="CAIDA IXP dataset (ixs_yyyymm.jsonl)")
 
     # Pass in the arguments 
     arguments = parser.parse_args()
@@ -121,7 +126,7 @@ if __name__ == "__main__":
 
     # Invoke main function 
     try: 
-        main(input_target_url, speed_test_flag, ping_test_flag)
+        main(input_target_url, speed_test_flag, ping_test_flag, arguments.ixp_dataset)
     # Graceful exit with keyboard interruption 
     except KeyboardInterrupt:
         logger.error("Keyboard Interrupted. Exiting the program. ")
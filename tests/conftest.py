@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def write_dataset(tmp_path):
+    """
+    Write a dataset in the format of the CAIDA `ixs_yyyymm.jsonl` files.
+
+    :return: function of (file name, list of (ix_id, name, IPv4 prefixes)) returning the path written.
+    """
+    def write(file_name:str, ixs:list[tuple]) -> str:
+        path = tmp_path / file_name
+        with open(path, 'w') as file:
+            file.write('# ' + json.dumps({"description": "test IXP dataset"}) + '\n')
+            for ix_id, name, prefixes in ixs:
+                file.write(json.dumps({"ix_id": ix_id, "name": name, "prefixes": {"ipv4": prefixes, "ipv6": []}}) + '\n')
+        return str(path)
+    return write
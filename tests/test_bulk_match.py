@@ -0,0 +1,97 @@
+import random
+import ipaddress
+
+import numpy as np
+import pytest
+
+from benchmarks.datasets import make_ip_list, write_ixp_dataset
+from caida.bulk_match import BulkMatcher, ips_to_array
+from caida.ip_map_ixp import exportCSV, matchIXs, parseJSONL
+from caida.map_ixp import PrefixTrie
+
+
+def canonical_address(ip:str):
+    # Reference of ips_to_array: the integer of a canonical dotted quad, None for anything else
+    try:
+        address = ipaddress.IPv4Address(ip)
+    except ValueError:
+        return None
+    return int(address) if str(address) == ip else None
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("bulk") / "ixs.jsonl")
+    prefixes = write_ixp_dataset(filename, 2000, seed=7)
+    # Network addresses, addresses inside the prefixes, random addresses and a few malformed lines
+    ips = make_ip_list(prefixes, 20000, seed=7) + ["", "1.2.3", "010.0.0.1", "2001:db8::1", " 1.2.3.4"]
+    return filename, prefixes, ips
+
+
+def test_exact_match_is_identical_to_ip_map_ixp(dataset, tmp_path):
+    filename, _, ips = dataset
+    ixs, ip_index = parseJSONL(filename)
+    matcher = BulkMatcher(ixs)
+    expected = list(matchIXs(ips, ip_index))
+    assert len(expected) > 1000
+    assert list(matcher.iter_matches(ips, chunk_size=3000)) == expected
+
+    assert matcher.export_csv(ips, tmp_path / "bulk.csv") == exportCSV(ips, ip_index, tmp_path / "reference.csv")
+    assert (tmp_path / "bulk.csv").read_text() == (tmp_path / "reference.csv").read_text()
+
+
+def test_longest_prefix_match_is_identical_to_the_trie(dataset):
+    filename, _, ips = dataset
+    ixs, _ = parseJSONL(filename)
+    matcher = BulkMatcher(ixs)
+    trie = PrefixTrie.from_jsonl(filename)
+
+    addresses, valid = ips_to_array(ips)
+    indexes = matcher.longest_prefix_match(addresses, valid)
+    matched = 0
+    for ip, index, is_valid in zip(ips, indexes.tolist(), valid.tolist()):
+        best = trie.lookup(ip) if is_valid else None
+        expected = str(ipaddress.IPv4Network(best[0], strict=False)) if best else None
+        found = f"{ipaddress.IPv4Address(int(matcher.starts[index]))}/{matcher.lengths[index]}" if index >= 0 else None
+        assert found == expected, ip
+        matched += found is not None
+    assert matched > 5000
+
+
+def test_matching_an_empty_dataset(write_dataset):
+    ixs, _ = parseJSONL(write_dataset("empty.jsonl", []))
+    matcher = BulkMatcher(ixs)
+    addresses, valid = ips_to_array(["1.2.3.4"])
+    assert matcher.exact_match(addresses, valid).tolist() == [-1]
+    assert matcher.longest_prefix_match(addresses, valid).tolist() == [-1]
+
+
+@pytest.mark.parametrize("ip", [
+    "", "1.2.3", "1.2.3.4.5", "1..3.4", ".1.2.3", "1.2.3.", "256.1.1.1", "1.2.3.999", "1234.1.1.1", "01.2.3.4",
+    "1.2.3.00", "1.2.3.4 ", " 1.2.3.4", "a.b.c.d", "1.2.3.-4", "1.2.3.4\n", "2001:db8::1", "111.111.111.1111",
+    "1.1.1.1.1.1.1.1.1", "é.1.1.1", "１.2.3.4",
+])
+def test_malformed_lines_are_invalid(ip):
+    addresses, valid = ips_to_array([ip, "9.9.9.9"])
+    assert valid.tolist() == [False, True]
+    assert addresses.tolist() == [0, 0x09090909]
+
+
+def test_ips_to_array_matches_ipaddress_on_random_lines():
+    rng = random.Random(3)
+    ips = ["0.0.0.0", "255.255.255.255", "100.10.1.0"]
+    for _ in range(20000):
+        if rng.random() < 0.5:
+            ips.append('.'.join(str(rng.choice([rng.randrange(256), rng.randrange(1000)])) for _ in range(4)))
+        else:
+            ips.append(''.join(rng.choice("0123456789..") for _ in range(rng.randrange(18))))
+    addresses, valid = ips_to_array(ips)
+    expected = [canonical_address(ip) for ip in ips]
+    assert valid.tolist() == [address is not None for address in expected]
+    assert addresses.tolist() == [address or 0 for address in expected]
+    assert valid.sum() > 1000
+
+
+def test_ips_to_array_of_no_lines():
+    addresses, valid = ips_to_array([])
+    assert (addresses.dtype, len(addresses), valid.dtype, len(valid)) == (np.uint32, 0, np.bool_, 0)
@@ -0,0 +1,108 @@
+import random
+import ipaddress
+
+import pytest
+
+from util.gpt_whois import integrate_ip_info
+from util.hop import Hop, OrgRecord
+from util.ip_range_index import IPRangeIndex, address_key
+
+
+def random_networks(rng:random.Random, count:int) -> list:
+    """
+    Networks of both families crowded in a few small blocks, so that many are nested or listed twice.
+    """
+    blocks = [ipaddress.ip_network("10.0.0.0/20"), ipaddress.ip_network("192.0.2.0/24"), ipaddress.ip_network("2001:db8::/116")]
+    networks = []
+    while len(networks) < count:
+        draw = rng.random()
+        if draw < 0.02:
+            network = ipaddress.ip_network(rng.choice(["0.0.0.0/0", "::/0"]))
+        elif draw < 0.15 and networks:
+            # Listed again
+            network = rng.choice(networks)
+        elif draw < 0.4 and networks:
+            # Nested in a network already listed
+            parent = rng.choice(networks)
+            length = min(parent.max_prefixlen, parent.prefixlen + rng.randint(1, 4))
+            network = rng.choice(list(parent.subnets(new_prefix=length))) if length - parent.prefixlen <= 4 else parent
+        else:
+            block = rng.choice(blocks)
+            length = rng.randint(block.prefixlen, block.max_prefixlen)
+            offset = rng.getrandbits(block.max_prefixlen - block.prefixlen) >> (block.max_prefixlen - length) << (block.max_prefixlen - length)
+            network = ipaddress.ip_network((int(block.network_address) + offset, length))
+        networks.append(network)
+    return networks
+
+
+def most_specific(items:list, key:int):
+    # Reference lookup: the smallest network containing the key, the first listed among equal ones
+    best = None
+    for network, value in items:
+        start, end = address_key(network.network_address), address_key(network.broadcast_address)
+        if start <= key <= end and (best is None or network.num_addresses < best[0]):
+            best = (network.num_addresses, value)
+    return best[1] if best else None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_from_networks_matches_incremental_inserts(seed):
+    rng = random.Random(seed)
+    items = [(network, index) for index, network in enumerate(random_networks(rng, rng.randint(1, 60)))]
+    bulk = IPRangeIndex.from_networks(items)
+    incremental = IPRangeIndex()
+    # A network inserted again overrides the value, so the first value listed is inserted last
+    for network, value in reversed(items):
+        incremental.insert_network(network, value)
+
+    keys = set()
+    for network, _ in items:
+        start, end = address_key(network.network_address), address_key(network.broadcast_address)
+        keys.update((start - 1, start, end, end + 1, rng.randint(start, end)))
+    keys.update(rng.randrange(1 << 33) for _ in range(200))
+    for key in sorted(keys):
+        expected = most_specific(items, key)
+        assert bulk.lookup(key) == expected, key
+        assert incremental.lookup(key) == expected, key
+    assert len(bulk) == len({network for network, _ in items})
+
+
+def test_from_networks_of_nothing():
+    index = IPRangeIndex.from_networks([])
+    assert (len(index), index.lookup("10.0.0.1")) == (0, None)
+
+
+def test_from_networks_mixed_families_do_not_overlap():
+    index = IPRangeIndex.from_networks([(ipaddress.ip_network("::/0"), "v6"), (ipaddress.ip_network("10.0.0.0/8"), "v4")])
+    assert [index.lookup(ip) for ip in ("10.1.2.3", "11.0.0.1", "::", "2001:db8::1", "::ffff:10.1.2.3")] == ["v4", None, "v6", "v6", "v6"]
+
+
+def test_integrate_ip_info_rows_are_fixed_width():
+    records = [
+        OrgRecord("RIPE", "10.0.0.0/8", "Large", "Address L"),
+        OrgRecord("RIPE", "10.1.0.0 - 10.1.255.255", "Specific", "Address S"),
+        OrgRecord("ARIN", "10.1.0.0/16", "Listed again", "Address A"),
+        OrgRecord("APNIC", "2001:db8::/32", "IPv6", "Address 6"),
+    ]
+    hops = [Hop.parse(1, "10.1.2.3"), Hop.parse(2, "10.2.0.1"), Hop.parse(3, "2001:db8::1"), Hop.parse(4, "8.8.8.8"), Hop(5)]
+    hops = [hop.replace(location=f"Location {hop.number}") for hop in hops]
+    integrated = integrate_ip_info(hops, records)
+
+    assert [hop.org for hop in integrated] == [records[1], records[0], records[3], None, None]
+    assert [hop.row() for hop in integrated[3:]] == [["8.8.8.8", "Location 4", "", "", "", ""], [None, "Location 5", "", "", "", ""]]
+    assert {len(hop.row()) for hop in integrated} == {6}
+    # The hops given are copied, not modified
+    assert all(hop.org is None for hop in hops)
+
+
+@pytest.mark.parametrize("network_range", [None, "", "not a range", "10.0.0.300/24", "10.0.0.9 - 10.0.0.1 - 10.0.0.2", "0.0.0.0/0", "::/0"])
+def test_integrate_ip_info_skips_unparsable_and_catch_all_ranges(network_range):
+    records = [None, OrgRecord("RIPE", network_range, "Skipped", None), OrgRecord("RIPE", "192.0.2.0/24", "Kept", None)]
+    integrated = integrate_ip_info([Hop.parse(1, "10.0.0.1"), Hop.parse(2, "2001:db8::1"), Hop.parse(3, "192.0.2.1")], records)
+    assert [hop.org for hop in integrated] == [None, None, records[2]]
+
+
+def test_integrate_ip_info_keeps_the_parsable_parts_of_a_range():
+    record = OrgRecord("ARIN", "garbage, 10.0.0.0/24, 10.0.1.0 - 10.0.1.255", "Parts", None)
+    integrated = integrate_ip_info([Hop.parse(1, "10.0.0.1"), Hop.parse(2, "10.0.1.1"), Hop.parse(3, "10.0.2.1")], [record])
+    assert [hop.org for hop in integrated] == [record, record, None]
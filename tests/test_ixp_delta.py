@@ -0,0 +1,150 @@
+import os
+import json
+import random
+import ipaddress
+
+import pytest
+
+from benchmarks.datasets import make_ip_list, write_ixp_dataset
+from caida.ixp_delta import SnapshotWatcher, diff_snapshots
+from caida.ixp_snapshot import load_snapshot
+from caida.map_ixp import PrefixTrie
+from util.hop import Hop
+from util.trace_store import TraceStore
+
+
+def next_month(old_file:str, new_file:str, seed:int=1) -> None:
+    """
+    Write the dataset of the following month: IXs renamed, prefixes dropped, prefixes added (some of them
+    nested in existing ones), and prefixes moved to another IX or listed by a second one.
+    """
+    rng = random.Random(seed)
+    with open(old_file) as file:
+        header, ixs = file.readline(), [json.loads(line) for line in file]
+    for ix in ixs:
+        prefixes = ix['prefixes']['ipv4']
+        draw = rng.random()
+        if draw < 0.05:
+            ix['name'] += " (renamed)"
+        elif draw < 0.15 and prefixes:
+            prefixes.pop(rng.randrange(len(prefixes)))
+        elif draw < 0.25 and prefixes:
+            network = ipaddress.IPv4Network(rng.choice(prefixes))
+            if network.prefixlen < 30:
+                prefixes.append(str(next(network.subnets(new_prefix=network.prefixlen + 2))))
+        elif draw < 0.30:
+            prefixes.append(f"100.{rng.randrange(64, 128)}.{rng.randrange(256)}.0/24")
+        elif draw < 0.35 and prefixes:
+            other = rng.choice(ixs)
+            other['prefixes']['ipv4'].append(prefixes.pop() if rng.random() < 0.5 else prefixes[-1])
+    with open(new_file, 'w') as file:
+        file.write(header)
+        for ix in ixs:
+            file.write(json.dumps(ix) + '\n')
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    old_file, new_file = str(tmp_path / "ixs_202307.jsonl"), str(tmp_path / "ixs_202308.jsonl")
+    prefixes = write_ixp_dataset(old_file, 2000)
+    next_month(old_file, new_file)
+    return old_file, new_file, prefixes
+
+
+@pytest.fixture
+def snapshots(datasets):
+    old_file, new_file, _ = datasets
+    old, new = load_snapshot(old_file), load_snapshot(new_file)
+    yield old, new
+    old.close()
+    new.close()
+
+
+def test_diff_snapshots(write_dataset):
+    old = load_snapshot(write_dataset("ixs_202307.jsonl", [(1, "IX-1", ["80.81.192.0/21", "185.1.0.0/24"]),
+                                                           (2, "IX-2", ["80.249.208.0/21"])]))
+    new = load_snapshot(write_dataset("ixs_202308.jsonl", [(1, "IX-1", ["80.81.192.0/21"]),
+                                                           (2, "IX-2 renamed", ["80.249.208.0/21", "185.1.0.0/24"]),
+                                                           (3, "IX-3", ["80.81.194.0/24"])]))
+    delta = diff_snapshots(old, new)
+
+    assert sorted(delta.added) == [("185.1.0.0/24", 2, "IX-2 renamed"), ("80.81.194.0/24", 3, "IX-3")]
+    assert delta.removed == [("185.1.0.0/24", 1, "IX-1")]
+    assert delta.changed == [("80.249.208.0/21", 2, "IX-2", "IX-2 renamed")]
+    assert delta.owners["185.1.0.0/24"] == {'ix_id': 2, 'name': "IX-2 renamed"}
+    # 80.81.194.0/24 is inside 80.81.192.0/21, which did not change: only its own addresses may match differently
+    assert [(str(ipaddress.IPv4Address(first)), str(ipaddress.IPv4Address(last))) for first, last in delta.ranges()] == [
+        ("80.81.194.0", "80.81.194.255"), ("80.249.208.0", "80.249.215.255"), ("185.1.0.0", "185.1.0.255")]
+    assert diff_snapshots(old, old).summary()['prefixes'] == 0
+    old.close()
+    new.close()
+
+
+def test_apply_to_trie_matches_a_rebuild(datasets, snapshots):
+    old_file, new_file, prefixes = datasets
+    delta = diff_snapshots(*snapshots)
+    assert len(delta) > 0
+
+    trie = PrefixTrie.from_jsonl(old_file)
+    delta.apply_to_trie(trie)
+    rebuilt = PrefixTrie.from_jsonl(new_file)
+
+    assert trie.size == rebuilt.size
+    ips = make_ip_list(prefixes, 20000) + [str(ipaddress.IPv4Network(prefix).network_address) for prefix, _ in delta.owners.items()]
+    assert [trie.lookup(ip) for ip in ips] == [rebuilt.lookup(ip) for ip in ips]
+
+
+def _all_matches(store:TraceStore, ix_ids:set, snapshot:str) -> list[tuple]:
+    return sorted(row[1:] for ix_id in ix_ids for row in store.traces_through_ixp(ix_id, snapshot=snapshot))
+
+
+def test_rematching_the_history_matches_a_rebuild(tmp_path, datasets, snapshots):
+    _, _, prefixes = datasets
+    old, new = snapshots
+    delta = diff_snapshots(old, new)
+    ips = make_ip_list(prefixes, 3000) + [str(ipaddress.IPv4Network(prefix).network_address) for prefix in delta.owners]
+    random.Random(2).shuffle(ips)
+    traces = [(f"target{index}.example", [Hop.parse(number, ip) for number, ip in enumerate(ips[start:start + 10], 1)], 1000.0 + index)
+              for index, start in enumerate(range(0, len(ips), 10))]
+    ix_ids = set(old.ix_ids) | set(new.ix_ids)
+
+    with TraceStore(str(tmp_path / "updated.sqlite"), old) as updated, TraceStore(str(tmp_path / "rebuilt.sqlite"), new) as rebuilt:
+        for target, hops, traced_at in traces:
+            updated.add_trace(target, hops, traced_at=traced_at)
+            rebuilt.add_trace(target, hops, traced_at=traced_at)
+        updated.flush()
+        before = _all_matches(updated, ix_ids, None)
+
+        rematched = updated.set_ixp_snapshot(new, delta)
+        rebuilt.flush()
+
+        assert 0 < rematched < len(ips)
+        assert _all_matches(updated, ix_ids, None) == _all_matches(rebuilt, ix_ids, None)
+        # The matches made with the previous dataset are kept
+        assert _all_matches(updated, ix_ids, "ixs_202307") == before
+        assert before != _all_matches(rebuilt, ix_ids, None)
+
+
+def test_set_ixp_snapshot_rejects_a_delta_from_another_snapshot(tmp_path, snapshots):
+    old, new = snapshots
+    with TraceStore(str(tmp_path / "history.sqlite"), new) as store:
+        with pytest.raises(ValueError):
+            store.set_ixp_snapshot(old, diff_snapshots(old, new))
+
+
+def test_watcher_follows_a_link_to_the_latest_dataset(tmp_path, datasets):
+    old_file, new_file, prefixes = datasets
+    link = str(tmp_path / "ixs_latest.jsonl")
+    os.symlink(old_file, link)
+    with TraceStore(str(tmp_path / "history.sqlite"), load_snapshot(old_file)) as store:
+        watcher = SnapshotWatcher(link, store)
+        store.add_trace("example.com", [Hop.parse(1, ip) for ip in make_ip_list(prefixes, 10)])
+        assert watcher.poll() is None
+
+        os.remove(link)
+        os.symlink(new_file, link)
+        delta = watcher.poll()
+        assert delta is not None and len(delta) > 0
+        assert [row[0] for row in store.snapshots()] == ["ixs_202307", "ixs_202308"]
+        assert watcher.poll() is None
+        store.ixp_snapshot.close()
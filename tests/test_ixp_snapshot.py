@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from caida import ixp_snapshot
+from caida.ixp_snapshot import load_snapshot
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """
+    Files hashed by checksum_of.
+    """
+    files = []
+    checksum_of = ixp_snapshot.checksum_of
+    monkeypatch.setattr(ixp_snapshot, "checksum_of", lambda file_name: files.append(file_name) or checksum_of(file_name))
+    return files
+
+
+def test_the_dataset_is_only_hashed_when_its_size_or_mtime_changed(write_dataset, hashed):
+    dataset = write_dataset("ixs_202307.jsonl", [(1, "IX-1", ["80.81.192.0/21"])])
+    load_snapshot(dataset).close()
+    assert len(hashed) == 1
+
+    hashed.clear()
+    snapshot = load_snapshot(dataset)
+    assert hashed == []
+    assert snapshot.find_ix("80.81.192.0") == {'ix_id': 1, 'name': "IX-1"}
+    snapshot.close()
+
+    # Touched but unchanged: hashed once, and the new mtime is recorded rather than compiled again
+    os.utime(dataset, ns=(1, 1))
+    inode = os.stat(ixp_snapshot.default_snapshot_path(dataset)).st_ino
+    hashed.clear()
+    load_snapshot(dataset).close()
+    load_snapshot(dataset).close()
+    assert len(hashed) == 1
+    assert os.stat(ixp_snapshot.default_snapshot_path(dataset)).st_ino == inode
+
+
+def test_a_changed_dataset_is_compiled_again(write_dataset):
+    dataset = write_dataset("ixs_202307.jsonl", [(1, "IX-1", ["80.81.192.0/21"])])
+    load_snapshot(dataset).close()
+    write_dataset("ixs_202307.jsonl", [(1, "IX-1", ["80.81.192.0/21"]), (2, "IX-2", ["185.1.0.0/24"])])
+    snapshot = load_snapshot(dataset)
+    assert snapshot.find_ix("185.1.0.0") == {'ix_id': 2, 'name': "IX-2"}
+    snapshot.close()
@@ -0,0 +1,102 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.stubs import StubServer, _chat_answer
+from util.llm_batch import LLMBatcher, LLMExtractionError
+from util.openai_client import set_api_key
+
+
+@pytest.fixture(autouse=True)
+def placeholder_key():
+    # The requests go to the stand-in servers, never to OpenAI
+    set_api_key("sk-stub")
+
+
+@pytest.fixture
+def failing_server():
+    """
+    Stand-in for the OpenAI API rejecting the requests of 10.0.0.1 until `fail_count` of them failed.
+    """
+    state = {'fail_count': 1, 'failures': 0, 'answered': {}}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            prompt = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['messages'][-1]['content']
+            with lock:
+                fail = "10.0.0.1)" in prompt and state['failures'] < state['fail_count']
+                state['failures'] += fail
+            if fail:
+                body = json.dumps({'error': {'message': "stand-in failure", 'type': 'invalid_request_error'}}).encode()
+            else:
+                for ip_address in ("10.0.0.1", "10.0.0.2"):
+                    if f"{ip_address})" in prompt:
+                        state['answered'][ip_address] = time.monotonic()
+                body = json.dumps({'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': _chat_answer(prompt)}}]}).encode()
+            self.send_response(400 if fail else 200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    state['api_base'] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_batches_are_sent_concurrently():
+    with StubServer(llm_latency=0.5) as server:
+        batcher = LLMBatcher(api_base=server.llm_api_base, max_batch_size=1, linger=0, max_in_flight=3)
+        start = time.monotonic()
+        futures = [batcher.submit(f"10.0.{i}.1", "inetnum: x\n") for i in range(3)]
+        results = [future.result(timeout=5) for future in futures]
+        elapsed = time.monotonic() - start
+        batcher.close()
+    assert [result['Network Range'] for result in results] == [f"10.0.{i}.0/24" for i in range(3)]
+    assert server.llm_requests == 3
+    assert elapsed < 1.2
+
+
+def test_backoff_does_not_hold_up_other_batches(failing_server):
+    batcher = LLMBatcher(api_base=failing_server['api_base'], max_batch_size=1, linger=0, backoff=0.5)
+    start = time.monotonic()
+    failing = batcher.submit("10.0.0.1", "inetnum: x\n")
+    time.sleep(0.2)
+    other = batcher.submit("10.0.0.2", "inetnum: x\n")
+    assert other.result(timeout=5)['Network Range'] == "10.0.0.0/24"
+    assert failing.result(timeout=5)['Network Range'] == "10.0.0.0/24"
+    batcher.close()
+    answered = failing_server['answered']
+    # The other record was answered while the failed one was backing off for at least 0.5 s
+    assert answered["10.0.0.2"] - start < 0.5 <= answered["10.0.0.1"] - start
+
+
+def test_records_fail_after_max_attempts(failing_server):
+    failing_server['fail_count'] = 10
+    batcher = LLMBatcher(api_base=failing_server['api_base'], linger=0, max_attempts=2, backoff=0.01)
+    with pytest.raises(LLMExtractionError):
+        batcher.submit("10.0.0.1", "inetnum: x\n").result(timeout=5)
+    batcher.close()
+    assert failing_server['failures'] == 2
+
+
+def test_close_without_waiting_fails_records_backing_off(failing_server):
+    batcher = LLMBatcher(api_base=failing_server['api_base'], linger=0, backoff=10)
+    future = batcher.submit("10.0.0.1", "inetnum: x\n")
+    while failing_server['failures'] == 0:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    batcher.close(wait=False)
+    with pytest.raises(LLMExtractionError):
+        future.result(timeout=1)
@@ -0,0 +1,88 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.stubs import StubServer
+from util.hop import Hop
+from util.trace_route import LocationClient, get_ip_info
+
+
+@pytest.fixture
+def stub_server():
+    with StubServer(ipinfo_latency=0.2) as server:
+        yield server
+
+
+@pytest.fixture
+def flaky_server():
+    """
+    Stand-in for ipinfo.io answering the first request for each IP address with a non JSON error page.
+    """
+    seen = set()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ip_address = self.path.strip('/').split('/')[0]
+            with lock:
+                first = ip_address not in seen
+                seen.add(ip_address)
+            body = b"Service Unavailable" if first else f'{{"ip": "{ip_address}", "city": "City", "region": "Region", "country": "SG", "org": "AS1 Example"}}'.encode()
+            self.send_response(503 if first else 200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_ip_info_formats_the_location(stub_server):
+    location = get_ip_info("8.8.8.8", base_url=stub_server.base_url)
+    assert location.endswith(", SG")
+    assert location.startswith("AS")
+
+
+def test_get_ip_info_returns_none_when_the_service_is_unreachable():
+    assert get_ip_info("8.8.8.8", base_url="http://127.0.0.1:9", timeout=1) is None
+
+
+def test_each_ip_address_is_looked_up_once(stub_server):
+    with LocationClient(stub_server.base_url) as client:
+        first, second = client.submit("8.8.8.8"), client.submit("8.8.8.8")
+        assert first is second
+        assert first.result() is not None
+    assert stub_server.ipinfo_requests == 1
+
+
+def test_lookups_run_concurrently_and_keep_the_order_of_the_hops(stub_server):
+    hops = [Hop.parse(number, f"8.8.{number}.1") for number in range(1, 9)]
+    with LocationClient(stub_server.base_url, max_workers=8) as client:
+        started = time.perf_counter()
+        located = client.get_locations(hops)
+        elapsed = time.perf_counter() - started
+
+    # 8 lookups of 0.2 s each take 1.6 s one after the other
+    assert elapsed < 1.0
+    assert [hop.ip_address for hop in located] == [hop.ip_address for hop in hops]
+    assert all(hop.location is not None for hop in located)
+    assert stub_server.ipinfo_requests == len(hops)
+
+
+def test_failed_lookups_are_not_kept(flaky_server):
+    with LocationClient(flaky_server) as client:
+        failed = client.submit("8.8.8.8")
+        assert failed.result() is None
+        retried = client.submit("8.8.8.8")
+        assert retried is not failed
+        assert retried.result() == "AS1 Example, City, Region, SG"
+        assert client.submit("8.8.8.8") is retried
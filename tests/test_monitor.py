@@ -0,0 +1,159 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+
+from util.hop import Hop, ip_to_int
+from util.monitor import PathMonitor, diff_paths, path_of
+from util.trace_store import TraceStore
+
+
+def trace(destination:str, *ips, rtt:float=10.0) -> list[Hop]:
+    """
+    Hops as yielded by iter_trace_route: the destination, then one hop per IP address, None for a hop that did not answer.
+    """
+    return [Hop.parse(0, destination)] + [Hop.parse(number, ip, (rtt,)) if ip else Hop(number)
+                                          for number, ip in enumerate(ips, 1)]
+
+
+class FakeLookups:
+    """
+    Stand-in for LocationClient and OrgResolver, answering at once and counting the lookups.
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.submitted = []
+
+    def submit(self, ip_address:str) -> Future:
+        self.submitted.append(ip_address)
+        future = Future()
+        future.set_result(self.answer(ip_address))
+        return future
+
+
+@pytest.fixture
+def traces(monkeypatch):
+    """
+    Traces the monitor gets for each target, in order.
+    """
+    scripted = {}
+    monkeypatch.setattr("util.monitor.iter_trace_route", lambda target, engine: iter(scripted[target].pop(0)))
+    return scripted
+
+
+@pytest.fixture
+def locations():
+    return FakeLookups(lambda ip_address: f"Location of {ip_address}")
+
+
+@pytest.fixture
+def orgs():
+    return FakeLookups(lambda ip_address: {'Regional Registry': 'RIPE', 'Network Range': f"{ip_address}/32",
+                                           'Organization': f"Org of {ip_address}", 'Address': 'Singapore'})
+
+
+@pytest.fixture
+def events_file(tmp_path):
+    return str(tmp_path / "events.jsonl")
+
+
+def read_events(events_file:str) -> list[dict]:
+    with open(events_file) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_path_of_keeps_the_first_responder_of_each_hop():
+    hops = trace("9.9.9.9", "8.8.8.8", None) + [Hop.parse(1, "1.1.1.1"), Hop.parse(2, "2.2.2.2")]
+    destination, path = path_of(hops)
+    assert destination == ip_to_int("9.9.9.9")
+    assert {number: hop.ip_address for number, hop in path.items()} == {1: "8.8.8.8", 2: "2.2.2.2"}
+
+
+def test_diff_paths():
+    _, previous = path_of(trace("9.9.9.9", "8.8.8.8", "1.1.1.1", "2.2.2.2"))
+    _, current = path_of(trace("9.9.9.9", "8.8.8.8", "3.3.3.3", None, "4.4.4.4"))
+    changes = [(change, number, previous_hop and previous_hop.ip_address, current_hop and current_hop.ip_address)
+               for change, number, previous_hop, current_hop in diff_paths(previous, current)]
+    # Hop 3 did not answer, which is not a change
+    assert changes == [("changed", 2, "1.1.1.1", "3.3.3.3"), ("added", 4, None, "4.4.4.4")]
+    assert [change for change, *_ in diff_paths(current, previous)] == ["changed", "removed"]
+    assert diff_paths(previous, previous) == []
+
+
+def test_events_follow_the_path_changes(traces, locations, orgs, events_file):
+    traces["example.com"] = [trace("9.9.9.9", "8.8.8.8", "1.1.1.1"),
+                             trace("9.9.9.9", "8.8.8.8", "1.1.1.1"),
+                             trace("9.9.9.9", "8.8.8.8", "2.2.2.2")]
+    monitor = PathMonitor(locations, orgs, events_file)
+
+    assert [event['event'] for event in monitor.check("example.com")] == ["new_path"]
+    assert monitor.check("example.com") == []
+    (event,) = monitor.check("example.com")
+
+    assert event['event'] == "path_change"
+    (change,) = event['changes']
+    assert (change['change'], change['hop'], change['previous']['ip'], change['current']['ip']) == ("changed", 2, "1.1.1.1", "2.2.2.2")
+    assert change['current']['organization'] == "Org of 2.2.2.2"
+    assert change['current']['location'] == "Location of 2.2.2.2"
+    assert [event['event'] for event in read_events(events_file)] == ["new_path", "path_change"]
+    # Only the IP addresses never seen before are looked up
+    assert locations.submitted == orgs.submitted == ["8.8.8.8", "1.1.1.1", "2.2.2.2"]
+    assert monitor.lookups == 3
+
+
+def test_rtt_changes_are_reported_above_the_threshold(traces, locations, orgs, events_file):
+    traces["example.com"] = [trace("9.9.9.9", "8.8.8.8", rtt=10.0),
+                             trace("9.9.9.9", "8.8.8.8", rtt=15.0),
+                             trace("9.9.9.9", "8.8.8.8", rtt=40.0)]
+    monitor = PathMonitor(locations, orgs, events_file, rtt_threshold=20)
+    monitor.check("example.com")
+    assert monitor.check("example.com") == []
+    (event,) = monitor.check("example.com")
+    assert event['event'] == "rtt_change"
+    assert event['rtt_deltas_ms'] == {1: 25.0}
+
+
+def test_unanswered_hops_are_recorded_as_traced(traces, locations, orgs, events_file, tmp_path):
+    traces["example.com"] = [trace("9.9.9.9", "8.8.8.8", "1.1.1.1"),
+                             trace("9.9.9.9", "8.8.8.8", None),
+                             trace("9.9.9.9", "8.8.8.8", "1.1.1.1")]
+    with TraceStore(str(tmp_path / "history.sqlite")) as store:
+        monitor = PathMonitor(locations, orgs, events_file, trace_store=store)
+        monitor.check("example.com")
+        # A hop not answering is neither a change, nor is it answering again from its last known responder
+        assert monitor.check("example.com") == []
+        assert monitor.check("example.com") == []
+        store.flush()
+
+        second_trace = sorted(store.traces_of("example.com"))[1][0]
+        assert [hop[2] for hop in store.hops_of(second_trace)] == ["8.8.8.8", None]
+        assert len(store.traces_through("1.1.1.1")) == 2
+
+
+def test_failed_lookups_are_tried_again(traces, locations, events_file):
+    failing = FakeLookups(lambda ip_address: None)
+    traces["example.com"] = [trace("9.9.9.9", "8.8.8.8"), trace("9.9.9.9", "8.8.8.8")]
+    monitor = PathMonitor(locations, failing, events_file)
+    monitor.check("example.com")
+    monitor.check("example.com")
+    assert failing.submitted == ["8.8.8.8", "8.8.8.8"]
+
+
+def test_a_failed_flush_does_not_stop_the_monitor(traces, locations, orgs, events_file, tmp_path, monkeypatch):
+    traces["example.com"] = [trace("9.9.9.9", "8.8.8.8"), trace("9.9.9.9", "8.8.8.8")]
+    with TraceStore(str(tmp_path / "history.sqlite")) as store:
+        flush = store.flush
+        calls = []
+
+        def failing_flush():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RuntimeError("stand-in failure")
+            return flush()
+
+        monkeypatch.setattr(store, "flush", failing_flush)
+        PathMonitor(locations, orgs, events_file, trace_store=store).run(["example.com"], interval=0, iterations=2)
+        assert len(calls) == 2
+        # The traces of the first round are written by the flush of the second
+        assert len(store.traces_of("example.com")) == 2
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import logging
+
+import pytest
+
+from util.orchestrator import Stage, run_command, run_in_thread, run_stages, run_until_interrupted
+
+
+def stage_results(stages:list[Stage]) -> dict:
+    return asyncio.run(run_stages(stages))
+
+
+def test_independent_stages_overlap():
+    intervals = {}
+
+    def sleeper(name:str):
+        async def run():
+            started = time.monotonic()
+            await asyncio.sleep(0.3)
+            intervals[name] = (started, time.monotonic())
+            return name
+        return run
+
+    started = time.monotonic()
+    results = stage_results([Stage("a", sleeper("a")), Stage("b", sleeper("b")), Stage("c", sleeper("c"))])
+    assert results == {"a": "a", "b": "b", "c": "c"}
+    assert time.monotonic() - started < 0.6
+    assert max(start for start, _ in intervals.values()) < min(end for _, end in intervals.values())
+
+
+def test_dependent_stages_get_the_results_of_their_dependencies():
+    order = []
+
+    async def first():
+        await asyncio.sleep(0.05)
+        order.append("first")
+        return 2
+
+    async def second():
+        order.append("second")
+        return 3
+
+    async def product(first, second):
+        order.append("product")
+        return first * second
+
+    results = stage_results([Stage("product", product, depends_on=("first", "second")), Stage("first", first), Stage("second", second)])
+    assert results == {"product": 6, "first": 2, "second": 3}
+    assert order == ["second", "first", "product"]
+
+
+def test_failed_dependencies_skip_or_default(caplog):
+    called = []
+
+    async def failing():
+        raise RuntimeError("stand-in failure")
+
+    async def skipped(failing):
+        called.append("skipped")
+
+    async def regardless(failing):
+        called.append(("regardless", failing))
+        return "ran"
+
+    async def after_skipped(skipped):
+        called.append("after_skipped")
+
+    results = stage_results([
+        Stage("failing", failing, default="failing default"),
+        Stage("skipped", skipped, depends_on=("failing",), default="skipped default"),
+        Stage("regardless", regardless, depends_on=("failing",), skip_on_failure=False),
+        Stage("after_skipped", after_skipped, depends_on=("skipped",)),
+    ])
+    assert results == {"failing": "failing default", "skipped": "skipped default", "regardless": "ran", "after_skipped": None}
+    assert called == [("regardless", "failing default")]
+    assert "Stage failing failed: RuntimeError('stand-in failure')" in caplog.text
+
+
+def test_stages_time_out(caplog):
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def dependent(slow):
+        return "ran"
+
+    started = time.monotonic()
+    results = stage_results([Stage("slow", slow, timeout=0.1, default="late"), Stage("dependent", dependent, depends_on=("slow",))])
+    assert results == {"slow": "late", "dependent": None}
+    assert time.monotonic() - started < 1
+    assert cancelled == [True]
+    assert "Stage slow timed out after 0.1 s" in caplog.text
+
+
+@pytest.mark.parametrize("timeout", [None, 5])
+def test_timeouts_raised_by_a_stage_are_failures(caplog, timeout):
+    async def connect():
+        # Such as a socket timeout, which is a TimeoutError too
+        raise socket.timeout("timed out")
+
+    assert stage_results([Stage("connect", connect, timeout=timeout, default="default")]) == {"connect": "default"}
+    assert "Stage connect failed: TimeoutError('timed out')" in caplog.text
+    assert "timed out after" not in caplog.text
+
+
+def test_blocking_functions_run_in_threads():
+    async def blocking():
+        return await run_in_thread(time.sleep, 0.2)
+
+    started = time.monotonic()
+    assert stage_results([Stage("a", blocking), Stage("b", blocking)]) == {"a": None, "b": None}
+    assert time.monotonic() - started < 0.35
+
+
+def process_exists(pid:int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def sleeping_command(pid_file) -> tuple:
+    return (sys.executable, "-c", f"import os, time; open({str(pid_file)!r}, 'w').write(str(os.getpid())); time.sleep(30)")
+
+
+async def wait_for_file(path) -> int:
+    while not path.exists() or not path.read_text():
+        await asyncio.sleep(0.01)
+    return int(path.read_text())
+
+
+def test_cancelling_kills_the_commands_of_the_stages(tmp_path):
+    pid_file = tmp_path / "pid"
+
+    async def command():
+        return await run_command(*sleeping_command(pid_file))
+
+    async def main():
+        task = asyncio.ensure_future(run_stages([Stage("command", command)]))
+        pid = await wait_for_file(pid_file)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return pid
+
+    started = time.monotonic()
+    pid = asyncio.run(main())
+    assert time.monotonic() - started < 5
+    assert not process_exists(pid)
+
+
+def test_ctrl_c_cancels_the_running_stages(tmp_path):
+    pid_file = tmp_path / "pid"
+
+    async def command():
+        return await run_command(*sleeping_command(pid_file))
+
+    async def interrupt():
+        await wait_for_file(pid_file)
+        os.kill(os.getpid(), signal.SIGINT)
+        await asyncio.sleep(10)
+
+    with pytest.raises(asyncio.CancelledError):
+        run_until_interrupted(run_stages([Stage("command", command), Stage("interrupt", interrupt)]))
+    assert not process_exists(int(pid_file.read_text()))
+    # The handler is removed, Ctrl+C interrupts as usual again
+    assert signal.getsignal(signal.SIGINT) is signal.default_int_handler
+
+
+def test_run_command_returns_the_exit_code_and_output():
+    assert asyncio.run(run_command(sys.executable, "-c", "import sys; print('out'); sys.exit(3)")) == (3, "out\n")
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([Stage("a", None, depends_on=("b",)), Stage("b", None, depends_on=("a",))], "depend on each other"),
+    ([Stage("a", None, depends_on=("a",))], "depend on each other"),
+    ([Stage("a", None), Stage("b", None, depends_on=("c",)), Stage("c", None, depends_on=("d",)), Stage("d", None, depends_on=("b",))],
+     "b -> c -> d -> b"),
+    ([Stage("a", None, depends_on=("missing",))], "unknown stage missing"),
+    ([Stage("a", None), Stage("a", None)], "Duplicate stage names"),
+])
+def test_invalid_stages_are_rejected(stages, message):
+    with pytest.raises(ValueError, match=message):
+        stage_results(stages)
@@ -0,0 +1,99 @@
+import os
+import sys
+import socket
+import struct
+import threading
+
+import pytest
+
+from util.prober import BASE_PORT, ICMP_DEST_UNREACHABLE, ICMP_TIME_EXCEEDED, _parse_icmp_reply, _probe_id, probe
+from util.trace_route import iter_trace_route
+
+
+def _ip_header(protocol:int, source:str, destination:str) -> bytes:
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 0, 0, 0, 64, protocol, 0,
+                       socket.inet_aton(source), socket.inet_aton(destination))
+
+
+def icmp_reply(icmp_type:int, quoted_destination:str, source_port:int, destination_port:int,
+               quoted_protocol:int=socket.IPPROTO_UDP) -> bytes:
+    """
+    IP packet of an ICMP error quoting the header of a UDP probe, as received on a raw socket.
+    """
+    quoted = _ip_header(quoted_protocol, "192.0.2.1", quoted_destination) + struct.pack('!HHHH', source_port, destination_port, 40, 0)
+    icmp = struct.pack('!BBHI', icmp_type, 0, 0, 0) + quoted
+    return _ip_header(socket.IPPROTO_ICMP, "198.51.100.7", "192.0.2.1") + icmp
+
+
+def _raw_socket_available() -> bool:
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP).close()
+    except PermissionError:
+        return False
+    return True
+
+
+needs_raw_socket = pytest.mark.skipif(not _raw_socket_available(), reason="needs a raw ICMP socket (root or CAP_NET_RAW)")
+
+
+def test_parse_time_exceeded():
+    reply = _parse_icmp_reply(icmp_reply(ICMP_TIME_EXCEEDED, "203.0.113.5", 40000, BASE_PORT + 7))
+    assert reply == (ICMP_TIME_EXCEEDED, 0, "203.0.113.5", 40000, BASE_PORT + 7)
+
+
+def test_parse_ignores_other_packets():
+    assert _parse_icmp_reply(icmp_reply(0, "203.0.113.5", 40000, BASE_PORT)) is None  # echo reply
+    assert _parse_icmp_reply(icmp_reply(ICMP_TIME_EXCEEDED, "203.0.113.5", 40000, BASE_PORT, socket.IPPROTO_TCP)) is None
+    assert _parse_icmp_reply(icmp_reply(ICMP_TIME_EXCEEDED, "203.0.113.5", 40000, BASE_PORT)[:40]) is None
+
+
+def test_replies_to_other_probers_are_ignored():
+    reply = (ICMP_TIME_EXCEEDED, 0, "203.0.113.5", 40000, BASE_PORT + 7)
+    assert _probe_id(reply, "203.0.113.5", 40000, BASE_PORT, 90) == 7
+    # Same destination and probe port, but sent by another prober
+    assert _probe_id(reply, "203.0.113.5", 40001, BASE_PORT, 90) is None
+    assert _probe_id(reply, "203.0.113.6", 40000, BASE_PORT, 90) is None
+    assert _probe_id(reply, "203.0.113.5", 40000, BASE_PORT, 7) is None
+
+
+@needs_raw_socket
+def test_probe_loopback():
+    destination, records = probe("127.0.0.1", max_hops=3, queries=2, timeout=1)
+    assert destination == "127.0.0.1"
+    # The destination answers the first TTL, the larger ones are dropped
+    assert [(record['ttl'], record['ip'], record['icmp_type']) for record in records] == [(1, "127.0.0.1", ICMP_DEST_UNREACHABLE)] * 2
+    assert all(record['rtt'] >= 0 for record in records)
+
+
+@needs_raw_socket
+def test_concurrent_probes_to_the_same_destination():
+    results = [None] * 4
+
+    def run(index:int) -> None:
+        results[index] = probe("127.0.0.1", max_hops=2, queries=3, timeout=1)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for _, records in results:
+        assert len(records) == 3
+        assert all(record['ip'] == "127.0.0.1" for record in records)
+
+
+def test_unresolvable_target_falls_back_to_traceroute(tmp_path, monkeypatch):
+    traceroute = tmp_path / "traceroute"
+    traceroute.write_text(f"#!{sys.executable}\n"
+                          "print('traceroute to example.invalid (192.0.2.9), 30 hops max')\n"
+                          "print(' 1  192.0.2.9  1.0 ms  1.5 ms  2.0 ms')\n")
+    traceroute.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    def unresolvable(target_url, **kwargs):
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        yield
+
+    monkeypatch.setattr("util.trace_route.iter_probe_trace", unresolvable)
+    hops = list(iter_trace_route("example.invalid", "probe"))
+    assert [(hop.number, hop.ip_address, hop.rtt) for hop in hops] == [(0, "192.0.2.9", ()), (1, "192.0.2.9", (1.0, 1.5, 2.0))]
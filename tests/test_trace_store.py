@@ -0,0 +1,133 @@
+import sqlite3
+
+import pytest
+
+from caida.ixp_snapshot import load_snapshot
+from util.hop import Hop, OrgRecord, ip_to_int
+from util.trace_store import TraceStore, match_ixps, parse_time
+
+ORG = OrgRecord("RIPE", "80.81.192.0/21", "DE-CIX Management GmbH", "Frankfurt")
+
+
+def hops(*ips, location:str="Frankfurt, DE", org:OrgRecord=ORG) -> list[Hop]:
+    return [Hop.parse(number, ip, (1.0, 3.0)).replace(location=location, org=org) if ip else Hop(number)
+            for number, ip in enumerate(ips, 1)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    with TraceStore(str(tmp_path / "history.sqlite")) as store:
+        yield store
+
+
+@pytest.fixture
+def ixp_snapshot(write_dataset):
+    snapshot = load_snapshot(write_dataset("ixs_202307.jsonl", [(1, "DE-CIX Frankfurt", ["80.81.192.0/21"]),
+                                                                (2, "AMS-IX", ["80.249.208.0/21", "80.249.210.0/24"])]))
+    yield snapshot
+    snapshot.close()
+
+
+def test_round_trip(store):
+    store.add_trace("example.com", hops("192.168.1.1", None, "80.81.192.10", "2001:db8::1"), destination=ip_to_int("2001:db8::1"),
+                    traced_at=1000.0, download=95.5, upload="NA", latency=12.3)
+    store.flush()
+
+    ((trace_id, target, traced_at, hop_count, download, upload, latency),) = store.traces_of("example.com")
+    assert (target, traced_at, hop_count, download, upload, latency) == ("example.com", 1000.0, 4, 95.5, None, 12.3)
+    assert store.hops_of(trace_id) == [
+        (1, 2.0, "192.168.1.1", "Frankfurt, DE", *ORG.row()),
+        (2, None, None, None, None, None, None, None),
+        (3, 2.0, "80.81.192.10", "Frankfurt, DE", *ORG.row()),
+        (4, 2.0, "2001:db8::1", "Frankfurt, DE", *ORG.row()),
+    ]
+
+
+def test_traces_are_buffered_until_a_batch_is_full(tmp_path):
+    filename = str(tmp_path / "history.sqlite")
+    with TraceStore(filename, batch_size=2) as store:
+        store.add_trace("a.example", hops("8.8.8.8"))
+        assert store.traces_of("a.example") == []
+        store.add_trace("b.example", hops("8.8.8.8"))
+        assert len(store.traces_of("a.example")) == 1
+        store.add_trace("c.example", hops("8.8.8.8"))
+    # Closing writes the rest, and the history is kept across runs
+    with TraceStore(filename) as store:
+        assert store.stats()['traces'] == 3
+
+
+def test_organizations_and_locations_are_stored_once(store):
+    for target in ("a.example", "b.example", "c.example"):
+        store.add_trace(target, hops("8.8.8.8", "1.1.1.1"))
+    store.flush()
+    stats = store.stats()
+    assert (stats['traces'], stats['hops'], stats['orgs'], stats['locations']) == (3, 6, 1, 1)
+
+
+def test_traces_through_an_ip_address_or_network(store):
+    store.add_trace("a.example", hops("8.8.8.8", "80.81.192.10"), traced_at=1000.0)
+    store.add_trace("b.example", hops("8.8.4.4", "2001:db8::1"), traced_at=2000.0)
+    store.add_trace("c.example", hops("80.81.193.1"), traced_at=3000.0)
+    store.flush()
+
+    assert [row[1:5] for row in store.traces_through("8.8.8.8")] == [("a.example", 1000.0, 1, "8.8.8.8")]
+    assert [row[1] for row in store.traces_through("80.81.192.0/21")] == ["c.example", "a.example"]
+    assert [row[1] for row in store.traces_through("8.8.0.0/16", since=1500.0)] == ["b.example"]
+    assert [row[1] for row in store.traces_through("80.81.192.0/21", until=2000.0)] == ["a.example"]
+    assert [row[4] for row in store.traces_through("2001:db8::/32")] == ["2001:db8::1"]
+    assert store.traces_through("9.9.9.9") == []
+
+
+def test_traces_through_an_ixp(tmp_path, ixp_snapshot):
+    with TraceStore(str(tmp_path / "history.sqlite"), ixp_snapshot) as store:
+        store.add_trace("a.example", hops("8.8.8.8", "80.81.192.10", "80.249.210.5"), traced_at=1000.0)
+        store.add_trace("b.example", hops("8.8.8.8", "80.249.209.1"), traced_at=2000.0)
+        store.flush()
+
+        assert [row[1:] for row in store.traces_through_ixp(1)] == [
+            ("a.example", 1000.0, 2, "80.81.192.10", "DE-CIX Frankfurt", "80.81.192.0/21", "ixs_202307")]
+        # Longest prefix match
+        assert [(row[1], row[6]) for row in store.traces_through_ixp(2)] == [("b.example", "80.249.208.0/21"),
+                                                                             ("a.example", "80.249.210.0/24")]
+        assert store.traces_through_ixp(2, snapshot="ixs_202308") == []
+        ((name, _, _, traces, matches),) = store.snapshots()
+        assert (name, traces, matches) == ("ixs_202307", 2, 3)
+
+
+def test_match_ixps(ixp_snapshot):
+    matches = match_ixps(hops("8.8.8.8", "80.249.210.5", "2001:db8::1", None), ixp_snapshot)
+    assert matches == [(2, ip_to_int("80.249.210.5"), 2, "AMS-IX", "80.249.210.0/24")]
+
+
+def test_failed_batches_are_rolled_back(store):
+    store.add_trace("a.example", hops("8.8.8.8"))
+    store.flush()
+    store.add_trace("b.example", hops("1.1.1.1", location="Sydney, AU", org=OrgRecord("APNIC", "1.1.1.0/24", "APNIC", "Brisbane"))
+                    + [Hop(2, "not an address")])
+    with pytest.raises(TypeError):
+        store.flush()
+    assert store.stats()['traces'] == 1
+    # The ids given out in the failed transaction are not reused
+    store.add_trace("c.example", hops("1.1.1.1", location="Sydney, AU", org=OrgRecord("APNIC", "1.1.1.0/24", "APNIC", "Brisbane")))
+    store.flush()
+    ((trace_id, *_),) = store.traces_of("c.example")
+    assert store.hops_of(trace_id)[0][3:5] == ("Sydney, AU", "APNIC")
+
+
+def test_traces_stay_buffered_while_the_database_is_locked(store):
+    store.add_trace("a.example", hops("8.8.8.8"))
+    store._connection.execute("PRAGMA busy_timeout = 10")
+    other = sqlite3.connect(store.filename, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    store.add_trace("b.example", hops("1.1.1.1"))
+    other.execute("ROLLBACK")
+    other.close()
+    assert store.flush() == 2
+    assert [len(store.traces_of(target)) for target in ("a.example", "b.example")] == [1, 1]
+
+
+def test_parse_time():
+    assert parse_time("2023-11-01") < parse_time("2023-11-01T08:00")
+    assert abs(parse_time("0s") - parse_time("1m") - 60) < 1
@@ -0,0 +1,230 @@
+import time
+import asyncio
+import threading
+import ipaddress
+import socketserver
+
+import pytest
+
+from util import whois_client
+from util.whois_client import ROOT_SERVER, WhoisClient, WhoisServer, parse_server_option
+
+
+class StandInServer:
+    """
+    Loopback whois server answering each query with answer(query).
+
+    Like the RIPE database, a keep_alive server keeps the connection open for further queries when the
+    first one starts with "-k", and ends each response with two empty lines, written in separate chunks.
+
+    :param latency: Seconds each query takes.
+    :param close_after: Close a kept connection after this many queries, as a server timing out idle connections would.
+    """
+
+    def __init__(self, answer, keep_alive:bool=False, latency:float=0.0, close_after:int=None):
+        self.queries = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                with lock:
+                    server.connections += 1
+                kept = False
+                served = 0
+                for line in self.rfile:
+                    query = line.decode('utf-8').strip()
+                    with lock:
+                        server.queries.append(query)
+                        server.active += 1
+                        server.max_active = max(server.max_active, server.active)
+                    if keep_alive and query.startswith('-k '):
+                        kept, query = True, query[3:]
+                    time.sleep(latency)
+                    with lock:
+                        server.active -= 1
+                    self.wfile.write(answer(query).encode())
+                    if not kept:
+                        return
+                    for chunk in (b"\n", b"\n"):
+                        self.wfile.flush()
+                        self.wfile.write(chunk)
+                    served += 1
+                    if close_after is not None and served >= close_after:
+                        return
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def iana_answer(query:str) -> str:
+    network = ipaddress.ip_network(f"{query}/8", strict=False)
+    registry = "whois.ripe.net" if network.network_address.packed[0] == 193 else "whois.arin.net"
+    return (f"% IANA WHOIS server\n\nrefer:        {registry}\n\n"
+            f"inetnum:      {network.network_address} - {network.broadcast_address}\nstatus:       ALLOCATED\n")
+
+
+def registry_answer(query:str) -> str:
+    # Query formats such as "n + 8.8.8.8" of ARIN: the address is the last word
+    query = query.split()[-1]
+    # An empty line inside the record, which must not be taken for the end of a keep-alive response
+    return f"% Record of {query}\n\ninetnum:        {query} - {query}\nnetname:        TEST-NET\n"
+
+
+@pytest.fixture
+def stand_ins():
+    servers = {'iana': StandInServer(iana_answer, latency=0.05),
+               'ripe': StandInServer(registry_answer, keep_alive=True),
+               'arin': StandInServer(registry_answer)}
+    yield servers
+    for server in servers.values():
+        server.close()
+
+
+def server_map(stand_ins:dict, **max_connections) -> dict:
+    return {
+        ROOT_SERVER: WhoisServer("127.0.0.1", stand_ins['iana'].port, max_connections=max_connections.get('iana', 4)),
+        "whois.ripe.net": WhoisServer("127.0.0.1", stand_ins['ripe'].port, keep_alive=True, max_connections=max_connections.get('ripe', 4)),
+        "whois.arin.net": WhoisServer("127.0.0.1", stand_ins['arin'].port, query_format="n + {query}",
+                                      max_connections=max_connections.get('arin', 4)),
+    }
+
+
+def test_referrals_are_followed_and_cached_per_range(stand_ins):
+    with WhoisClient(server_map(stand_ins)) as client:
+        assert client.query("193.0.6.139") == registry_answer("193.0.6.139")
+        assert client.query("193.200.1.1") == registry_answer("193.200.1.1")
+        assert client.query("8.8.8.8") == registry_answer("8.8.8.8")
+
+        # The second address of 193.0.0.0/8 went straight to RIPE
+        assert stand_ins['iana'].queries == ["193.0.6.139", "8.8.8.8"]
+        assert stand_ins['ripe'].queries == ["-k 193.0.6.139", "193.200.1.1"]
+        assert stand_ins['arin'].queries == ["n + 8.8.8.8"]
+        assert client.stats()['referral_hits'] == 1
+        assert client.stats()['referral_ranges'] == 2
+
+
+def test_keep_alive_connections_are_reused(stand_ins):
+    with WhoisClient(server_map(stand_ins)) as client:
+        responses = [client.query(f"193.0.0.{host}") for host in range(1, 6)]
+
+    assert responses == [registry_answer(f"193.0.0.{host}") for host in range(1, 6)]
+    assert stand_ins['ripe'].connections == 1
+    # Only the first query of the connection asks to keep it open
+    assert stand_ins['ripe'].queries == ["-k 193.0.0.1"] + [f"193.0.0.{host}" for host in range(2, 6)]
+
+
+def test_connections_closed_by_the_server_are_replaced(stand_ins):
+    ripe = StandInServer(registry_answer, keep_alive=True, close_after=1)
+    servers = server_map(stand_ins)
+    servers["whois.ripe.net"].port = ripe.port
+    try:
+        with WhoisClient(servers) as client:
+            responses = [client.query(f"193.0.0.{host}") for host in range(1, 4)]
+            assert responses == [registry_answer(f"193.0.0.{host}") for host in range(1, 4)]
+            assert ripe.connections == 3
+            assert ripe.queries == ["-k 193.0.0.1", "-k 193.0.0.2", "-k 193.0.0.3"]
+    finally:
+        ripe.close()
+
+
+def test_concurrent_queries_into_a_block_ask_iana_once(stand_ins):
+    ips = [f"193.{index}.0.1" for index in range(20)]
+    responses = {}
+    with WhoisClient(server_map(stand_ins)) as client:
+        threads = [threading.Thread(target=lambda ip=ip: responses.__setitem__(ip, client.query(ip))) for ip in ips]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert responses == {ip: registry_answer(ip) for ip in ips}
+    assert len(stand_ins['iana'].queries) == 1
+    assert client.stats()['referral_ranges'] == 1
+
+
+def test_concurrent_queries_per_server_are_limited(stand_ins):
+    slow = StandInServer(registry_answer, latency=0.1)
+    # No referral from this root server: every query is answered by it, one /8 each so that none waits for another
+    client = WhoisClient({ROOT_SERVER: WhoisServer("127.0.0.1", slow.port, max_connections=2)})
+    try:
+        threads = [threading.Thread(target=client.query, args=(f"{index}.0.0.1",)) for index in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(slow.queries) == 8
+        assert slow.max_active == 2
+    finally:
+        client.close()
+        slow.close()
+
+
+def test_unreachable_server():
+    with WhoisClient({ROOT_SERVER: WhoisServer("127.0.0.1", 9)}, timeout=1) as client:
+        with pytest.raises(OSError):
+            client.query("8.8.8.8")
+
+
+def test_aquery(stand_ins):
+    async def run(client:WhoisClient) -> list[str]:
+        ips = [f"193.{index}.0.1" for index in range(20)] + ["8.8.8.8", "8.8.4.4"]
+        responses = await asyncio.gather(*(client.aquery(ip) for ip in ips))
+        assert responses == [registry_answer(ip) for ip in ips]
+        # Once the referrals are known, the kept connections to RIPE serve the next queries
+        return await asyncio.gather(*(client.aquery(f"193.0.0.{host}") for host in range(1, 9)))
+
+    with WhoisClient(server_map(stand_ins, ripe=2)) as client:
+        responses = asyncio.run(run(client))
+
+    assert responses == [registry_answer(f"193.0.0.{host}") for host in range(1, 9)]
+    assert len(stand_ins['iana'].queries) == 2
+    assert stand_ins['arin'].queries == ["n + 8.8.8.8", "n + 8.8.4.4"]
+    assert stand_ins['ripe'].max_active <= 2
+    assert stand_ins['ripe'].connections == 2
+
+
+def test_aquery_replaces_connections_closed_by_the_server(stand_ins):
+    ripe = StandInServer(registry_answer, keep_alive=True, close_after=1)
+    servers = server_map(stand_ins)
+    servers["whois.ripe.net"].port = ripe.port
+
+    async def run(client:WhoisClient) -> list[str]:
+        return [await client.aquery(f"193.0.0.{host}") for host in range(1, 4)]
+
+    try:
+        with WhoisClient(servers) as client:
+            assert asyncio.run(run(client)) == [registry_answer(f"193.0.0.{host}") for host in range(1, 4)]
+        assert ripe.connections == 3
+    finally:
+        ripe.close()
+
+
+def test_parse_server_option():
+    name, server = parse_server_option("whois.ripe.net=127.0.0.1:4343")
+    assert (name, server.host, server.port, server.keep_alive) == ("whois.ripe.net", "127.0.0.1", 4343, True)
+    name, server = parse_server_option("whois.arin.net=localhost")
+    assert (server.host, server.port, server.query_format) == ("localhost", 43, "n + {query}")
+    for option in ("whois.ripe.net", "=localhost", "whois.ripe.net=localhost:port"):
+        with pytest.raises(ValueError):
+            parse_server_option(option)
+
+
+def test_shared_client(stand_ins):
+    client = WhoisClient(server_map(stand_ins))
+    previous = whois_client.set_client(client)
+    try:
+        assert whois_client.get_client() is client
+        assert whois_client.whois("8.8.8.8") == registry_answer("8.8.8.8")
+    finally:
+        whois_client.set_client(previous)
+        client.close()
@@ -0,0 +1,251 @@
+from concurrent.futures import Future
+
+import pytest
+
+from util.gpt_whois import summarize_whois
+from util.whois_parser import DEFAULT_MIN_CONFIDENCE, detect_registry, parse_whois, split_objects
+
+# Response of whois.arin.net to "n + 8.8.8.8": the parent allocation, then the reassignment
+ARIN_MULTI = """
+#
+# ARIN WHOIS data and services are subject to the Terms of Use
+# available at: https://www.arin.net/resources/registry/whois/tou/
+#
+
+NetRange:       8.0.0.0 - 8.127.255.255
+CIDR:           8.0.0.0/9
+NetName:        LVLT-ORG-8-8
+NetHandle:      NET-8-0-0-0-1
+Parent:         NET8 (NET-8-0-0-0-0)
+NetType:        Direct Allocation
+Organization:   Level 3 Parent, LLC (LPL-141)
+RegDate:        1992-12-01
+Updated:        2018-04-23
+
+OrgName:        Level 3 Parent, LLC
+OrgId:          LPL-141
+Address:        100 CenturyLink Drive
+City:           Monroe
+StateProv:      LA
+PostalCode:     71203
+Country:        US
+
+NetRange:       8.8.8.0 - 8.8.8.255
+CIDR:           8.8.8.0/24
+NetName:        GOGL
+NetHandle:      NET-8-8-8-0-2
+Parent:         LVLT-ORG-8-8 (NET-8-0-0-0-1)
+NetType:        Direct Allocation
+Organization:   Google LLC (GOGL)
+RegDate:        2023-12-28
+Updated:        2023-12-28
+
+OrgName:        Google LLC
+OrgId:          GOGL
+Address:        1600 Amphitheatre Parkway
+City:           Mountain View
+StateProv:      CA
+PostalCode:     94043
+Country:        US
+RegDate:        2000-03-30
+
+OrgAbuseHandle: ABUSE5250-ARIN
+OrgAbuseName:   Abuse
+"""
+
+ARIN = """
+NetRange:       38.0.0.0 - 38.255.255.255
+CIDR:           38.0.0.0/8
+NetName:        COGENT-A
+Organization:   PSINet, Inc. (PSI)
+
+OrgName:        PSINet, Inc.
+OrgId:          PSI
+Address:        2450 N Street NW
+City:           Washington
+StateProv:      DC
+PostalCode:     20037
+Country:        US
+"""
+
+RIPE = """
+% This is the RIPE Database query service.
+% The objects are in RPSL format.
+
+% Information related to '193.0.0.0 - 193.0.7.255'
+
+inetnum:        193.0.0.0 - 193.0.7.255
+netname:        RIPE-NCC
+descr:          RIPE Network Coordination Centre
+org:            ORG-RIEN1-RIPE
+country:        NL
+admin-c:        BRD-RIPE
+status:         ASSIGNED PA
+mnt-by:         RIPE-NCC-MNT
+source:         RIPE
+
+organisation:   ORG-RIEN1-RIPE
+org-name:       Reseaux IP Europeens Network Coordination Centre (RIPE NCC)
+org-type:       RIR
+address:        P.O. Box 10096
+address:        1001 EB
+address:        Amsterdam
+address:        NETHERLANDS
+source:         RIPE
+
+% This query was served by the RIPE Database Query Service version 1.112 (SHETLAND)
+"""
+
+APNIC = """
+% [whois.apnic.net]
+% Whois data copyright terms    http://www.apnic.net/db/dbcopyright.html
+
+% Information related to '1.1.1.0 - 1.1.1.255'
+
+inetnum:        1.1.1.0 - 1.1.1.255
+netname:        APNIC-LABS
+descr:          APNIC and Cloudflare DNS Resolver project
+country:        AU
+org:            ORG-ARAD1-AP
+admin-c:        AIC3-AP
+status:         ASSIGNED PORTABLE
+source:         APNIC
+
+irt:            IRT-APNICRANDNET-AU
+address:        PO Box 3646
+address:        South Brisbane, QLD 4101
+address:        Australia
+source:         APNIC
+
+organisation:   ORG-ARAD1-AP
+org-name:       APNIC Research and Development
+country:        AU
+address:        6 Cordelia St
+source:         APNIC
+"""
+
+LACNIC = """
+% Copyright LACNIC lacnic.net
+%  The data below is provided for information purposes
+%  and to assist persons in obtaining information about or
+
+inetnum:     200.160/20
+status:      allocated
+aut-num:     N/A
+owner:       Núcleo de Inf. e Coord. do Ponto BR - NIC.BR
+ownerid:     005.506.560/0001-36
+responsible: Frederico A C Neves
+address:     Av. das Nações Unidas, 11541, 7º andar
+address:     04578-000 - São Paulo - SP
+country:     BR
+created:     19980101
+changed:     20090902
+"""
+
+AFRINIC = """
+% This is the AfriNIC Whois server.
+
+% Note: this output has been filtered.
+
+% Information related to '196.216.2.0 - 196.216.3.255'
+
+inetnum:        196.216.2.0 - 196.216.3.255
+netname:        AFRINIC-Pretoria-IPv4
+descr:          AFRINIC - Pretoria, South Africa - IPv4
+country:        ZA
+org:            ORG-AFNC1-AFRINIC
+status:         ASSIGNED PI
+source:         AFRINIC # Filtered
+
+organisation:   ORG-AFNC1-AFRINIC
+org-name:       African Network Information Center - ( AFRINIC )
+org-type:       RIR
+country:        MU
+address:        11th Floor, Standard Chartered Tower
+address:        Cybercity
+address:        Ebene
+source:         AFRINIC # Filtered
+"""
+
+
+@pytest.mark.parametrize("whois_result, ip_address, expected", [
+    (ARIN_MULTI, "8.8.8.8", {'Regional Registry': 'ARIN', 'Network Range': "8.8.8.0 - 8.8.8.255", 'Organization': "Google LLC",
+                             'Address': "1600 Amphitheatre Parkway, Mountain View, CA, 94043, US"}),
+    (ARIN, "38.140.44.154", {'Regional Registry': 'ARIN', 'Network Range': "38.0.0.0 - 38.255.255.255", 'Organization': "PSINet, Inc.",
+                             'Address': "2450 N Street NW, Washington, DC, 20037, US"}),
+    (RIPE, "193.0.6.139", {'Regional Registry': 'RIPE', 'Network Range': "193.0.0.0 - 193.0.7.255",
+                           'Organization': "Reseaux IP Europeens Network Coordination Centre (RIPE NCC)",
+                           'Address': "P.O. Box 10096, 1001 EB, Amsterdam, NETHERLANDS, NL"}),
+    (APNIC, "1.1.1.1", {'Regional Registry': 'APNIC', 'Network Range': "1.1.1.0 - 1.1.1.255",
+                        'Organization': "APNIC Research and Development", 'Address': "6 Cordelia St, AU"}),
+    (LACNIC, "200.160.2.3", {'Regional Registry': 'LACNIC', 'Network Range': "200.160.0.0/20",
+                             'Organization': "Núcleo de Inf. e Coord. do Ponto BR - NIC.BR",
+                             'Address': "Av. das Nações Unidas, 11541, 7º andar, 04578-000 - São Paulo - SP, BR"}),
+    (AFRINIC, "196.216.2.1", {'Regional Registry': 'AFRINIC', 'Network Range': "196.216.2.0 - 196.216.3.255",
+                              'Organization': "African Network Information Center - ( AFRINIC )",
+                              'Address': "11th Floor, Standard Chartered Tower, Cybercity, Ebene, ZA"}),
+])
+def test_registry_records_are_parsed_without_gpt(whois_result, ip_address, expected):
+    org_detail, confidence = parse_whois(whois_result, ip_address)
+    assert org_detail == expected
+    assert confidence >= DEFAULT_MIN_CONFIDENCE
+
+
+def test_split_objects_drops_comments_and_joins_continuation_lines():
+    objects = split_objects("% comment\ninetnum: 10.0.0.0 - 10.0.0.255\ndescr:   first\n         second\n\n# more\nsource: RIPE\n")
+    assert objects == [[('inetnum', "10.0.0.0 - 10.0.0.255"), ('descr', "first second")], [('source', "RIPE")]]
+
+
+def test_detect_registry_from_the_text():
+    assert detect_registry("% whois.apnic.net referral\n", []) == 'APNIC'
+    assert detect_registry(ARIN, split_objects(ARIN)) == 'ARIN'
+    assert detect_registry("", []) is None
+
+
+def test_a_range_not_containing_the_ip_address_lowers_the_confidence():
+    _, confidence = parse_whois(RIPE, "193.0.6.139")
+    _, elsewhere = parse_whois(RIPE, "8.8.8.8")
+    assert elsewhere < DEFAULT_MIN_CONFIDENCE <= confidence
+
+
+@pytest.mark.parametrize("whois_result", [
+    "",
+    "% No entries found for the selected source(s).\n",
+    # A network object without organization nor address
+    "inetnum:        10.0.0.0 - 10.0.0.255\nstatus:         ASSIGNED PA\n",
+    # An organization without network range
+    "organisation:   ORG-EX1-RIPE\norg-name:       Example\nsource:         RIPE\n",
+    # Registry unknown
+    "network:        something\nowner-name:     Example Org\n",
+])
+def test_incomplete_records_have_a_low_confidence(whois_result):
+    _, confidence = parse_whois(whois_result, "10.0.0.1")
+    assert confidence < DEFAULT_MIN_CONFIDENCE
+
+
+class FakeBatcher:
+    model = "stub-model"
+
+    def __init__(self):
+        self.records = []
+
+    def submit(self, ip_address:str, whois_result:str) -> Future:
+        self.records.append(ip_address)
+        future = Future()
+        future.set_result({'Regional Registry': 'RIPE', 'Network Range': "10.0.0.0/24", 'Organization': "From GPT", 'Address': None})
+        return future
+
+
+@pytest.mark.parametrize("whois_result", ["", "% No entries found.\n", "inetnum: 10.0.0.0 - 10.0.0.255\n"])
+def test_low_confidence_records_go_to_gpt(whois_result):
+    batcher = FakeBatcher()
+    org_detail, source = summarize_whois("10.0.0.1", whois_result, llm_batcher=batcher)
+    assert (source, org_detail['Organization'], batcher.records) == ("gpt", "From GPT", ["10.0.0.1"])
+
+
+def test_parsed_records_skip_gpt():
+    batcher = FakeBatcher()
+    org_detail, source = summarize_whois("193.0.6.139", RIPE, llm_batcher=batcher)
+    assert (source, org_detail['Network Range'], batcher.records) == ("parser", "193.0.0.0/21", [])
+    # Without the fast path, every record goes to GPT
+    assert summarize_whois("193.0.6.139", RIPE, fast_path=False, llm_batcher=batcher)[1] == "gpt"
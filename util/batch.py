@@ -0,0 +1,101 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from util.trace_route import LocationClient
+from util.gpt_whois import OrgResolver, integrate_ip_info
+from util.pipeline import trace_and_enrich
+from util.csv_helper import write_batch_summary_header, append_batch_summary
+from util.trace_store import TraceStore
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+def read_targets(filename:str) -> list[str]:
+    """
+    Read the target URLs of a batch run, one per line. Blank lines and lines starting with # are ignored.
+
+    :param filename: Name of the targets file.
+    :return: List of target URLs, without duplicates, in file order.
+    """
+    targets = []
+    seen = set()
+    with open(filename, 'r') as file:
+        for line in file:
+            target = line.strip()
+            if target and not target.startswith('#') and target not in seen:
+                seen.add(target)
+                targets.append(target)
+    return targets
+
+def read_completed_targets(state_filename:str) -> set[str]:
+    """
+    Read the targets already completed by a previous, interrupted, batch run.
+    """
+    if not os.path.exists(state_filename):
+        return set()
+    with open(state_filename, 'r') as file:
+        return {line.strip() for line in file if line.strip()}
+
+def run_batch(targets:list[str], output_filename:str, location_client:LocationClient, org_resolver:OrgResolver,
+              max_parallel:int=4, resume:bool=False, engine:str="system", trace_store:TraceStore=None) -> dict[str, int]:
+    """
+    Trace and analyse many targets, with up to max_parallel traceroutes running at the same time.
+
+    Every target shares the same location client and organization resolver, so a network range is
+    only resolved once per batch. The results of all targets are appended to one summary CSV file as
+    each target completes, and completed targets are recorded in `output_filename.done` so that an
+    interrupted batch can be resumed.
+
+    :param targets: List of target URLs.
+    :param output_filename: Name of the combined summary CSV file.
+    :param location_client: LocationClient shared by all targets.
+    :param org_resolver: OrgResolver shared by all targets.
+    :param max_parallel: Number of traceroutes running at the same time.
+    :param resume: Skip the targets completed by a previous run into the same output file.
+    :param engine: traceroute engine, "system" or "probe", see `iter_trace_route`.
+    :param trace_store: Optional `util.trace_store.TraceStore` every completed target is also recorded to.
+    :return: Dictionary of the hop count of each target completed by this run.
+    """
+    state_filename = f"{output_filename}.done"
+    completed_targets = read_completed_targets(state_filename) if resume else set()
+    if not completed_targets or not os.path.exists(output_filename):
+        completed_targets = set()
+        write_batch_summary_header(output_filename)
+        open(state_filename, 'w').close()
+
+    pending_targets = [target for target in targets if target not in completed_targets]
+    total = len(targets)
+    done = total - len(pending_targets)
+    if done:
+        logger.info(f"Resuming batch: {done}/{total} targets already completed")
+
+    write_lock = threading.Lock()
+    hop_counts = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="traceroute")
+    try:
+        futures = {executor.submit(trace_and_enrich, target, location_client, org_resolver, engine): target for target in pending_targets}
+        for future in as_completed(futures):
+            target = futures[future]
+            try:
+                hops, org_record_list, hop_count = future.result()
+            except Exception as e:
+                logger.error(f"Trace Route to {target} failed: {e}")
+                continue
+
+            hops = integrate_ip_info(hops, org_record_list)
+            with write_lock:
+                append_batch_summary(output_filename, target, hop_count, hops)
+                if trace_store is not None:
+                    trace_store.add_trace(target, hops, hop_count)
+                with open(state_filename, 'a') as state_file:
+                    state_file.write(f"{target}\n")
+            hop_counts[target] = hop_count
+            done += 1
+            logger.info(f"[{done}/{total}] {target}: {hop_count} hops, {len(hops)} public hops, {len(org_record_list)} organizations")
+    finally:
+        # Do not start the remaining targets if interrupted, the batch can be resumed later
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return hop_counts
@@ -1,5 +1,9 @@
 import csv
 
+from util.hop import Hop, ORG_DETAIL_FIELDS
+from util.timing import timed
+
+@timed(category="csv")
 def write_org_detail_to(data: list[dict], filename:str)-> None:
     """
     Write a list of dictionaries to a CSV file.
@@ -20,6 +24,7 @@ def write_org_detail_to(data: list[dict], filename:str)-> None:
             writer.writerow(row)
 
 
+@timed(category="csv")
 def write_ip_location_to(data:dict[str, str], header: tuple[str, str], filename:str)->None: 
     """
     Write a dictionary to a CSV file with header specified in header tuple(header_for_key, header_for_value)
@@ -39,6 +44,7 @@ def write_ip_location_to(data:dict[str, str], header: tuple[str, str], filename:
             writer.writerow([key, value])
 
 
+@timed(category="csv")
 def write_summary_stats_to(filename:str, download:str, upload:str, latency:str, hop_count:int, )->None: 
     """
     Write download speed, upload speed, and ping latency in to a CSV file with following format 
@@ -59,12 +65,13 @@ def write_summary_stats_to(filename:str, download:str, upload:str, latency:str,
         writer = csv.writer(csvfile)
         writer.writerows(rows)
 
-def write_ip_info(filename: str, data: list[list[str]]) -> None:
+@timed(category="csv")
+def write_ip_info(filename: str, hops: list[Hop]) -> None:
     """
-    Append the provided data to a CSV file.
+    Append the provided hops to a CSV file.
 
     :param filename (str): Name of the CSV file to write to.
-    :param data (list[list[str]]): 2D list containing IP information.
+    :param hops (list[Hop]): Hops with their location and organization.
     """
 
     with open(filename, 'a', newline='') as file:
@@ -74,8 +81,39 @@ def write_ip_info(filename: str, data: list[list[str]]) -> None:
         writer.writerow([])
 
         # Write the headers
-        headers = ['IP Address', 'Location', 'Regional Registry', 'Network Range', 'Organization', 'Address']
+        headers = ['IP Address', 'Location', *ORG_DETAIL_FIELDS]
         writer.writerow(headers)
 
-        # Write the data row by row
-        writer.writerows(data)
\ No newline at end of file
+        # Write the data row by row, the hops are only rendered to strings here
+        writer.writerows(hop.row() for hop in hops)
+
+BATCH_SUMMARY_HEADERS = ['Target', 'Number of Hops', 'IP Address', 'Location', *ORG_DETAIL_FIELDS]
+
+@timed(category="csv")
+def write_batch_summary_header(filename: str) -> None:
+    """
+    Create the combined summary CSV file of a batch run, with its headers.
+
+    :param filename (str): Name of the CSV file to write to.
+    """
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(BATCH_SUMMARY_HEADERS)
+
+@timed(category="csv")
+def append_batch_summary(filename: str, target: str, hop_count: int, hops: list[Hop]) -> None:
+    """
+    Append the IP information of one target to the combined summary CSV file of a batch run.
+
+    :param filename (str): Name of the CSV file to write to.
+    :param target (str): Target URL of the traceroute.
+    :param hop_count (int): Number of hops to the target.
+    :param hops (list[Hop]): Hops with their location and organization, as written by `write_ip_info`.
+    """
+    with open(filename, 'a', newline='') as file:
+        writer = csv.writer(file)
+        if not hops:
+            # Keep a row for targets without any public hop so that every target appears in the summary
+            writer.writerow([target, hop_count])
+        for hop in hops:
+            writer.writerow([target, hop_count] + hop.row())
@@ -1,14 +1,22 @@
-import subprocess
-import openai
 import logging
 import ipaddress
 import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
-# Obtain API key from `key` file stored in the project root directory
-openai.api_key = open("key", "r").read().strip('\n')
+from util.ip_range_index import IPRangeIndex, parse_networks
+from util.hop import Hop, OrgRecord
+from util.whois_parser import parse_whois, DEFAULT_MIN_CONFIDENCE
+from util.llm_batch import LLMBatcher, LLMExtractionError, DEFAULT_MODEL, PROMPT_VERSION as BATCH_PROMPT_VERSION
+from util.timing import timed
+from util.whois_client import whois
+from util.openai_client import get_openai, openai_errors
 
 logger:logging.Logger = logging.getLogger(__name__)
 
+# Change whenever the prompt of `query_gpt` or `parse_summary` changes, cached summaries are keyed by it
+PROMPT_VERSION = "single-1"
+
 def filter_private_ips(ip_address_list: list[str])->list[str]:
     """
     Filter out private IP addresses from the provided list.
@@ -57,154 +65,362 @@ def to_cidr(ip_address_range:str)->str:
         logger.error(f"Could not convert: {ip_address_range} to CIDR notation")
         pass
 
-        
-def match_ip_to_org(ip_address_range_dict:dict[str:str], ip_address:str)->tuple[str:str]:
+
+def build_ip_range_index(ip_address_range_dict:dict[str:str])->IPRangeIndex:
     """
-    Find the IP address range and organization for a given IP address.
+    Build an IP range index from a dictionary of IP address ranges and organizations.
 
     :param ip_address_range_dict: Dictionary with IP address ranges as keys and organizations as values.
+    :return: IPRangeIndex mapping each range to a tuple of (IP address range, organization).
+    """
+    return IPRangeIndex.from_networks((network, (ip_range, org))
+                                      for ip_range, org in ip_address_range_dict.items()
+                                      for network in parse_networks(ip_range))
+
+def match_ip_to_org(ip_range_index:IPRangeIndex, ip_address:str)->tuple[str:str]:
+    """
+    Find the IP address range and organization for a given IP address.
+
+    :param ip_range_index: IPRangeIndex of (IP address range, organization) tuples,
+        or a dictionary with IP address ranges as keys and organizations as values.
     :param ip_address: IP address to search for.
     :return: Tuple of (IP address range, organization) or None.
     """
+    if isinstance(ip_range_index, dict):
+        ip_range_index = build_ip_range_index(ip_range_index)
+
     logger.info(f"Checking if {ip_address} was found previously")
-    for ip_range, org in ip_address_range_dict.items():
-        # Convert the range and IP to network and IP objects
-        try:
-            if ipaddress.ip_address(ip_address) in ipaddress.ip_network(ip_range):
-                logger.info(f"{ip_address} belongs to {ip_address_range_dict[ip_range]}")
-                return (ip_range, org)
-        except ValueError:
-            # This will happen if the ip_range is not a valid format. 
-            logger.info(f"{ip_address} is not found in any identified organizations")
-            continue
+    result = ip_range_index.lookup(ip_address)
+    if result is None:
+        logger.info(f"{ip_address} is not found in any identified organizations")
+        return None
 
-    return None
+    logger.info(f"{ip_address} belongs to {result[1]}")
+    return result
 
-def identify_org_details(ip_address_list: list[str])-> list[dict[str:str]]:
+@timed("whois", "network")
+def run_whois(ip_address:str)->str:
+    """
+    Query the whois record of an IP address, with the shared `util.whois_client.WhoisClient`.
 
-    ip_address_range_dict = {} 
-    org_detail_list = []
-    org_peering_list = []
+    :param ip_address: IP address to query.
+    :return: whois record of the registry of the IP address.
+    """
+    return whois(ip_address)
 
-    for ip_address in ip_address_list: 
+@timed("gpt", "llm")
+def query_gpt(ip_address:str, whois_result:str, retry_count:int=3, wait_time:float=3)->str:
+    """
+    Ask GPT to summarize the whois details of an IP address.
+
+    :param ip_address: IP address queried.
+    :param whois_result: Output of the whois command for the IP address.
+    :return: Summary in "Field:Value" lines.
+    """
+    # openai is imported, and the API key read, on the first call
+    openai = get_openai()
+    for attempt in range(retry_count): 
+        try: 
+            # Pass the result of whois to ChatGPT to identify the Regional Registry, Organization, Network Range,and Address
+            response = openai.ChatCompletion.create(
+                model = "gpt-3.5-turbo",
+                messages =[
+                    {
+                        "role":"user", 
+                        "content": f"From the whois details in {whois_result} for ip address {ip_address}, identify the Regional Registry, Network Range, Organization,and Address for {ip_address}. Present the solution in following format:\nRegional Registry:Regional_Registry_Identified\nOrganization:`Organization_identified`\nNetwork Range:`Network_Range_Identified`\nAddress:`Address_Identified",
+                    }
+                ],
+                max_tokens=200
+                )
+            return response['choices'][0]['message']['content']
+        except openai.error.OpenAIError as e: 
+            logger.error(f"Error on attempt {attempt + 1}: {e}")
+            # if this is the last attempt, raise exception 
+            if attempt == retry_count - 1:
+                raise
+            # If not the last attempt, wait for a bit longer after each failure before retrying
+            time.sleep(wait_time * 2 ** attempt)
+
+def parse_summary(summary:str)->dict[str:str]:
+    """
+    Extract the organization details from the summary given by GPT.
+
+    :param summary: Summary in "Field:Value" lines.
+    :return: Dictionary of organization details, with the network range converted to CIDR format.
+    """
+    regional_registry = None
+    network_range = None
+    organization = None
+    address = None
+    
+    for line in summary.split('\n'):
+        if 'Organization' in line:
+            organization = line.split(':')[-1].strip()
+        elif 'Network Range' in line:
+            network_range = line.split(':')[-1].strip()
+        elif 'Regional Registry' in line:
+            regional_registry = line.split(':')[-1].strip()
+        elif 'Address' in line:
+            address = line.split(':')[-1].strip()
+
+    return {
+        'Regional Registry': regional_registry,
+        # convert the network range to CIDR format 
+        'Network Range': to_cidr(network_range),
+        'Organization': organization,
+        'Address': address
+    }
+
+def summarize_whois(ip_address:str, whois_result:str, fast_path:bool=True, min_confidence:float=DEFAULT_MIN_CONFIDENCE,
+                    llm_batcher:LLMBatcher=None, llm_cache=None)->tuple[dict[str:str], str]:
+    """
+    Extract the organization details from a whois response, with the deterministic parser of
+    `util.whois_parser` first, and GPT only if the parsed record is not complete enough.
+
+    :param ip_address: IP address queried.
+    :param whois_result: Output of the whois command for the IP address.
+    :param fast_path: Try the deterministic parser before GPT.
+    :param min_confidence: Minimum parser confidence for the parsed record to be used.
+    :param llm_batcher: Optional LLMBatcher packing the GPT requests of concurrent lookups together.
+    :param llm_cache: Optional `util.llm_cache.LLMCache` of the summaries GPT gave for whois responses seen before.
+    :return: (org_detail, source) where source is "parser", "cache" or "gpt".
+    """
+    if fast_path:
+        org_detail, confidence = parse_whois(whois_result, ip_address)
+        if confidence >= min_confidence:
+            logger.info(f"Parsed whois of {ip_address} without GPT (confidence {confidence})")
+            org_detail['Network Range'] = to_cidr(org_detail['Network Range'])
+            return org_detail, "parser"
+        logger.info(f"Whois of {ip_address} could not be parsed reliably (confidence {confidence}), asking GPT")
+
+    model, prompt_version = (llm_batcher.model, BATCH_PROMPT_VERSION) if llm_batcher is not None else (DEFAULT_MODEL, PROMPT_VERSION)
+    if llm_cache is not None:
+        org_detail = llm_cache.get(whois_result, model, prompt_version)
+        if org_detail is not None:
+            logger.info(f"Whois of {ip_address} was summarized by GPT before, using the cached summary")
+            return org_detail, "cache"
+
+    if llm_batcher is not None:
+        org_detail = llm_batcher.submit(ip_address, whois_result).result()
+        org_detail['Network Range'] = to_cidr(org_detail['Network Range'])
+    else:
+        org_detail = parse_summary(query_gpt(ip_address, whois_result))
+
+    if llm_cache is not None:
+        llm_cache.put(whois_result, model, prompt_version, org_detail)
+    return org_detail, "gpt"
+
+def lookup_org_detail(ip_address:str, fast_path:bool=True, llm_batcher:LLMBatcher=None, llm_cache=None)->tuple[dict[str:str], str]:
+    """
+    Identify the organization details of an IP address with whois, and the whois parser or GPT.
+
+    :param ip_address: IP address to query.
+    :param fast_path: Try the deterministic whois parser before GPT.
+    :param llm_batcher: Optional LLMBatcher packing the GPT requests of concurrent lookups together.
+    :param llm_cache: Optional `util.llm_cache.LLMCache` of the summaries GPT gave for whois responses seen before.
+    :return: (org_detail, source) where source is "parser", "cache" or "gpt", or (None, None) if whois or GPT failed.
+    """
+    logger.info(f"{ip_address} does not belong to previously found organizations. Query whois now ...")
+    try:
+        whois_result = run_whois(ip_address)
+    except OSError as e:
+        logger.error(f"Error querying whois for {ip_address}: {e}")
+        return None, None
+
+    try:
+        org_detail, source = summarize_whois(ip_address, whois_result, fast_path, llm_batcher=llm_batcher, llm_cache=llm_cache)
+    except (LLMExtractionError, *openai_errors()) as e:
+        logger.error(f"Could not identify the organization of {ip_address}: {e}")
+        return None, None
+
+    logger.info(f"Regional Registry: {org_detail['Regional Registry']}")
+    logger.info(f"Network Range: {org_detail['Network Range']}")
+    logger.info(f"Organization:{org_detail['Organization']}")
+    logger.info(f"Address:{org_detail['Address']}")
+    logger.info("++++++++++++++++++++++++++++++++++++++++++++++++++")
+    return org_detail, source
+
+def _inflight_key(ip_address:str)->str:
+    """
+    Key grouping IP addresses that almost certainly belong to the same allocation (same /24 or /48).
+    """
+    ip = ipaddress.ip_address(ip_address)
+    return str(ipaddress.ip_network(f"{ip}/{24 if ip.version == 4 else 48}", strict=False))
+
+class OrgResolver:
+    """
+    Resolve the organization details of IP addresses with a bounded pool of workers.
+
+    Network ranges identified so far are kept in an IPRangeIndex shared by every lookup, and an
+    optional `util.org_cache.OrgCache` is consulted before running whois. Lookups for addresses
+    in the same /24 as a lookup still in flight wait for it, so that a range is queried once.
+    Whois responses go through the deterministic parser first when fast_path is set, and the
+    number of responses parsed without GPT is counted. The GPT requests of concurrent lookups are
+    packed together when an LLMBatcher is given, and skipped for whois responses already
+    summarized when an `util.llm_cache.LLMCache` is given.
+    """
+
+    def __init__(self, org_cache=None, max_workers:int=4, fast_path:bool=True, llm_batcher:LLMBatcher=None, llm_cache=None):
+        self.org_cache = org_cache
+        self.fast_path = fast_path
+        self.llm_batcher = llm_batcher
+        self.llm_cache = llm_cache
+        self.fast_path_hits = 0
+        self.fast_path_misses = 0
+        self.llm_cache_hits = 0
+        self.ip_range_index = IPRangeIndex()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="whois")
+
+    def close(self, wait:bool=True) -> None:
+        """
+        :param wait: If False, e.g. when the run was interrupted, drop the lookups not started yet and
+            return without waiting for those in flight.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close(wait=exc_type is None)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Counters of whois responses parsed without GPT (hits), sent to GPT (misses), and summarized
+        by GPT in an earlier run (llm_cache_hits, neither hits nor misses).
+        """
+        total = self.fast_path_hits + self.fast_path_misses
+        return {
+            'fast_path_hits': self.fast_path_hits,
+            'fast_path_misses': self.fast_path_misses,
+            'fast_path_hit_rate': round(self.fast_path_hits / total, 3) if total else 0.0,
+            'llm_cache_hits': self.llm_cache_hits
+        }
+
+    def submit(self, ip_address:str) -> Future:
+        """
+        Start resolving an IP address.
+
+        :param ip_address: IP address to resolve.
+        :return: Future of the organization details dictionary, or of None if the lookup failed.
+        """
+        key = _inflight_key(ip_address)
+        with self._lock:
+            pending = self._inflight.get(key)
+            future = self._executor.submit(self._resolve, ip_address, pending)
+            self._inflight[key] = future
+        future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def _release(self, key:str, future:Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _resolve(self, ip_address:str, pending:Future=None):
         logger.info(f"Querying for IP Address: {ip_address} ...")
+        # Wait for a lookup of the same block still in flight, its range may cover this address too
+        if pending is not None:
+            wait([pending])
 
         # 1. Check if this IP address has already been identified previously 
-        result = match_ip_to_org(ip_address_range_dict, ip_address)
-
-        if result != None: 
-            # if found to be previous identified 
-            logger.info(f"{ip_address} belong to a previously found organizations: {result}")
-            org_peering_list.append(result)
-            logger.info("..................................................")
+        with self._lock:
+            org_detail = self.ip_range_index.lookup(ip_address)
+        if org_detail is not None:
+            logger.info(f"{ip_address} belong to a previously found organizations: {(org_detail['Network Range'], org_detail['Organization'])}")
+            return org_detail
+
+        # 2. Check if this IP address has been identified in a previous run
+        org_detail = self.org_cache.lookup(ip_address) if self.org_cache is not None else None
+        if org_detail is not None:
+            logger.info(f"{ip_address} belong to a cached organization: {(org_detail['Network Range'], org_detail['Organization'])}")
         else:
-            logger.info(f"{ip_address} does not belong to previously found organizations. Run whois command now ...")
-            
-            # Step 2: Run the whois command.
-            try:
-                result = subprocess.check_output(['whois', ip_address], stderr=subprocess.STDOUT).decode('utf-8')
-            except subprocess.CalledProcessError as e:
-                print(f"Error executing whois on {ip_address}.")
-                return {}
-            
-            retry_count = 3
-            wait_time = 3 
-            response = None
-
-            for attempt in range(retry_count): 
-                try: 
-                    # Step 2: Pass the result of whois to ChatGPT to identify the Regional Registry, Organization, Network Range,and Address
-                    response = openai.ChatCompletion.create(
-                        model = "gpt-3.5-turbo",
-                        messages =[
-                            {
-                                "role":"user", 
-                                "content": f"From the whois details in {result} for ip address {ip_address}, identify the Regional Registry, Network Range, Organization,and Address for {ip_address}. Present the solution in following format:\nRegional Registry:Regional_Registry_Identified\nOrganization:`Organization_identified`\nNetwork Range:`Network_Range_Identified`\nAddress:`Address_Identified",
-                            }
-                        ],
-                        max_tokens=200
-                        )
-                    # if success, break 
-                    break 
-                except openai.error.OpenAIError as e: 
-                    logger.error(f"Error on attempt {attempt + 1}: {e}")
-                    # if this is the last attempt, raise exception 
-                    if attempt == retry_count - 1:
-                            raise
-                    # If not the last attempt, wait for a bit before retrying
-                    time.sleep(wait_time)
-
-            summary =response['choices'][0]['message']['content']
-
-            # # Step 3: Extract necessary information from the summary. 
-            regional_registry = None
-            network_range = None
-            organization = None
-            address = None
-            
-            for line in summary.split('\n'):
-                if 'Organization' in line:
-                    organization = line.split(':')[-1].strip()
-                elif 'Network Range' in line:
-                    network_range = line.split(':')[-1].strip()
-                elif 'Regional Registry' in line:
-                    regional_registry = line.split(':')[-1].strip()
-                elif 'Address' in line:
-                    address = line.split(':')[-1].strip()
-
-            # convert the network range to CIDR format 
-            network_range = to_cidr(network_range)
-            # put the newly identified range and org pair into the dictionary 
-            ip_address_range_dict[network_range] = organization
-
-            org_detail_list.append(
-                {
-                    'Regional Registry': regional_registry,
-                    'Network Range': network_range,
-                    'Organization': organization,
-                    'Address': address
-                }
-            )
-
-            org_peering_list.append((network_range, organization))
-
-            logger.info(f"Regional Registry: {regional_registry}")
-            logger.info(f"Network Range: {network_range}")
-            logger.info(f"Organization:{organization}")
-            logger.info(f"Address:{address}")
-            logger.info("++++++++++++++++++++++++++++++++++++++++++++++++++")
+            # 3. Run whois and GPT
+            org_detail, source = lookup_org_detail(ip_address, self.fast_path, self.llm_batcher, self.llm_cache)
+            if org_detail is None:
+                return None
+            with self._lock:
+                if source == "parser":
+                    self.fast_path_hits += 1
+                elif source == "cache":
+                    self.llm_cache_hits += 1
+                else:
+                    self.fast_path_misses += 1
+            if self.org_cache is not None:
+                self.org_cache.put(org_detail['Network Range'], org_detail)
+
+        # put the newly identified range and org pair into the index, 
+        # except for the catch-all range `to_cidr` returns for an invalid range 
+        if org_detail['Network Range'] != "0.0.0.0/0":
+            with self._lock:
+                self.ip_range_index.insert(org_detail['Network Range'], org_detail)
+        return org_detail
+
+def identify_org_details(hops: list[Hop], org_cache=None, max_workers:int=1, resolver:OrgResolver=None,
+                         fast_path:bool=True)-> list[OrgRecord]:
+    """
+    Identify the organization owning each IP address with whois and GPT.
+
+    :param hops: List of public hops, or of public IP addresses.
+    :param org_cache: Optional `util.org_cache.OrgCache` consulted before, and filled after, each whois query.
+    :param max_workers: Number of IP addresses resolved concurrently.
+    :param resolver: Optional OrgResolver to share across calls, org_cache, max_workers and fast_path are then ignored.
+    :param fast_path: Parse whois responses without GPT when possible, see `util.whois_parser`.
+    :return: List of organizations, one per network range identified, in the order of hops.
+        IP addresses whose lookup failed are skipped.
+    """
+    own_resolver = resolver is None
+    if own_resolver:
+        resolver = OrgResolver(org_cache, max_workers, fast_path)
+
+    try:
+        ip_address_list = [hop if isinstance(hop, str) else hop.ip_address for hop in hops]
+        org_record_list = collect_org_details([resolver.submit(ip_address) for ip_address in ip_address_list])
+    finally:
+        if own_resolver:
+            resolver.close()
             
-    return org_detail_list
+    return org_record_list
+
+def collect_org_details(futures: list[Future])-> list[OrgRecord]:
+    """
+    Wait for OrgResolver lookups and keep the organization of each network range once.
 
-def integrate_ip_info(ip_address_location: list[list[str]], org_detail_list: list[dict]) -> list[list[str]]:
+    :param futures: Futures returned by OrgResolver.submit, in hop order.
+    :return: List of organizations, in the order of futures. Failed lookups are skipped.
     """
-    Integrate IP information from the provided org_detail_list into the ip_address_location list based on the IP range.
+    org_record_list = []
+    found_ranges = set()
+    for future in futures:
+        org_detail = future.result()
+        if org_detail is not None and org_detail['Network Range'] not in found_ranges:
+            found_ranges.add(org_detail['Network Range'])
+            org_record_list.append(OrgRecord.from_dict(org_detail))
+    return org_record_list
+
+def integrate_ip_info(hops: list[Hop], org_record_list: list[OrgRecord]) -> list[Hop]:
+    """
+    Integrate the organizations of org_record_list into the hops based on the IP range.
 
-    Args:
-    - ip_address_location (list[list[str]]): List containing IP addresses and their locations.
-    - org_detail_list (list[dict]): List of dictionaries containing IP-related information.
+    Every network range is parsed once into an IPRangeIndex, and each IP address is matched to the most
+    specific range containing it with a binary search. Ranges that cannot be parsed, and the catch-all
+    range `to_cidr` returns for an invalid range, are skipped.
 
-    Returns:
-    - list[list[str]]: Updated ip_address_location list with integrated information.
+    :param hops: List of hops with their locations. They are not modified.
+    :param org_record_list: List of organizations identified.
+    :return: Copies of the hops with the organization of their IP address, None when no organization was found.
     """
-    
-    for record in ip_address_location:
-        ip_addr = ipaddress.ip_address(record[0])  # Convert string to IP address object
-        
-        # Check if the IP address is within any of the network ranges
-        for info in org_detail_list:
-            network = ipaddress.ip_network(info['Network Range'])
-            if ip_addr in network:
-                # Add the information from the dictionary to the record
-                record.extend([
-                    info['Regional Registry'],
-                    info['Network Range'],
-                    info['Organization'],
-                    info['Address']
-                ])
-                break  # Exit the inner loop if a match is found
-
-    return ip_address_location
+    # Index every network range once, the first record listed for a range wins.
+    # The /0 networks, such as the catch-all range of `to_cidr`, would match every IP address
+    ip_range_index = IPRangeIndex.from_networks(
+        (network, org_record)
+        for org_record in org_record_list if org_record is not None
+        for network in parse_networks(org_record.network_range) if network.prefixlen > 0)
+
+    # Find the most specific network range containing the IP address
+    return [hop.replace(org=ip_range_index.lookup(hop.ip) if hop.ip is not None else None) for hop in hops]
 
 
 # Test
@@ -0,0 +1,130 @@
+import socket
+import ipaddress
+
+from util.ip_range_index import address_key
+
+# Columns of an organization in the summary CSV files, and keys of the organization details dictionaries
+ORG_DETAIL_FIELDS = ('Regional Registry', 'Network Range', 'Organization', 'Address')
+
+_EMPTY_ORG_ROW = ("",) * len(ORG_DETAIL_FIELDS)
+
+
+def ip_to_int(ip_address) -> int:
+    """
+    Integer form of an IP address, as kept by Hop: the address itself for IPv4, and the
+    address after every IPv4 address for IPv6 (see `util.ip_range_index.address_key`).
+
+    :raises ValueError: if ip_address is not a valid IP address.
+    """
+    return address_key(ip_address)
+
+
+def int_to_ip(ip:int) -> str:
+    """
+    IP address string of an integer given by ip_to_int.
+    """
+    if ip < 1 << 32:
+        return socket.inet_ntoa(ip.to_bytes(4, 'big'))
+    return str(ipaddress.IPv6Address(ip - (1 << 32)))
+
+
+class OrgRecord:
+    """
+    Organization owning a network range, as identified by whois and GPT.
+
+    The organization details are passed around as dictionaries keyed by ORG_DETAIL_FIELDS while they
+    are being resolved and cached, and kept as OrgRecord once identified.
+    """
+    __slots__ = ('regional_registry', 'network_range', 'organization', 'address')
+
+    def __init__(self, regional_registry:str=None, network_range:str=None, organization:str=None, address:str=None):
+        self.regional_registry = regional_registry
+        self.network_range = network_range
+        self.organization = organization
+        self.address = address
+
+    @classmethod
+    def from_dict(cls, org_detail:dict) -> 'OrgRecord':
+        return cls(*(org_detail.get(field) for field in ORG_DETAIL_FIELDS))
+
+    def to_dict(self) -> dict[str, str]:
+        return dict(zip(ORG_DETAIL_FIELDS, self.row()))
+
+    def row(self) -> tuple:
+        """
+        :return: the fields in the order of ORG_DETAIL_FIELDS.
+        """
+        return (self.regional_registry, self.network_range, self.organization, self.address)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, OrgRecord) and self.row() == other.row()
+
+    def __hash__(self) -> int:
+        return hash(self.row())
+
+    def __repr__(self) -> str:
+        return f"OrgRecord({', '.join(repr(value) for value in self.row())})"
+
+
+class Hop:
+    """
+    Hop of a traceroute.
+
+    The IP address is kept as an integer (see ip_to_int), and only rendered as a string by
+    `ip_address`, `row` and `__repr__`, when it is sent to a service or written out.
+
+    :param number: Hop number, 0 for the destination announced by traceroute.
+    :param ip: IP address of the responder as an integer, or None if no probe was answered.
+    :param rtt: Round trip times of the probes, in ms.
+    :param location: Location of the IP address, see `util.trace_route.get_ip_info`.
+    :param org: OrgRecord of the network range of the IP address.
+    """
+    __slots__ = ('number', 'ip', 'rtt', 'location', 'org')
+
+    def __init__(self, number:int, ip:int=None, rtt:tuple=(), location:str=None, org:OrgRecord=None):
+        self.number = number
+        self.ip = ip
+        self.rtt = rtt
+        self.location = location
+        self.org = org
+
+    @classmethod
+    def parse(cls, number:int, ip_address:str=None, rtt=()) -> 'Hop':
+        """
+        Hop of an IP address string as printed by traceroute.
+        """
+        return cls(number, ip_to_int(ip_address) if ip_address else None, tuple(rtt))
+
+    @property
+    def ip_address(self) -> str:
+        return int_to_ip(self.ip) if self.ip is not None else None
+
+    @property
+    def is_private(self) -> bool:
+        if self.ip is None:
+            return False
+        if self.ip < 1 << 32:
+            return ipaddress.IPv4Address(self.ip).is_private
+        return ipaddress.IPv6Address(self.ip - (1 << 32)).is_private
+
+    def replace(self, **changes) -> 'Hop':
+        """
+        Copy of the hop with some of its fields changed, hops are never modified once shared.
+        """
+        values = {field: getattr(self, field) for field in self.__slots__}
+        values.update(changes)
+        return Hop(**values)
+
+    def row(self) -> list[str]:
+        """
+        :return: [IP address, location] followed by the fields of the organization, empty if it is
+            not known, as written by `util.csv_helper.write_ip_info`.
+        """
+        org_row = self.org.row() if self.org is not None else _EMPTY_ORG_ROW
+        return [self.ip_address, self.location or ""] + list(org_row)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Hop) and all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"Hop({self.number}, {self.ip_address!r}, rtt={self.rtt!r}, location={self.location!r}, org={self.org!r})"
@@ -0,0 +1,178 @@
+import bisect
+import socket
+import ipaddress
+
+
+def address_key(ip_address) -> int:
+    """
+    Integer sort key of an IP address. IPv6 keys are placed after every IPv4 key
+    so that both families can live in the same sorted index.
+    Integers are taken to be keys already, such as the IP addresses of `util.hop.Hop`.
+    """
+    if isinstance(ip_address, int):
+        return ip_address
+    if isinstance(ip_address, str):
+        # inet_pton parses dotted quads several times faster than ipaddress, and as strictly
+        try:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big')
+        except OSError:
+            ip_address = ipaddress.ip_address(ip_address)
+    if ip_address.version == 6:
+        return (1 << 32) + int(ip_address)
+    return int(ip_address)
+
+
+def parse_networks(network_range:str) -> list:
+    """
+    Parse a CIDR network, or several comma separated CIDR networks as produced by `to_cidr`.
+    Parts in the "start - end" format of whois records are summarized into CIDR networks.
+    Invalid parts are skipped.
+    """
+    networks = []
+    for part in str(network_range).split(','):
+        try:
+            if '-' in part:
+                start, end = (ipaddress.ip_address(ip.strip()) for ip in part.split('-'))
+                networks.extend(ipaddress.summarize_address_range(start, end))
+            else:
+                networks.append(ipaddress.ip_network(part.strip(), strict=False))
+        except (ValueError, TypeError):
+            continue
+    return networks
+
+
+class IPRangeIndex:
+    """
+    Sorted integer interval index mapping IP networks to values.
+
+    The index is kept as disjoint segments sorted by their first address, each one remembering
+    the size of the network it came from. Inserting a network only overrides the parts of the
+    segments that come from networks at least as large, so the most specific network always
+    wins, and a containment query is a single binary search.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._sizes = []
+        self._values = []
+        self.network_count = 0
+
+    @classmethod
+    def from_networks(cls, items) -> 'IPRangeIndex':
+        """
+        Build an index from many networks at once, in O(n log n).
+
+        CIDR networks are either nested or disjoint, so once sorted by first address, larger networks
+        first, a single sweep with a stack of the enclosing networks gives the segments. A network
+        listed several times keeps its first value.
+
+        :param items: Iterable of (network, value) pairs, network being an `ipaddress` network object.
+        """
+        networks = sorted(
+            (address_key(network.network_address), -network.num_addresses, order, address_key(network.broadcast_address), value)
+            for order, (network, value) in enumerate(items))
+
+        index = cls()
+        stack = []
+        cursor = 0
+
+        def close(until:int) -> None:
+            # Emit the segments of the enclosing networks ending before `until`
+            nonlocal cursor
+            while stack and stack[-1][1] < until:
+                _, end, size, value = stack.pop()
+                if cursor <= end:
+                    index._append(cursor, end, size, value)
+                    cursor = end + 1
+
+        for start, negative_size, _, end, value in networks:
+            close(start)
+            if stack and stack[-1][0] == start and stack[-1][1] == end:
+                continue
+            if stack and cursor < start:
+                index._append(cursor, start - 1, stack[-1][2], stack[-1][3])
+            stack.append((start, end, -negative_size, value))
+            cursor = start
+            index.network_count += 1
+        close(float('inf'))
+        return index
+
+    def _append(self, start:int, end:int, size:int, value) -> None:
+        self._starts.append(start)
+        self._ends.append(end)
+        self._sizes.append(size)
+        self._values.append(value)
+
+    def __len__(self) -> int:
+        return self.network_count
+
+    def insert(self, network_range:str, value) -> int:
+        """
+        Insert every network of a network range string.
+
+        :param network_range: CIDR network, or several comma separated CIDR networks.
+        :param value: Value returned by `lookup` for addresses in these networks.
+        :return: Number of networks inserted.
+        """
+        networks = parse_networks(network_range)
+        for network in networks:
+            self.insert_network(network, value)
+        return len(networks)
+
+    def insert_network(self, network, value) -> None:
+        start = address_key(network.network_address)
+        end = address_key(network.broadcast_address)
+        size = end - start + 1
+
+        first = bisect.bisect_right(self._starts, start) - 1
+        if first < 0 or self._ends[first] < start:
+            first += 1
+        last = first
+        while last < len(self._starts) and self._starts[last] <= end:
+            last += 1
+
+        segments = []
+        cursor = start
+        for index in range(first, last):
+            segment_start, segment_end = self._starts[index], self._ends[index]
+            segment_size, segment_value = self._sizes[index], self._values[index]
+            if segment_start < start:
+                segments.append((segment_start, start - 1, segment_size, segment_value))
+            overlap_start, overlap_end = max(segment_start, start), min(segment_end, end)
+            if cursor < overlap_start:
+                segments.append((cursor, overlap_start - 1, size, value))
+            if segment_size < size:
+                segments.append((overlap_start, overlap_end, segment_size, segment_value))
+            else:
+                segments.append((overlap_start, overlap_end, size, value))
+            cursor = overlap_end + 1
+            if segment_end > end:
+                segments.append((end + 1, segment_end, segment_size, segment_value))
+        if cursor <= end:
+            segments.append((cursor, end, size, value))
+
+        self._starts[first:last] = [segment[0] for segment in segments]
+        self._ends[first:last] = [segment[1] for segment in segments]
+        self._sizes[first:last] = [segment[2] for segment in segments]
+        self._values[first:last] = [segment[3] for segment in segments]
+        self.network_count += 1
+
+    def lookup(self, ip_address):
+        """
+        Find the value of the most specific network containing ip_address.
+
+        :param ip_address: IP address, as a string, an `ipaddress` object or an integer key.
+        :return: The value inserted with the network, or None.
+        """
+        try:
+            key = address_key(ip_address)
+        except ValueError:
+            return None
+        index = bisect.bisect_right(self._starts, key) - 1
+        if index >= 0 and self._ends[index] >= key:
+            return self._values[index]
+        return None
+
+    def __contains__(self, ip_address) -> bool:
+        return self.lookup(ip_address) is not None
@@ -0,0 +1,290 @@
+import re
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from util.timing import span
+from util.openai_client import get_openai
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+# Change whenever the prompt or the parsing of the answer changes, cached summaries are keyed by it
+PROMPT_VERSION = "batch-1"
+FIELDS = ('Regional Registry', 'Network Range', 'Organization', 'Address')
+
+# Whois attributes that never help identifying the organization of a network
+_NOISE_KEYS = re.compile(
+    r'^(remarks|comment|notify|changed|created|last-modified|regdate|updated|ref|mnt-[\w-]+|admin-c|tech-c|abuse-c|'
+    r'orgabuse\w*|orgtech\w*|orgnoc\w*|rtech\w*|nic-hdl|e-mail|phone|fax-no|status|source|parent|originas|nettype)\s*:',
+    re.IGNORECASE
+)
+
+
+def estimate_tokens(text:str) -> int:
+    """
+    Rough token count of a text, about four characters per token.
+    """
+    return len(text) // 4 + 1
+
+
+def trim_whois(whois_result:str, max_chars:int=2000) -> str:
+    """
+    Keep only the whois lines useful to identify the organization, up to max_chars characters.
+    """
+    lines = []
+    for line in whois_result.splitlines():
+        line = line.rstrip()
+        if not line.strip() or line.startswith(('%', '#')) or _NOISE_KEYS.match(line.strip()):
+            continue
+        lines.append(re.sub(r'\s{2,}', ' ', line))
+    return '\n'.join(lines)[:max_chars]
+
+
+def build_prompt(records:list[tuple[int, str, str]]) -> str:
+    """
+    Prompt asking for the organization details of several whois records at once.
+
+    :param records: List of (record id, IP address, trimmed whois record).
+    """
+    prompt = (
+        "For each whois record below, identify the Regional Registry, Network Range, Organization and Address "
+        "of the network containing the given IP address. Answer with only a JSON array holding one object per record: "
+        '{"id": record_id, "Regional Registry": "...", "Network Range": "...", "Organization": "...", "Address": "..."}\n'
+    )
+    for record_id, ip_address, whois_result in records:
+        prompt += f"\n### Record {record_id} (IP address {ip_address})\n{whois_result}\n"
+    return prompt
+
+
+def parse_batch_response(content:str) -> dict[int, dict]:
+    """
+    Parse the JSON array answered by the model into organization details keyed by record id.
+    Objects that are malformed or miss the record id are ignored.
+    """
+    start, end = content.find('['), content.rfind(']')
+    if start < 0 or end < start:
+        return {}
+    try:
+        items = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            record_id = int(item.get('id'))
+        except (TypeError, ValueError):
+            continue
+        results[record_id] = {field: (str(item[field]) if item.get(field) not in (None, '') else None) for field in FIELDS}
+    return results
+
+
+class LLMExtractionError(Exception):
+    """
+    Raised through the future of a whois record the model could not extract.
+    """
+
+
+class _Request:
+    __slots__ = ('record_id', 'ip_address', 'whois_result', 'future', 'attempts', 'not_before')
+
+    def __init__(self, record_id:int, ip_address:str, whois_result:str):
+        self.record_id = record_id
+        self.ip_address = ip_address
+        self.whois_result = whois_result
+        self.future = Future()
+        self.attempts = 0
+        # time.monotonic() before which the record must not be sent again
+        self.not_before = 0.0
+
+
+class LLMBatcher:
+    """
+    Pack several whois records into one ChatCompletion request.
+
+    Records submitted while a batch is being collected (within `linger` seconds) are sent together,
+    as long as their estimated tokens fit in `token_budget`. Records missing from, or malformed in,
+    the answer are queued again for the next batch, up to `max_attempts` times. Up to `max_in_flight`
+    batches are sent at once. The records of a failed request are queued again to be sent after an
+    exponential backoff of `backoff` * 2 ** attempt seconds (at most 30), without holding up the other
+    batches. `api_base` selects another OpenAI compatible endpoint, such as a local stub server.
+    """
+
+    def __init__(self, model:str=DEFAULT_MODEL, api_base:str=None, token_budget:int=3000, max_batch_size:int=8,
+                 linger:float=0.2, max_attempts:int=3, tokens_per_answer:int=120, max_record_chars:int=2000,
+                 max_in_flight:int=3, backoff:float=1.0):
+        self.model = model
+        self.api_base = api_base
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.tokens_per_answer = tokens_per_answer
+        self.max_record_chars = max_record_chars
+        self.max_in_flight = max_in_flight
+        self.backoff = backoff
+        self.request_count = 0
+        self.record_count = 0
+        self._queue = []
+        self._next_id = 0
+        self._in_flight = 0
+        self._closed = False
+        self._cancelled = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm-batch")
+        self._thread = threading.Thread(target=self._run, name="llm-batcher", daemon=True)
+        self._thread.start()
+
+    def close(self, wait:bool=True) -> None:
+        """
+        Stop the batcher once the records queued are extracted.
+
+        :param wait: If False, e.g. when the run was interrupted, fail the records still queued instead,
+            and return without waiting for the requests in flight.
+        """
+        with self._condition:
+            self._closed = True
+            self._cancelled = not wait
+            cancelled, self._queue = (self._queue, []) if not wait else ([], self._queue)
+            self._condition.notify()
+        for request in cancelled:
+            request.future.set_exception(LLMExtractionError("the batcher was closed"))
+        if wait:
+            self._thread.join()
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def stats(self) -> dict[str, int]:
+        return {'requests': self.request_count, 'records': self.record_count}
+
+    def submit(self, ip_address:str, whois_result:str) -> Future:
+        """
+        Queue a whois record for extraction.
+
+        :return: Future of the organization details dictionary, with the network range as answered by the model.
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("LLMBatcher is closed")
+            request = _Request(self._next_id, ip_address, trim_whois(whois_result, self.max_record_chars))
+            self._next_id += 1
+            self._queue.append(request)
+            self._condition.notify()
+        return request.future
+
+    def _ready(self, now:float) -> list[_Request]:
+        return [request for request in self._queue if request.not_before <= now]
+
+    def _take_batch(self) -> list[_Request]:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._closed and not self._queue and (not self._in_flight or self._cancelled):
+                    # Batches still in flight may queue their records again
+                    return []
+                ready = self._ready(now)
+                if ready and self._in_flight < self.max_in_flight:
+                    break
+                # Wake up when the first record backing off may be sent again
+                timeout = min(request.not_before for request in self._queue) - now if self._queue and not ready else None
+                self._condition.wait(timeout)
+
+            # Give concurrent lookups a moment to join the batch
+            deadline = time.monotonic() + self.linger
+            while len(ready) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+                ready = self._ready(time.monotonic())
+
+            batch = []
+            tokens = estimate_tokens(build_prompt([]))
+            for request in ready:
+                if len(batch) == self.max_batch_size:
+                    break
+                request_tokens = estimate_tokens(request.whois_result) + self.tokens_per_answer
+                if batch and tokens + request_tokens > self.token_budget:
+                    break
+                batch.append(request)
+                tokens += request_tokens
+            taken = {id(request) for request in batch}
+            self._queue = [request for request in self._queue if id(request) not in taken]
+            if batch:
+                self._in_flight += 1
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                self._executor.submit(self._send, batch)
+            except RuntimeError:
+                # The executor was shut down by close(wait=False)
+                for request in batch:
+                    request.future.set_exception(LLMExtractionError("the batcher was closed"))
+                return
+
+    def _send(self, batch:list[_Request]) -> None:
+        try:
+            self._send_batch(batch)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def _send_batch(self, batch:list[_Request]) -> None:
+        prompt = build_prompt([(request.record_id, request.ip_address, request.whois_result) for request in batch])
+        for request in batch:
+            request.attempts += 1
+        not_before = 0.0
+        try:
+            with self._condition:
+                self.request_count += 1
+                self.record_count += len(batch)
+            with span("gpt_batch", "llm", records=len(batch)):
+                response = get_openai().ChatCompletion.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=self.tokens_per_answer * len(batch),
+                    temperature=0,
+                    api_base=self.api_base
+                )
+            results = parse_batch_response(response['choices'][0]['message']['content'])
+            error = LLMExtractionError("the model did not return this record")
+        except Exception as e:
+            # Any failure must reach the futures, or the lookups waiting on them would hang
+            logger.error(f"Batch of {len(batch)} whois records failed: {e}")
+            # Exponential backoff with jitter before the records are tried again
+            attempt = max(request.attempts for request in batch)
+            not_before = time.monotonic() + min(30, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+            results = {}
+            error = LLMExtractionError(str(e))
+
+        retry = []
+        for request in batch:
+            if request.record_id in results:
+                request.future.set_result(results[request.record_id])
+            elif request.attempts < self.max_attempts and not self._cancelled:
+                request.not_before = not_before
+                retry.append(request)
+            else:
+                request.future.set_exception(error)
+        if retry:
+            with self._condition:
+                # close(wait=False) may have emptied the queue for good while the batch was in flight
+                cancelled = self._cancelled
+                if not cancelled:
+                    logger.info(f"Queueing {len(retry)} whois records again")
+                    self._queue[:0] = retry
+                    self._condition.notify()
+            if cancelled:
+                for request in retry:
+                    request.future.set_exception(LLMExtractionError("the batcher was closed"))
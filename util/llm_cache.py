@@ -0,0 +1,119 @@
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+
+from util.llm_batch import trim_whois
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 50000
+
+
+def normalize_whois(whois_result:str) -> str:
+    """
+    Normalize a whois response so that responses for the same allocation hash identically:
+    comments (which carry query details and timestamps), noise attributes and spacing are dropped.
+    """
+    return trim_whois(whois_result, max_chars=len(whois_result))
+
+
+def cache_key(whois_result:str, model:str, prompt_version:str) -> str:
+    """
+    Content address of a GPT summary: hash of the normalized whois response, the model and the prompt version.
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, normalize_whois(whois_result)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent cache of the organization details GPT extracted from a whois response.
+
+    Entries are keyed by the hash of the normalized whois text, the model and the prompt version, so
+    a response seen before, for any IP address and in any run, never needs an API call. The cache lives
+    in SQLite and holds at most `max_entries` summaries, evicting the least recently used ones.
+    """
+
+    def __init__(self, filename:str="llm_cache.sqlite", max_entries:int=DEFAULT_MAX_ENTRIES):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_access ON llm_cache (last_access)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def get(self, whois_result:str, model:str, prompt_version:str):
+        """
+        Find the summary GPT gave for this whois response.
+
+        :return: Dictionary of organization details, or None on a miss.
+        """
+        key = cache_key(whois_result, model, prompt_version)
+        with self._lock:
+            row = self._connection.execute("SELECT summary FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, whois_result:str, model:str, prompt_version:str, summary:dict) -> None:
+        """
+        Store the summary GPT gave for this whois response.
+        """
+        key = cache_key(whois_result, model, prompt_version)
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, json.dumps(summary), now, now))
+                (count,) = self._connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+                if count > self.max_entries:
+                    self._connection.execute(
+                        "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+                    self.evictions += count - self.max_entries
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        return count
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self)
+        }
@@ -0,0 +1,245 @@
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from util.hop import Hop, OrgRecord, int_to_ip
+from util.trace_route import iter_trace_route, LocationClient
+from util.gpt_whois import OrgResolver
+from util.trace_store import TraceStore
+from util.timing import span
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+def path_of(hops) -> tuple[int, dict[int, Hop]]:
+    """
+    Path of a traceroute: the first responder of each hop number.
+
+    :param hops: Hops yielded by `util.trace_route.iter_trace_route`.
+    :return: (destination IP as an integer or None, dictionary of hop number to Hop)
+    """
+    destination_ip = None
+    path = {}
+    for hop in hops:
+        if hop.number == 0:
+            destination_ip = destination_ip or hop.ip
+        elif hop.number not in path or (path[hop.number].ip is None and hop.ip is not None):
+            path[hop.number] = hop
+    return destination_ip, path
+
+def mean_rtt(hop:Hop) -> float:
+    """
+    Mean round trip time of the probes of a hop in ms, or None if none was answered.
+    """
+    return sum(hop.rtt) / len(hop.rtt) if hop is not None and hop.rtt else None
+
+def rtt_delta(previous:Hop, current:Hop) -> float:
+    previous_rtt, current_rtt = mean_rtt(previous), mean_rtt(current)
+    if previous_rtt is None or current_rtt is None:
+        return None
+    return round(current_rtt - previous_rtt, 3)
+
+def diff_paths(previous:dict[int, Hop], current:dict[int, Hop]) -> list[tuple[str, int, Hop, Hop]]:
+    """
+    Compare two paths hop by hop.
+
+    Hops that did not answer are not changes: a router dropping a few probes would otherwise
+    show up as route churn.
+
+    :return: list of (change, hop number, previous hop, current hop), change being "added",
+        "removed" or "changed", in hop order.
+    """
+    changes = []
+    for number in sorted(previous.keys() | current.keys()):
+        previous_hop, current_hop = previous.get(number), current.get(number)
+        if previous_hop is None:
+            if current_hop.ip is not None:
+                changes.append(("added", number, None, current_hop))
+        elif current_hop is None:
+            if previous_hop.ip is not None:
+                changes.append(("removed", number, previous_hop, None))
+        elif previous_hop.ip is not None and current_hop.ip is not None and previous_hop.ip != current_hop.ip:
+            changes.append(("changed", number, previous_hop, current_hop))
+    return changes
+
+def _hop_fields(hop:Hop) -> dict:
+    if hop is None:
+        return {'ip': None}
+    org = hop.org or OrgRecord()
+    return {'ip': hop.ip_address, 'rtt_ms': mean_rtt(hop), 'location': hop.location,
+            'organization': org.organization, 'network_range': org.network_range}
+
+class PathMonitor:
+    """
+    Re-trace a set of targets on a schedule, and report how their paths change.
+
+    The last path of each target is kept, and each new traceroute is compared with it hop by hop.
+    Only the hops whose IP address was never seen before are looked up with ipinfo, whois and GPT:
+    the location and organization of every other hop are taken from the earlier traceroutes, so
+    the lookups follow the route churn rather than the number of targets and hops.
+
+    Every change is written as one JSON line to events_filename:
+        new_path: first traceroute of a target
+        path_change: a hop was added, removed or answered from another IP address
+        rtt_change: same path, but the RTT of a hop moved by rtt_threshold ms or more
+    Each event lists the changed hops with their location and organization, and the RTT delta of
+    every hop number present in both paths.
+
+    :param location_client: LocationClient used for the location lookups.
+    :param org_resolver: OrgResolver used for the whois lookups.
+    :param events_filename: JSONL file the events are appended to.
+    :param engine: traceroute engine, "system" or "probe", see `iter_trace_route`.
+    :param rtt_threshold: Smallest RTT change in ms reported for an unchanged path, None to only report path changes.
+    :param trace_store: Optional `util.trace_store.TraceStore` every traceroute is recorded to, changed or not.
+    :param ixp_watcher: Optional `caida.ixp_delta.SnapshotWatcher` of the IXP dataset of trace_store, polled
+        after every round so that a new dataset is applied without restarting the monitor.
+    """
+
+    def __init__(self, location_client:LocationClient, org_resolver:OrgResolver, events_filename:str,
+                 engine:str="system", rtt_threshold:float=None, trace_store:TraceStore=None, ixp_watcher=None):
+        self.location_client = location_client
+        self.org_resolver = org_resolver
+        self.events_filename = events_filename
+        self.engine = engine
+        self.rtt_threshold = rtt_threshold
+        self.trace_store = trace_store
+        self.ixp_watcher = ixp_watcher
+        self.paths = {}
+        self.destinations = {}
+        self.lookups = 0
+        self._enriched = {}
+        self._lock = threading.Lock()
+
+    def enrich(self, path:dict[int, Hop]) -> dict[int, Hop]:
+        """
+        Add the location and organization to the public hops of a path, looking up only the IP addresses never seen before.
+        """
+        pending = []
+        for number, hop in path.items():
+            if hop.ip is None or hop.is_private:
+                continue
+            with self._lock:
+                known = self._enriched.get(hop.ip)
+                if known is None:
+                    self.lookups += 1
+            if known is not None:
+                path[number] = hop.replace(location=known.location, org=known.org)
+            else:
+                pending.append((number, self.location_client.submit(hop.ip_address), self.org_resolver.submit(hop.ip_address)))
+
+        for number, location_future, org_future in pending:
+            org_detail = org_future.result()
+            hop = path[number].replace(location=location_future.result(),
+                                       org=OrgRecord.from_dict(org_detail) if org_detail is not None else None)
+            path[number] = hop
+            # A failed location or whois lookup is tried again the next time the hop is seen
+            if org_detail is not None and hop.location is not None:
+                with self._lock:
+                    self._enriched[hop.ip] = hop
+        return path
+
+    def check(self, target:str) -> list[dict]:
+        """
+        Trace a target once, and record how its path changed since the last traceroute.
+
+        :return: the events written.
+        """
+        with span("monitor_trace", target=target):
+            destination_ip, path = path_of(iter_trace_route(target, self.engine))
+        previous = self.paths.get(target)
+
+        changes = diff_paths(previous or {}, path)
+        with span("monitor_enrich", target=target):
+            path = self.enrich(path)
+
+        # The path the next traceroute is compared with: hops that did not answer this time keep their
+        # last known responder, without RTT. The events and the trace store only get the hops as traced.
+        known_path = dict(path)
+        if previous is not None:
+            for number, hop in path.items():
+                if hop.ip is None and number in previous:
+                    known_path[number] = previous[number].replace(rtt=())
+
+        rtt_deltas = {}
+        if previous is not None:
+            for number in sorted(previous.keys() & path.keys()):
+                delta = rtt_delta(previous[number], path[number])
+                if delta is not None:
+                    rtt_deltas[number] = delta
+
+        if previous is None:
+            event_type = "new_path"
+        elif changes:
+            event_type = "path_change"
+        elif self.rtt_threshold is not None and any(abs(delta) >= self.rtt_threshold for delta in rtt_deltas.values()):
+            event_type = "rtt_change"
+        else:
+            event_type = None
+
+        self.paths[target] = known_path
+        if self.trace_store is not None:
+            self.trace_store.add_trace(target, [path[number] for number in sorted(path)], destination=destination_ip)
+        previous_destination = self.destinations.get(target)
+        self.destinations[target] = destination_ip
+        if event_type is None:
+            return []
+
+        event = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'target': target,
+            'event': event_type,
+            'destination': int_to_ip(destination_ip) if destination_ip is not None else None,
+            'hop_count': max(path, default=0),
+            'changes': [dict(change=change, hop=number, previous=_hop_fields(previous_hop), current=_hop_fields(path.get(number)),
+                             rtt_delta_ms=rtt_deltas.get(number))
+                        for change, number, previous_hop, _ in changes] if previous is not None else [],
+            'rtt_deltas_ms': rtt_deltas,
+            'path': [_hop_fields(path[number]) | {'hop': number} for number in sorted(path)]
+        }
+        if previous_destination is not None and previous_destination != destination_ip:
+            event['previous_destination'] = int_to_ip(previous_destination)
+        self.write_event(event)
+        return [event]
+
+    def write_event(self, event:dict) -> None:
+        with self._lock:
+            with open(self.events_filename, 'a') as file:
+                file.write(json.dumps(event) + '\n')
+        logger.info(f"{event['target']}: {event['event']}, {len(event['changes'])} hops changed")
+
+    def run(self, targets:list[str], interval:float, max_parallel:int=4, iterations:int=None) -> None:
+        """
+        Trace every target every interval seconds, up to max_parallel at a time, until interrupted
+        or until iterations rounds are done.
+        """
+        round_number = 0
+        with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="monitor") as executor:
+            while iterations is None or round_number < iterations:
+                started = time.monotonic()
+                round_number += 1
+                futures = {target: executor.submit(self.check, target) for target in targets}
+                event_count = 0
+                for target, future in futures.items():
+                    try:
+                        event_count += len(future.result())
+                    except Exception as e:
+                        logger.error(f"Monitoring {target} failed: {e}")
+                if self.trace_store is not None:
+                    try:
+                        self.trace_store.flush()
+                    except Exception as e:
+                        logger.error(f"Recording the traces failed: {e}")
+                if self.ixp_watcher is not None:
+                    # Between rounds, so that no traceroute is matched against a snapshot being replaced
+                    try:
+                        self.ixp_watcher.poll()
+                    except Exception as e:
+                        logger.error(f"Reloading the IXP dataset failed: {e}")
+                logger.info(f"Round {round_number}: {len(targets)} targets traced, {event_count} events, "
+                            f"{self.lookups} IP addresses looked up so far")
+
+                if iterations is not None and round_number >= iterations:
+                    break
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -3,30 +3,45 @@ import ipaddress
 
 import logging
 
+from util.timing import span, timed
+
 logger:logging.Logger = logging.getLogger(__name__)
 
+AIRPORT_COMMAND = ["/System/Library/PrivateFrameworks/Apple80211.framework/Versions/Current/Resources/airport", "-I"]
+IFCONFIG_COMMAND = ["ifconfig", "en0"]
+
+def parse_ssid(output:str):
+    for line in output.splitlines():
+        if " SSID: " in line:
+            return line.split(":")[1].strip()
+    return None
+
+def parse_ipv4(output:str):
+    for line in output.splitlines():
+        if "inet " in line and not "inet6" in line:
+            return line.split()[1]
+    return None
+
+@timed("airport", "subprocess")
 def get_ssid_macos():
     """
     Retrieve the SSID of the connected WiFi on macOS through a shell command.
     """
     try:
-        result = subprocess.check_output(["/System/Library/PrivateFrameworks/Apple80211.framework/Versions/Current/Resources/airport", "-I"])
-        for line in result.decode("utf-8").splitlines():
-            if " SSID: " in line:
-                return line.split(":")[1].strip()
+        result = subprocess.check_output(AIRPORT_COMMAND)
+        return parse_ssid(result.decode("utf-8"))
     except Exception as e:
         logger.error(f"Error getting SSID: {e}")
         return None
 
+@timed("ifconfig", "subprocess")
 def get_ipv4_macos():
     """
     Retrieve the IPv4 address of the connected WiFi on macOS through a shell command.
     """
     try:
-        result = subprocess.check_output(["ifconfig", "en0"])
-        for line in result.decode("utf-8").splitlines():
-            if "inet " in line and not "inet6" in line:
-                return line.split()[1]
+        result = subprocess.check_output(IFCONFIG_COMMAND)
+        return parse_ipv4(result.decode("utf-8"))
     except Exception as e:
         logger.error(f"Error getting IPv4: {e}")
         return None
@@ -36,6 +51,27 @@ def get_wifi_info_macos():
     ipv4 = get_ipv4_macos()
     return {'SSID': ssid, 'IPv4 Address': ipv4}
 
+async def get_wifi_info_macos_async():
+    """
+    get_wifi_info_macos, with both commands run concurrently by `asyncio.create_subprocess_exec`.
+    """
+    import asyncio
+    from util.orchestrator import run_command
+
+    async def query(command:list[str], parse, name:str):
+        try:
+            with span(command[0].rsplit('/', 1)[-1], "subprocess"):
+                returncode, output = await run_command(*command)
+            if returncode != 0:
+                raise OSError(f"{command[0]} exited with {returncode}")
+            return parse(output)
+        except Exception as e:
+            logger.error(f"Error getting {name}: {e}")
+            return None
+
+    ssid, ipv4 = await asyncio.gather(query(AIRPORT_COMMAND, parse_ssid, "SSID"), query(IFCONFIG_COMMAND, parse_ipv4, "IPv4"))
+    return {'SSID': ssid, 'IPv4 Address': ipv4}
+
    
 if __name__ == "__main__":
 
@@ -0,0 +1,59 @@
+import logging
+import threading
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+# File holding the OpenAI API key, in the working directory (the project root directory)
+KEY_FILENAME = "key"
+
+_lock = threading.Lock()
+_openai = None
+_api_key = None
+
+
+def set_api_key(api_key:str) -> None:
+    """
+    Use this API key instead of the one in the key file, e.g. a placeholder key for a local stub server.
+    """
+    global _api_key
+    with _lock:
+        _api_key = api_key
+        if _openai is not None:
+            _openai.api_key = api_key
+
+
+def _read_key_file(filename:str=KEY_FILENAME):
+    try:
+        with open(filename, "r") as file:
+            return file.read().strip('\n')
+    except FileNotFoundError:
+        logger.warning(f"No `{filename}` file found, the OpenAI API key is taken from the OPENAI_API_KEY environment variable")
+        return None
+
+
+def get_openai():
+    """
+    Import openai and give it the API key, the first time GPT is called.
+
+    Importing openai takes a few hundred milliseconds, and reading the key fails where there is no
+    key file: runs that never call GPT do neither.
+
+    :return: the openai module.
+    """
+    global _openai
+    with _lock:
+        if _openai is None:
+            import openai
+            api_key = _api_key or _read_key_file()
+            if api_key:
+                openai.api_key = api_key
+            _openai = openai
+    return _openai
+
+
+def openai_errors() -> tuple:
+    """
+    Exception classes raised by openai, to catch them without importing openai: if it was never
+    imported, no call could have raised them.
+    """
+    return (_openai.error.OpenAIError,) if _openai is not None else ()
@@ -0,0 +1,226 @@
+"""
+Run the stages of a program concurrently with asyncio, each one as soon as the stages it depends on are done.
+
+asyncio is only imported by the runs that use this module, it is slow to import.
+"""
+import time
+import signal
+import asyncio
+import logging
+import threading
+
+from util.timing import span
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    Stage run by run_stages.
+
+    :param name: Name of the stage, also the keyword its result is passed to the stages depending on it with.
+    :param function: Coroutine function, called with the results of the stages it depends on as keyword arguments.
+    :param depends_on: Names of the stages that must be done before this one starts.
+    :param timeout: Seconds the stage may take before it is cancelled, None for no limit.
+    :param default: Result of the stage if it fails, times out, or is skipped.
+    :param skip_on_failure: Skip the stage if one of the stages it depends on failed. If False, it runs
+        with the default results of the failed stages.
+    """
+
+    def __init__(self, name:str, function, depends_on:tuple=(), timeout:float=None, default=None, skip_on_failure:bool=True):
+        self.name = name
+        self.function = function
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+        self.default = default
+        self.skip_on_failure = skip_on_failure
+
+
+def _check_stages(stages:list[Stage]) -> None:
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names in {names}")
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+
+    # Depth first search for a cycle, which would leave its stages waiting for each other forever
+    state = {}
+    def visit(name:str, path:tuple) -> None:
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Stages depend on each other: {' -> '.join(path + (name,))}")
+        state[name] = "visiting"
+        for dependency in by_name[name].depends_on:
+            visit(dependency, path + (name,))
+        state[name] = "done"
+    for name in names:
+        visit(name, ())
+
+
+class _StageTimeout(Exception):
+    """
+    Raised by _wait_for when the stage deadline expired, unlike the TimeoutError a stage raises itself.
+    """
+
+
+async def _wait_for(coroutine, timeout:float):
+    """
+    Await a coroutine, cancelling it after timeout seconds (None for no limit).
+
+    `asyncio.wait_for` raises the same TimeoutError whether its deadline expired or the coroutine raised
+    one, such as a socket timeout, and `asyncio.timeout` is only available from Python 3.11.
+
+    :raises _StageTimeout: if the deadline expired.
+    """
+    task = asyncio.ensure_future(coroutine)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    if not done:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise _StageTimeout()
+    return task.result()
+
+
+async def run_stages(stages:list[Stage]) -> dict:
+    """
+    Run the stages, each one as soon as the stages it depends on are done, and independent stages concurrently.
+
+    A stage that fails or times out is logged and gives its default result, and the stages depending
+    on it are skipped with theirs, unless they are run regardless (skip_on_failure=False). If run_stages is cancelled, e.g. on Ctrl+C, every stage still
+    running is cancelled, which kills its subprocesses, before CancelledError is raised again.
+
+    :return: dictionary of the result of each stage, by name.
+    """
+    _check_stages(stages)
+    tasks = {}
+    failed = set()
+    started = time.perf_counter()
+
+    async def run(stage:Stage):
+        inputs = {}
+        for dependency in stage.depends_on:
+            inputs[dependency] = await tasks[dependency]
+        skipped = [dependency for dependency in stage.depends_on if dependency in failed]
+        if skipped and stage.skip_on_failure:
+            logger.error(f"Stage {stage.name} skipped, as {', '.join(skipped)} failed")
+            failed.add(stage.name)
+            return stage.default
+
+        stage_started = time.perf_counter()
+        try:
+            with span(stage.name, "stage"):
+                result = await _wait_for(stage.function(**inputs), stage.timeout)
+        except _StageTimeout:
+            logger.error(f"Stage {stage.name} timed out after {stage.timeout:g} s and was cancelled")
+            failed.add(stage.name)
+            return stage.default
+        except Exception as e:
+            logger.error(f"Stage {stage.name} failed: {e!r}")
+            failed.add(stage.name)
+            return stage.default
+        logger.info(f"Stage {stage.name} done in {time.perf_counter() - stage_started:.2f} s "
+                    f"({time.perf_counter() - started:.2f} s since the start)")
+        return result
+
+    # Every task exists before any of them runs, so that they can wait for each other
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    except asyncio.CancelledError:
+        # gather already cancelled every task, cancelling them again would interrupt their clean up
+        running = [name for name, task in tasks.items() if not task.done() or task.cancelled()]
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        logger.error(f"Cancelled the stages still running: {', '.join(running) or 'none'}")
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
+
+def run_until_interrupted(coroutine):
+    """
+    Run a coroutine in a new event loop, cancelling it on Ctrl+C (SIGINT) rather than raising
+    KeyboardInterrupt wherever the program happens to be. A second Ctrl+C interrupts as usual.
+
+    :return: the result of the coroutine.
+    :raises asyncio.CancelledError: if it was interrupted.
+    """
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(coroutine)
+
+    def interrupt():
+        logger.error("Keyboard Interrupted. Cancelling the running stages ...")
+        loop.remove_signal_handler(signal.SIGINT)
+        task.cancel()
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, interrupt)
+    except (NotImplementedError, RuntimeError):
+        # No signal handlers in event loops on Windows, nor outside the main thread
+        pass
+    try:
+        return loop.run_until_complete(task)
+    finally:
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError):
+            pass
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def run_command(*command:str) -> tuple[int, str]:
+    """
+    Run a command with `asyncio.create_subprocess_exec`, killing it if the calling task is cancelled.
+
+    :return: (exit code, output and errors of the command)
+    """
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    try:
+        output, _ = await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return process.returncode, output.decode('utf-8', errors='replace')
+
+
+async def run_in_thread(function, *args):
+    """
+    Run a blocking function in a daemon thread.
+
+    Unlike `asyncio.to_thread`, the program does not wait for the function to return when the
+    calling task is cancelled, so blocking calls without a timeout (such as the speed test) do not
+    delay an interruption.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result, exception):
+        if not future.done():
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def target():
+        try:
+            result, exception = function(*args), None
+        except BaseException as e:
+            result, exception = None, e
+        try:
+            loop.call_soon_threadsafe(set_result, result, exception)
+        except RuntimeError:
+            # The event loop was closed while the function ran, nobody waits for its result any more
+            pass
+
+    threading.Thread(target=target, name=getattr(function, '__name__', 'stage'), daemon=True).start()
+    return await future
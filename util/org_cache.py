@@ -0,0 +1,135 @@
+import json
+import time
+import sqlite3
+import logging
+import ipaddress
+import threading
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 7 * 24 * 60 * 60  # one week, in seconds
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def _address_key(ip_address) -> str:
+    """
+    Fixed width hex representation of an address, prefixed by its IP version,
+    so that addresses compare correctly as text and IPv4 never falls into an IPv6 range.
+    """
+    return f"{ip_address.version}:{int(ip_address):032x}"
+
+
+class OrgCache:
+    """
+    Persistent cache of organization details keyed by the network range they were resolved for.
+
+    Entries live in a SQLite database so that several processes can share it safely. An IP
+    address is looked up by containment, and the most specific range containing it wins.
+    Entries older than `ttl` seconds are ignored and purged, and once there are more than
+    `max_entries` networks the least recently used ones are evicted.
+    """
+
+    def __init__(self, filename:str="org_cache.sqlite", ttl:float=DEFAULT_TTL, max_entries:int=DEFAULT_MAX_ENTRIES):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS org_cache (
+                network TEXT PRIMARY KEY,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                record TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS org_cache_range ON org_cache (start, end)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS org_cache_access ON org_cache (last_access)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def lookup(self, ip_address:str):
+        """
+        Find the cached organization details of the most specific network containing ip_address.
+
+        :param ip_address: IP address to search for.
+        :return: Dictionary of organization details, or None on a miss.
+        """
+        key = _address_key(ipaddress.ip_address(ip_address))
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                """
+                SELECT network, record FROM org_cache
+                WHERE start <= ? AND end >= ? AND created_at >= ?
+                ORDER BY start DESC, end ASC LIMIT 1
+                """,
+                (key, key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE org_cache SET last_access = ? WHERE network = ?", (now, row[0]))
+            self.hits += 1
+        logger.info(f"{ip_address} found in organization cache under {row[0]}")
+        return json.loads(row[1])
+
+    def put(self, network_range:str, record:dict) -> None:
+        """
+        Store organization details for a network range.
+
+        :param network_range: CIDR network, or several comma separated CIDR networks as produced by `to_cidr`.
+        :param record: Dictionary of organization details.
+        """
+        networks = []
+        for cidr in str(network_range).split(','):
+            try:
+                networks.append(ipaddress.ip_network(cidr.strip(), strict=False))
+            except ValueError:
+                continue
+        # Never cache the catch-all range `to_cidr` falls back to, it would shadow every other entry
+        networks = [network for network in networks if network.prefixlen > 0]
+        if not networks:
+            return
+
+        now = time.time()
+        serialized = json.dumps(record)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO org_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    [(str(network), _address_key(network.network_address), _address_key(network.broadcast_address),
+                      serialized, now, now) for network in networks]
+                )
+                self._evict(now)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now:float) -> None:
+        self._connection.execute("DELETE FROM org_cache WHERE created_at < ?", (now - self.ttl,))
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM org_cache").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM org_cache WHERE network IN (SELECT network FROM org_cache ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM org_cache").fetchone()
+        return count
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
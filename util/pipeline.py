@@ -0,0 +1,100 @@
+import logging
+
+from util.hop import Hop, OrgRecord
+from util.trace_route import iter_trace_route, aiter_trace_route, LocationClient
+from util.gpt_whois import OrgResolver, collect_org_details
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+def trace_and_enrich(target_url:str, location_client:LocationClient, org_resolver:OrgResolver, engine:str="system") -> tuple[list[Hop], list[OrgRecord], int]:
+    """
+    Perform a traceroute and look up the location and organization of each public hop as soon as
+    traceroute reports it, while the following hops are still being probed.
+
+    :param target_url: Target URL of the traceroute.
+    :param location_client: LocationClient used for the location lookups.
+    :param org_resolver: OrgResolver used for the whois lookups.
+    :param engine: traceroute engine, "system" or "probe", see `iter_trace_route`.
+    :return: (hops, org_record_list, hop_count)
+        hops: the public hops with their location, in hop order, one per IP address
+        org_record_list: list of organizations, one per network range identified
+        hop_count: the number of hops went through
+    """
+    destination_ip = None
+    identified_ips = set()
+    public_hops = []
+    location_futures = []
+    org_futures = []
+    hop_count = 0
+
+    for hop in iter_trace_route(target_url, engine):
+        if hop.number == 0:
+            # omit the destination ip address announced by traceroute, as trace_route does
+            destination_ip = destination_ip or hop.ip
+            continue
+        hop_count = max(hop_count, hop.number)
+
+        if hop.ip is None or hop.ip == destination_ip or hop.ip in identified_ips:
+            continue
+        identified_ips.add(hop.ip)
+
+        # filter out the private ip addresses 
+        if hop.is_private:
+            continue
+        ip_address = hop.ip_address
+        public_hops.append(hop)
+        location_futures.append(location_client.submit(ip_address))
+        org_futures.append(org_resolver.submit(ip_address))
+
+    logger.info(f"Traceroute finished after {hop_count} hops, waiting for the remaining lookups")
+    hops = [hop.replace(location=future.result()) for hop, future in zip(public_hops, location_futures)]
+    org_record_list = collect_org_details(org_futures)
+    return (hops, org_record_list, hop_count)
+
+async def trace_and_enrich_async(target_url:str, location_client:LocationClient, org_resolver:OrgResolver, engine:str="system") -> tuple[list[Hop], list[OrgRecord], int]:
+    """
+    Asynchronous `trace_and_enrich`, for the stages of `util.orchestrator.run_stages`: the traceroute
+    runs with `aiter_trace_route` and the lookups are awaited, so that the other stages run meanwhile.
+    If the stage is cancelled, traceroute is killed and the lookups not yet started are dropped.
+
+    :return: (hops, org_record_list, hop_count), as trace_and_enrich.
+    """
+    import asyncio
+
+    destination_ip = None
+    identified_ips = set()
+    public_hops = []
+    location_futures = []
+    org_futures = []
+    hop_count = 0
+
+    # Closed here rather than left to the garbage collector, so that a cancelled traceroute is killed right away
+    trace = aiter_trace_route(target_url, engine)
+    try:
+        async for hop in trace:
+            if hop.number == 0:
+                destination_ip = destination_ip or hop.ip
+                continue
+            hop_count = max(hop_count, hop.number)
+
+            if hop.ip is None or hop.ip == destination_ip or hop.ip in identified_ips:
+                continue
+            identified_ips.add(hop.ip)
+            if hop.is_private:
+                continue
+            ip_address = hop.ip_address
+            public_hops.append(hop)
+            location_futures.append(location_client.submit(ip_address))
+            org_futures.append(org_resolver.submit(ip_address))
+
+        logger.info(f"Traceroute finished after {hop_count} hops, waiting for the remaining lookups")
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in location_futures + org_futures), return_exceptions=True)
+    except asyncio.CancelledError:
+        for future in location_futures + org_futures:
+            future.cancel()
+        raise
+    finally:
+        await trace.aclose()
+    hops = [hop.replace(location=future.result()) for hop, future in zip(public_hops, location_futures)]
+    org_record_list = collect_org_details(org_futures)
+    return (hops, org_record_list, hop_count)
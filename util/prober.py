@@ -0,0 +1,179 @@
+import time
+import errno
+import select
+import socket
+import struct
+import logging
+import argparse
+
+from util.hop import Hop
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+BASE_PORT = 33434  # first destination port used by traceroute probes
+
+ICMP_TIME_EXCEEDED = 11
+ICMP_DEST_UNREACHABLE = 3
+
+
+def _parse_icmp_reply(packet:bytes):
+    """
+    Parse an ICMP error received on a raw socket.
+
+    :param packet: IP packet carrying the ICMP message.
+    :return: (icmp_type, icmp_code, quoted destination address, quoted UDP source port, quoted UDP
+        destination port), or None if the packet is not an ICMP error quoting a UDP datagram.
+    """
+    if len(packet) < 20:
+        return None
+    header_length = (packet[0] & 0x0F) * 4
+    icmp = packet[header_length:]
+    if len(icmp) < 8 + 20 + 8:
+        return None
+    icmp_type, icmp_code = icmp[0], icmp[1]
+    if icmp_type not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+        return None
+
+    quoted = icmp[8:]
+    quoted_header_length = (quoted[0] & 0x0F) * 4
+    if quoted[9] != socket.IPPROTO_UDP or len(quoted) < quoted_header_length + 8:
+        return None
+    quoted_destination = socket.inet_ntoa(quoted[16:20])
+    source_port, destination_port = struct.unpack('!HH', quoted[quoted_header_length:quoted_header_length + 4])
+    return icmp_type, icmp_code, quoted_destination, source_port, destination_port
+
+
+def _probe_id(reply:tuple, destination:str, source_port:int, base_port:int, probe_count:int):
+    """
+    Probe answered by an ICMP reply parsed by _parse_icmp_reply, or None if it answers another prober:
+    one sending to another destination, or from another source port.
+    """
+    _, _, quoted_destination, quoted_source_port, destination_port = reply
+    probe_id = destination_port - base_port
+    if quoted_destination != destination or quoted_source_port != source_port or not 0 <= probe_id < probe_count:
+        return None
+    return probe_id
+
+
+def probe(target_url:str, max_hops:int=30, queries:int=3, timeout:float=2.0, base_port:int=BASE_PORT) -> tuple[str, list[dict]]:
+    """
+    Traceroute in-process: send UDP probes for every TTL at once and collect the ICMP replies.
+
+    Each probe is sent to its own destination port, which is quoted back in the ICMP reply and
+    identifies the probe. The probes of each call are sent from their own source port, also quoted
+    back, since the raw socket receives the ICMP replies to every prober running on the host.
+    Receiving ICMP needs a raw socket, so this usually requires root (or CAP_NET_RAW on Linux).
+
+    :param target_url: Host name or IPv4 address to trace.
+    :param max_hops: Largest TTL probed.
+    :param queries: Number of probes sent per TTL.
+    :param timeout: Seconds to wait for replies after the last probe was sent.
+    :param base_port: Destination port of the first probe.
+    :return: (destination IP address, probe records). Each probe record is a dictionary with the
+        keys 'ttl', 'probe_id', 'ip' (responder, None if unanswered), 'rtt' (ms, None if unanswered),
+        'icmp_type' and 'icmp_code'.
+    """
+    destination = socket.gethostbyname(target_url)
+
+    try:
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    except PermissionError as e:
+        raise PermissionError(errno.EPERM, "the in-process prober needs a raw ICMP socket (run as root or grant CAP_NET_RAW)") from e
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+
+    records = []
+    try:
+        sender.bind(('', 0))
+        source_port = sender.getsockname()[1]
+        receiver.setblocking(False)
+        # Send every probe up front, the replies of all TTLs then arrive within about one round trip
+        for ttl in range(1, max_hops + 1):
+            sender.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+            for _ in range(queries):
+                probe_id = len(records)
+                records.append({'ttl': ttl, 'probe_id': probe_id, 'ip': None, 'rtt': None,
+                                'icmp_type': None, 'icmp_code': None, 'sent': time.perf_counter()})
+                try:
+                    sender.sendto(b'\0' * 32, (destination, base_port + probe_id))
+                except OSError as e:
+                    logger.error(f"Could not send probe {probe_id} with TTL {ttl}: {e}")
+
+        unanswered = len(records)
+        destination_ttl = None
+        deadline = time.perf_counter() + timeout
+        while unanswered:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([receiver], [], [], remaining)
+            if not readable:
+                break
+            packet, (responder, _) = receiver.recvfrom(1500)
+            received = time.perf_counter()
+
+            reply = _parse_icmp_reply(packet)
+            if reply is None:
+                continue
+            probe_id = _probe_id(reply, destination, source_port, base_port, len(records))
+            if probe_id is None:
+                continue
+            icmp_type, icmp_code = reply[0], reply[1]
+            record = records[probe_id]
+            if record['ip'] is not None:
+                continue
+
+            record['ip'] = responder
+            record['rtt'] = (received - record['sent']) * 1000
+            record['icmp_type'] = icmp_type
+            record['icmp_code'] = icmp_code
+            unanswered -= 1
+
+            # Once the destination answered, probes with a larger TTL will not tell us more
+            if icmp_type == ICMP_DEST_UNREACHABLE:
+                if destination_ttl is None or record['ttl'] < destination_ttl:
+                    destination_ttl = record['ttl']
+                unanswered = sum(1 for r in records if r['ip'] is None and r['ttl'] <= destination_ttl)
+    finally:
+        sender.close()
+        receiver.close()
+
+    if destination_ttl is not None:
+        records = [record for record in records if record['ttl'] <= destination_ttl]
+    for record in records:
+        del record['sent']
+    return destination, records
+
+
+def iter_probe_trace(target_url:str, **kwargs):
+    """
+    Traceroute with the in-process prober, yielding Hop as `util.trace_route.iter_trace_route` does:
+    hop 0 is the destination, then one hop per TTL and responder.
+    """
+    destination, records = probe(target_url, **kwargs)
+    yield Hop.parse(0, destination)
+
+    for ttl in sorted({record['ttl'] for record in records}):
+        responders = {}
+        for record in records:
+            if record['ttl'] == ttl and record['ip'] is not None:
+                responders.setdefault(record['ip'], []).append(round(record['rtt'], 3))
+        if not responders:
+            yield Hop(ttl)
+        for ip, rtts in responders.items():
+            logger.info(f"{ttl}  {ip}  " + "  ".join(f"{rtt} ms" for rtt in rtts))
+            yield Hop.parse(ttl, ip, rtts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process parallel probe traceroute.")
+    parser.add_argument('target', type=str, help="Target host, e.g. 127.0.0.1 for a loopback test")
+    parser.add_argument('-m', dest='max_hops', type=int, default=30, help="Largest TTL probed")
+    parser.add_argument('-q', dest='queries', type=int, default=3, help="Probes sent per TTL")
+    parser.add_argument('-w', dest='timeout', type=float, default=2.0, help="Seconds to wait for replies")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    destination, records = probe(args.target, args.max_hops, args.queries, args.timeout)
+    print(f"traceroute to {args.target} ({destination}) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    for record in records:
+        print(record)
@@ -1,10 +1,12 @@
 import subprocess
-import speedtest
 
 import logging
 
+from util.timing import span, timed
+
 logger:logging.Logger = logging.getLogger(__name__)
 
+@timed("ping", "subprocess")
 def ping_test(target_url:str, count:int=4):
     """
     Get the latency to the target URL 
@@ -16,18 +18,40 @@ def ping_test(target_url:str, count:int=4):
             universal_newlines=True  # Needed for the output to be a string
         )
         
-        # Extract the average latency from the ping output
-        avg_latency = response.split('/')[-3]
-        return avg_latency
+        return parse_ping_output(response)
     
     except subprocess.CalledProcessError:
         logger.error(f"Ping to {target_url} failed!")
         return None
 
+def parse_ping_output(response:str):
+    """
+    Extract the average latency from the ping output
+    """
+    return response.split('/')[-3]
+
+async def ping_test_async(target_url:str, count:int=4):
+    """
+    Get the latency to the target URL, with ping run by `asyncio.create_subprocess_exec`
+    so that the other stages run meanwhile. ping is killed if the stage is cancelled.
+    """
+    from util.orchestrator import run_command
+
+    with span("ping", "subprocess"):
+        returncode, response = await run_command('ping', '-c', str(count), target_url)
+    if returncode != 0:
+        logger.error(f"Ping to {target_url} failed!")
+        return None
+    return parse_ping_output(response)
+
+@timed("speedtest", "network")
 def speed_test():
     """
     Test the download/upload speed of current network
     """
+    # Imported here, as only runs with the speed test need it
+    import speedtest
+
     st = speedtest.Speedtest()
     st.get_best_server()  # Selects the best server for testing
     
@@ -0,0 +1,189 @@
+"""
+Lightweight timing spans around the stages of a run and the external calls they make
+(subprocesses, HTTP requests, GPT calls, CSV writes).
+
+Timing is disabled unless `enable` is called: `span` then returns a shared no-op context manager and
+functions decorated with `timed` are called straight through, so the instrumentation costs one global
+lookup per call. Once enabled, every span is recorded with its thread, and the recorder can write a JSON
+report (per-span summary and raw spans) and a Chrome trace-event file (open in chrome://tracing or Perfetto).
+"""
+import os
+import json
+import time
+import logging
+import functools
+import threading
+from contextlib import nullcontext
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+_recorder = None
+_NO_SPAN = nullcontext()
+
+
+class TimingRecorder:
+    """
+    Collects the spans recorded while timing is enabled, from any thread.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.origin = time.perf_counter_ns()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name:str, category:str, start:int, end:int, attributes:dict) -> None:
+        """
+        :param start: perf_counter_ns() when the span started.
+        :param end: perf_counter_ns() when the span ended.
+        """
+        thread = threading.current_thread()
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'category': category,
+                'start_ms': (start - self.origin) / 1e6,
+                'duration_ms': (end - start) / 1e6,
+                'thread_id': thread.ident,
+                'thread_name': thread.name,
+                'attributes': attributes
+            })
+
+    def summary(self) -> list[dict]:
+        """
+        :return: count, total, mean and max duration (ms) of the spans of each name, longest total first.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        totals = {}
+        for span in spans:
+            entry = totals.setdefault(span['name'], {'name': span['name'], 'category': span['category'], 'count': 0,
+                                                     'total_ms': 0.0, 'max_ms': 0.0})
+            entry['count'] += 1
+            entry['total_ms'] += span['duration_ms']
+            entry['max_ms'] = max(entry['max_ms'], span['duration_ms'])
+        for entry in totals.values():
+            entry['mean_ms'] = entry['total_ms'] / entry['count']
+        return sorted(totals.values(), key=lambda entry: entry['total_ms'], reverse=True)
+
+    def report(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {'started_at': self.started_at, 'summary': self.summary(), 'spans': spans}
+
+    def chrome_trace(self) -> dict:
+        """
+        :return: the spans in the Chrome trace-event format, as complete ("X") events.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        events = []
+        thread_names = {}
+        for span in spans:
+            thread_names[span['thread_id']] = span['thread_name']
+            events.append({
+                'name': span['name'],
+                'cat': span['category'],
+                'ph': 'X',
+                'ts': span['start_ms'] * 1000,
+                'dur': span['duration_ms'] * 1000,
+                'pid': pid,
+                'tid': span['thread_id'],
+                'args': span['attributes']
+            })
+        for thread_id, thread_name in thread_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, output_prefix:str) -> tuple[str, str]:
+        """
+        Write the JSON report to `<output_prefix>timing.json` and the Chrome trace to `<output_prefix>trace.json`.
+
+        :return: (report filename, trace filename)
+        """
+        report_filename = f"{output_prefix}timing.json"
+        trace_filename = f"{output_prefix}trace.json"
+        with open(report_filename, 'w') as file:
+            json.dump(self.report(), file, indent=2, default=str)
+        with open(trace_filename, 'w') as file:
+            json.dump(self.chrome_trace(), file, default=str)
+        return report_filename, trace_filename
+
+
+class _Span:
+    __slots__ = ('recorder', 'name', 'category', 'attributes', 'start')
+
+    def __init__(self, recorder:TimingRecorder, name:str, category:str, attributes:dict):
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        # A generator closed early is not a failure of the span around its body
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.attributes['error'] = exc_type.__name__
+        self.recorder.record(self.name, self.category, self.start, end, self.attributes)
+        return False
+
+
+def enable() -> TimingRecorder:
+    """
+    Start recording spans, discarding any spans recorded before.
+    """
+    global _recorder
+    _recorder = TimingRecorder()
+    return _recorder
+
+
+def disable() -> TimingRecorder:
+    """
+    Stop recording spans.
+
+    :return: the recorder holding the spans recorded, or None if timing was not enabled.
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def is_enabled() -> bool:
+    return _recorder is not None
+
+
+def span(name:str, category:str="stage", **attributes):
+    """
+    Context manager timing the block it wraps.
+
+    :param name: Name of the span, spans of the same name are summarized together.
+    :param category: Kind of work, e.g. "stage", "subprocess", "http", "llm" or "csv".
+    :param attributes: Details recorded with the span, e.g. the IP address looked up.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NO_SPAN
+    return _Span(recorder, name, category, attributes)
+
+
+def timed(name:str=None, category:str="call"):
+    """
+    Decorator timing every call of a function, named after the function unless `name` is given.
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return function(*args, **kwargs)
+            with _Span(recorder, span_name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
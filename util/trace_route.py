@@ -1,65 +1,184 @@
 import re
-import requests
 import subprocess
 import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from util.prober import iter_probe_trace
+from util.hop import Hop
+from util.timing import span, timed
 
 logger:logging.Logger = logging.getLogger(__name__)
 
-def trace_route(target_url:str) -> tuple[list[str],int]:
+# Pattern to match IP addresses (with parenthesis to avoid duplication)
+IP_PATTERN = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
+# Pattern to match hop number at the start of the line
+HOP_NUMBER_PATTERN = re.compile(r'^\s*(\d+)\s')
+# Pattern to match the round trip times
+RTT_PATTERN = re.compile(r'([\d.]+)\s*ms')
+
+class TracerouteParser:
+    """
+    Parse the output of the traceroute command line by line, remembering the current hop number.
+    """
+
+    def __init__(self):
+        self.hop_number = 0
+
+    def parse_line(self, output_line:str):
+        """
+        :return: the Hop of an output line, or None for a line without hop.
+        """
+        output_line = output_line.strip()
+        if not output_line:
+            return None
+        logger.info(output_line)
+
+        # Extract hop number, lines without one are further replies to the current hop
+        hop_match = HOP_NUMBER_PATTERN.match(output_line)
+        if hop_match:
+            self.hop_number = int(hop_match.group(1))
+            output_line = output_line[hop_match.end():]
+
+        # Extract IP address
+        match = IP_PATTERN.search(output_line)  # Search for IP in the line
+        if match is None and not hop_match:
+            return None
+        return Hop.parse(
+            self.hop_number,
+            match.group(1) if match else None,  # This should remove the parenthesis 
+            [float(rtt) for rtt in RTT_PATTERN.findall(output_line)]
+        )
+
+def iter_trace_route(target_url:str, engine:str="system"):
+    """
+    Perform a traceroute and yield each hop as soon as its line is printed.
+
+    :param target_url: 
+    :param engine: "system" to run the `traceroute` command, or "probe" to use the in-process
+        prober of `util.prober`, which falls back to the system command without raw socket permission.
+    :return: generator of Hop, without location nor organization.
+        The first hop has number 0 and holds the destination IP address announced by traceroute.
+    """
+    if engine == "probe":
+        try:
+            with span("probe", "network", target=target_url):
+                hops = list(iter_probe_trace(target_url))
+        except OSError as e:
+            # No raw socket (PermissionError), or the target did not resolve (socket.gaierror)
+            logger.error(f"In-process prober unavailable, falling back to traceroute: {e}")
+        else:
+            yield from hops
+            return
+
+    cmd = ['traceroute',  target_url]
+    # The span lasts as long as the traceroute process
+    with span("traceroute", "subprocess", target=target_url):
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True
+        )
+
+        parser = TracerouteParser()
+        try:
+            for output_line in process.stdout:
+                hop = parser.parse_line(output_line)
+                if hop is not None:
+                    yield hop
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+async def aiter_trace_route(target_url:str, engine:str="system"):
+    """
+    Asynchronous `iter_trace_route`: the traceroute command runs with `asyncio.create_subprocess_exec`,
+    and the in-process prober in a worker thread, so that other stages run meanwhile.
+    Cancelling the iteration kills the traceroute process.
+
+    :return: asynchronous generator of Hop, as iter_trace_route.
+    """
+    import asyncio
+    from util.orchestrator import run_in_thread
+
+    if engine == "probe":
+        try:
+            with span("probe", "network", target=target_url):
+                hops = await run_in_thread(lambda: list(iter_probe_trace(target_url)))
+        except OSError as e:
+            # No raw socket (PermissionError), or the target did not resolve (socket.gaierror)
+            logger.error(f"In-process prober unavailable, falling back to traceroute: {e}")
+        else:
+            for hop in hops:
+                yield hop
+            return
+
+    with span("traceroute", "subprocess", target=target_url):
+        process = await asyncio.create_subprocess_exec(
+            'traceroute', target_url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+
+        parser = TracerouteParser()
+        try:
+            async for output_line in process.stdout:
+                hop = parser.parse_line(output_line.decode('utf-8', errors='replace'))
+                if hop is not None:
+                    yield hop
+        finally:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+
+def trace_route(target_url:str, engine:str="system") -> tuple[list[Hop],int]:
     """
     Perform a traceroute and obtain all the IP addresses 
     :param target_url:  
+    :param engine: "system" or "probe", see `iter_trace_route`
     :return: (identified_hops, hop_count)
-        identified_hops: a list of IP address of the hops that have been identified 
+        identified_hops: a list of the hops that have been identified, the first hop of each IP address
         hop_count: the number of hops went through
     
     """
-    cmd = ['traceroute',  target_url]
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True
-    )
-
     identified_hops = []
+    identified_ips = set()
     hop_count = 0 
-    trace_route_output = []
-
-    # Pattern to match IP addresses (with parenthesis to avoid duplication)
-    ip_pattern = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')  
-    # Pattern to match hop number at the start of the line
-    hop_number_pattern = re.compile(r'^\s*(\d+)\s')
-
-    while True:
-        output_line = process.stdout.readline()
-        if output_line == '' and process.poll() is not None:
-            break
-        if output_line:
-            logger.info(output_line.strip())
-            trace_route_output.append(output_line.strip())
-             # Extract hop number
-            hop_match = hop_number_pattern.match(output_line)
-            if hop_match:
-                hop_count = max(hop_count, int(hop_match.group(1)))
-            
-            # Extract IP address
-            match = ip_pattern.search(output_line)  # Search for IP in the line
-            if match:  # If found
-                matched_ip_address = match.group(1) # This should remove the parenthesis 
-                if matched_ip_address not in identified_hops:
-                    identified_hops.append(matched_ip_address)  # Add the matched IP if it's not already in the list
+
+    for hop in iter_trace_route(target_url, engine):
+        hop_count = max(hop_count, hop.number)
+        if hop.ip is not None and hop.ip not in identified_ips:
+            identified_ips.add(hop.ip)
+            identified_hops.append(hop)  # Add the matched IP if it's not already in the list
     
     identified_hops = identified_hops[1:] # omit the first ip address as it is the destination ip address 
     return (identified_hops, hop_count)
 
-def get_ip_info(ip_address:str):
+IPINFO_BASE_URL = "https://ipinfo.io"
+
+@timed("ipinfo", "http")
+def get_ip_info(ip_address:str, session=None, base_url:str=IPINFO_BASE_URL, timeout:float=5):
+    """
+    Get the location of an IP address from ipinfo.io
+
+    :param ip_address: IP address to locate.
+    :param session: Optional `requests.Session` whose connections are reused.
+    :param base_url: Base URL of the ipinfo compatible service.
+    :param timeout: Timeout of the request in seconds.
+    :return: Location as "org, city, region, country", or None if the lookup failed.
+    """
+    import requests
+
     try:
-        response = requests.get(f"https://ipinfo.io/{ip_address}/json")
+        response = (session or requests).get(f"{base_url}/{ip_address}/json", timeout=timeout)
         data = response.json()
         
         if 'error' in data:
-            return data['error']['message']
+            logger.warning(f"Location of {ip_address} not found: {data['error'].get('message')}")
+            return None
         
         city = data.get('city', 'Private')
         region = data.get('region', 'Private')
@@ -67,8 +186,87 @@ def get_ip_info(ip_address:str):
         org = data.get('org', 'Private')
         location = f"{org}, {city}, {region}, {country}"
         return location
-    except requests.RequestException as e:
-        return str(e)
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Error looking up the location of {ip_address}: {e}")
+        return None
+
+def _failed(future:Future) -> bool:
+    return future.done() and (future.cancelled() or future.exception() is not None or future.result() is None)
+
+class LocationClient:
+    """
+    Look up the locations of IP addresses concurrently.
+
+    Requests share one keep-alive connection pool and run on a bounded pool of workers.
+    Every IP address is only looked up once per client, unless the lookup failed.
+    """
 
-def get_locations(ip_addresses_list: list[str]) -> list[list[str]]:
-    return [[ip, get_ip_info(ip)] for ip in ip_addresses_list]
\ No newline at end of file
+    def __init__(self, base_url:str=IPINFO_BASE_URL, max_workers:int=8, timeout:float=5):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        # requests is only imported by runs that look locations up
+        import requests
+        import requests.adapters
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ipinfo")
+
+    def close(self, wait:bool=True) -> None:
+        """
+        :param wait: If False, e.g. when the run was interrupted, drop the lookups not started yet and
+            return without waiting for those in flight.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close(wait=exc_type is None)
+
+    def submit(self, ip_address:str) -> Future:
+        """
+        Start looking up the location of an IP address.
+
+        :return: Future of the location string, None if the lookup failed.
+        """
+        with self._lock:
+            future = self._futures.get(ip_address)
+            # The callback dropping a failed lookup may not have run yet when its result is known
+            if future is not None and not _failed(future):
+                return future
+            future = self._executor.submit(get_ip_info, ip_address, self.session, self.base_url, self.timeout)
+            self._futures[ip_address] = future
+        # Outside the lock: the callback runs at once if the lookup is already done
+        future.add_done_callback(lambda done: self._forget_failed(ip_address, done))
+        return future
+
+    def _forget_failed(self, ip_address:str, future:Future) -> None:
+        # A failed lookup, e.g. a timeout, is tried again the next time the IP address is submitted
+        if _failed(future):
+            with self._lock:
+                if self._futures.get(ip_address) is future:
+                    del self._futures[ip_address]
+
+    def get_locations(self, hops: list[Hop]) -> list[Hop]:
+        futures = [self.submit(hop.ip_address) for hop in hops]
+        return [hop.replace(location=future.result()) for hop, future in zip(hops, futures)]
+
+def get_locations(hops: list[Hop], client:LocationClient=None) -> list[Hop]:
+    """
+    Get the location of each hop, looked up concurrently.
+
+    :param hops: List of hops with an IP address.
+    :param client: Optional LocationClient to share across calls.
+    :return: Copies of the hops with their location, in the order of hops.
+    """
+    if client is not None:
+        return client.get_locations(hops)
+    with LocationClient() as client:
+        return client.get_locations(hops)
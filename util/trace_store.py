@@ -0,0 +1,560 @@
+import os
+import re
+import csv
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import ipaddress
+import threading
+from datetime import datetime
+
+from util.hop import Hop, OrgRecord, ORG_DETAIL_FIELDS, int_to_ip, ip_to_int
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 64  # traces written per transaction
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS traces (
+        id INTEGER PRIMARY KEY,
+        target TEXT NOT NULL,
+        traced_at REAL NOT NULL,
+        destination,
+        hop_count INTEGER,
+        download REAL,
+        upload REAL,
+        latency REAL,
+        snapshot_id INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL UNIQUE,
+        loaded_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS orgs (
+        id INTEGER PRIMARY KEY,
+        regional_registry TEXT,
+        network_range TEXT,
+        organization TEXT,
+        address TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY,
+        location TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS hops (
+        trace_id INTEGER NOT NULL,
+        number INTEGER NOT NULL,
+        ip,
+        rtt_ms REAL,
+        location_id INTEGER,
+        org_id INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ixp_matches (
+        trace_id INTEGER NOT NULL,
+        traced_at REAL NOT NULL,
+        number INTEGER NOT NULL,
+        ip,
+        ix_id INTEGER NOT NULL,
+        name TEXT,
+        prefix TEXT,
+        snapshot_id INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS traces_target ON traces (target, traced_at)",
+    "CREATE INDEX IF NOT EXISTS traces_time ON traces (traced_at)",
+    "CREATE INDEX IF NOT EXISTS orgs_range ON orgs (network_range)",
+    "CREATE INDEX IF NOT EXISTS hops_trace ON hops (trace_id, number)",
+    "CREATE INDEX IF NOT EXISTS hops_ip ON hops (ip, trace_id)",
+    "CREATE INDEX IF NOT EXISTS ixp_matches_ix ON ixp_matches (ix_id, traced_at)",
+    "CREATE INDEX IF NOT EXISTS ixp_matches_trace ON ixp_matches (trace_id)",
+]
+
+MATCH_INSERT = "INSERT INTO ixp_matches (trace_id, traced_at, number, ip, ix_id, name, prefix, snapshot_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Columns added since the first version of the schema, added to the tables of older databases
+MIGRATIONS = [
+    ("traces", "snapshot_id", "INTEGER"),
+    ("ixp_matches", "snapshot_id", "INTEGER")
+]
+
+
+def ip_column(ip:int):
+    """
+    Value stored in the ip columns for an IP address given as an integer by `util.hop.ip_to_int`:
+    the address itself for IPv4, and its 16 bytes for IPv6, which do not fit in a SQLite integer.
+    SQLite orders integers before blobs, so both families can share the column and its index.
+    """
+    if ip is None or ip < 1 << 32:
+        return ip
+    return (ip - (1 << 32)).to_bytes(16, 'big')
+
+
+def ip_from_column(value) -> str:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return str(ipaddress.IPv6Address(value))
+    return int_to_ip(value)
+
+
+def _number(value) -> float:
+    # The speed and ping tests report "NA" when they were not run
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def match_ixps(hops:list[Hop], ixp_snapshot) -> list[tuple]:
+    """
+    Longest prefix match of each hop against the IXP prefixes.
+
+    :param hops: Hops of a trace.
+    :param ixp_snapshot: `caida.ixp_snapshot.IXPSnapshot` of a CAIDA IXP dataset.
+    :return: list of (hop number, IP as an integer, ix_id, IX name, prefix) of the hops inside an IXP prefix.
+    """
+    matches = []
+    for hop in hops:
+        match = match_ip(hop.ip, ixp_snapshot)
+        if match is not None:
+            matches.append((hop.number, hop.ip, *match))
+    return matches
+
+
+def match_ip(ip:int, ixp_snapshot) -> tuple:
+    """
+    :return: (ix_id, IX name, prefix) of the longest IXP prefix containing an IP address given as an integer, or None.
+    """
+    if ip is None or ip >= 1 << 32:
+        return None
+    index = ixp_snapshot.lookup(int_to_ip(ip))
+    if index is None:
+        return None
+    ix = ixp_snapshot.ix_record(ixp_snapshot.ix_slots[index])
+    return (ix['ix_id'], ix['name'], ixp_snapshot.prefix_string(index))
+
+
+def snapshot_name(ixp_snapshot) -> str:
+    """
+    Name a snapshot is recorded with, that of its dataset such as "ixs_202307".
+    """
+    return os.path.splitext(os.path.basename(ixp_snapshot.snapshot_file_name))[0]
+
+
+class TraceStore:
+    """
+    History of the traces of every run, kept in a SQLite database instead of one CSV file per run.
+
+    A trace is stored with its hops, the organization and location of each hop, and the IXPs its hops
+    matched. Organizations and locations are stored once and referenced by id, IP addresses are stored
+    as integers. Traces are buffered and written `batch_size` at a time in a single transaction; `flush`
+    writes the buffered ones, and `close` flushes.
+    Indexed columns: target and time of the traces, IP address of the hops and ix_id of the IXP matches.
+
+    IXP matches are versioned by the snapshot of the dataset they were made with. When the dataset is
+    replaced, `set_ixp_snapshot` with the delta between the two snapshots re-matches only the recorded
+    hops inside the changed prefixes, and records the matches of every trace again under the new snapshot;
+    the matches made with the previous snapshots are kept.
+
+    :param filename: SQLite database file.
+    :param ixp_snapshot: Optional `caida.ixp_snapshot.IXPSnapshot` the hops of each trace are matched against.
+    :param batch_size: Number of traces written per transaction.
+    """
+
+    def __init__(self, filename:str="trace_history.sqlite", ixp_snapshot=None, batch_size:int=DEFAULT_BATCH_SIZE):
+        self.filename = filename
+        self.ixp_snapshot = ixp_snapshot
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._org_ids = {}
+        self._location_ids = {}
+        self._connection = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+        for table, column, column_type in MIGRATIONS:
+            columns = [row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self._snapshot_id = self._snapshot_id_of(ixp_snapshot) if ixp_snapshot is not None else None
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._connection.execute("PRAGMA optimize")
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_trace(self, target:str, hops:list[Hop], hop_count:int=None, ixp_matches:list[tuple]=None, traced_at:float=None,
+                  destination:int=None, download=None, upload=None, latency=None) -> None:
+        """
+        Buffer a trace, written with the next batch.
+
+        :param target: Target URL of the traceroute.
+        :param hops: Hops of the trace, with their location and organization.
+        :param hop_count: Number of hops went through, by default the number of the last hop.
+        :param ixp_matches: IXPs matched by the hops, as given by match_ixps. By default the hops are matched
+            against the ixp_snapshot of the store, if it has one.
+        :param traced_at: Time of the trace in seconds since the epoch, by default now.
+        :param destination: Destination IP address as an integer.
+        :param download, upload, latency: Results of the speed and ping tests, if they were run.
+        """
+        if hop_count is None:
+            hop_count = max((hop.number for hop in hops), default=0)
+        ixp_snapshot, snapshot_id = self.ixp_snapshot, self._snapshot_id
+        if ixp_matches is None:
+            ixp_matches = match_ixps(hops, ixp_snapshot) if ixp_snapshot is not None else []
+        trace = (target, traced_at or time.time(), destination, hop_count, _number(download), _number(upload),
+                 _number(latency), list(hops), list(ixp_matches), snapshot_id)
+        with self._lock:
+            self._pending.append(trace)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write the buffered traces in one transaction.
+
+        If the database cannot be written, e.g. while another process locks it, the traces stay buffered
+        for the next flush. Traces that cannot be written at all are dropped.
+
+        :return: number of traces written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            connection = self._connection
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    hop_rows = []
+                    match_rows = []
+                    for target, traced_at, destination, hop_count, download, upload, latency, hops, ixp_matches, snapshot_id in pending:
+                        trace_id = connection.execute(
+                            "INSERT INTO traces (target, traced_at, destination, hop_count, download, upload, latency, snapshot_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (target, traced_at, ip_column(destination), hop_count, download, upload, latency, snapshot_id)
+                        ).lastrowid
+                        hop_rows.extend((trace_id, hop.number, ip_column(hop.ip), sum(hop.rtt) / len(hop.rtt) if hop.rtt else None,
+                                         self._location_id(hop.location), self._org_id(hop.org)) for hop in hops)
+                        match_rows.extend((trace_id, traced_at, number, ip_column(ip), ix_id, name, prefix, snapshot_id)
+                                          for number, ip, ix_id, name, prefix in ixp_matches)
+                    connection.executemany("INSERT INTO hops VALUES (?, ?, ?, ?, ?, ?)", hop_rows)
+                    connection.executemany(MATCH_INSERT, match_rows)
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    # Ids given out in the failed transaction do not exist
+                    self._org_ids.clear()
+                    self._location_ids.clear()
+                    raise
+            except sqlite3.OperationalError as e:
+                # Such as a database locked by another process or a full disk: the traces are written by the next flush
+                self._pending[:0] = pending
+                logger.error(f"Recording {len(pending)} traces to {self.filename} failed, they are kept for the next flush: {e}")
+                raise
+            except Exception as e:
+                # The traces themselves are invalid, they would fail again
+                logger.error(f"Recording {len(pending)} traces to {self.filename} failed, they are dropped: {e}")
+                raise
+        logger.info(f"{len(pending)} traces recorded to {self.filename}")
+        return len(pending)
+
+    def set_ixp_snapshot(self, ixp_snapshot, delta=None) -> int:
+        """
+        Match the next traces against another snapshot, e.g. that of the dataset of the following month.
+
+        With the `caida.ixp_delta.SnapshotDelta` from the current snapshot to the new one, the traces
+        matched against the current snapshot are matched again under the new one: their matches outside
+        the changed prefixes are copied, and only the hops inside the changed prefixes are looked up in the
+        new snapshot. Without a delta, the recorded traces keep the matches of the snapshot they were
+        recorded with.
+
+        :return: number of recorded hops looked up again.
+        """
+        self.flush()
+        with self._lock:
+            current_id = self._snapshot_id
+            if delta is not None and self.ixp_snapshot is not None and delta.old_checksum != self.ixp_snapshot.checksum:
+                raise ValueError("The delta does not start from the current snapshot")
+            connection = self._connection
+            new_id = self._snapshot_id_of(ixp_snapshot)
+            rematched = 0
+            if delta is not None and current_id is not None and new_id != current_id:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    rematched = self._rematch(current_id, new_id, ixp_snapshot, delta)
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+            self.ixp_snapshot, self._snapshot_id = ixp_snapshot, new_id
+        if rematched:
+            logger.info(f"{rematched} recorded hops matched again against {snapshot_name(ixp_snapshot)}")
+        return rematched
+
+    def _rematch(self, current_id:int, new_id:int, ixp_snapshot, delta) -> int:
+        connection = self._connection
+        # Matches outside the changed prefixes are the same with both snapshots, and are copied within SQLite.
+        # The changed ranges are disjoint, so an address is inside one if it is inside the last one starting before it
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS changed_ranges (first INTEGER PRIMARY KEY, last INTEGER)")
+        connection.execute("DELETE FROM changed_ranges")
+        connection.executemany("INSERT INTO changed_ranges VALUES (?, ?)", delta.ranges())
+        connection.execute(
+            """
+            INSERT INTO ixp_matches (trace_id, traced_at, number, ip, ix_id, name, prefix, snapshot_id)
+            SELECT trace_id, traced_at, number, ip, ix_id, name, prefix, ? FROM ixp_matches m
+            WHERE snapshot_id = ? AND NOT EXISTS (
+                SELECT 1 FROM changed_ranges r
+                WHERE r.first = (SELECT MAX(first) FROM changed_ranges WHERE first <= m.ip) AND r.last >= m.ip
+            )
+            """,
+            (new_id, current_id)
+        )
+
+        match_rows = []
+        rematched = 0
+        for first, last in delta.ranges():
+            for trace_id, traced_at, number, ip in connection.execute(
+                """
+                SELECT h.trace_id, t.traced_at, h.number, h.ip FROM hops h JOIN traces t ON t.id = h.trace_id
+                WHERE h.ip BETWEEN ? AND ? AND t.snapshot_id = ?
+                """,
+                (first, last, current_id)
+            ):
+                rematched += 1
+                match = match_ip(ip, ixp_snapshot)
+                if match is not None:
+                    match_rows.append((trace_id, traced_at, number, ip, *match, new_id))
+        connection.executemany(MATCH_INSERT, match_rows)
+        connection.execute("UPDATE traces SET snapshot_id = ? WHERE snapshot_id = ?", (new_id, current_id))
+        return rematched
+
+    def _snapshot_id_of(self, ixp_snapshot) -> int:
+        checksum = ixp_snapshot.checksum.hex()
+        self._connection.execute("INSERT OR IGNORE INTO snapshots (name, checksum, loaded_at) VALUES (?, ?, ?)",
+                                 (snapshot_name(ixp_snapshot), checksum, time.time()))
+        (snapshot_id,) = self._connection.execute("SELECT id FROM snapshots WHERE checksum = ?", (checksum,)).fetchone()
+        return snapshot_id
+
+    def _location_id(self, location:str) -> int:
+        if not location:
+            return None
+        location_id = self._location_ids.get(location)
+        if location_id is None:
+            self._connection.execute("INSERT OR IGNORE INTO locations (location) VALUES (?)", (location,))
+            (location_id,) = self._connection.execute("SELECT id FROM locations WHERE location = ?", (location,)).fetchone()
+            self._location_ids[location] = location_id
+        return location_id
+
+    def _org_id(self, org:OrgRecord) -> int:
+        if org is None:
+            return None
+        key = org.row()
+        org_id = self._org_ids.get(key)
+        if org_id is None:
+            row = self._connection.execute(
+                "SELECT id FROM orgs WHERE network_range IS ? AND regional_registry IS ? AND organization IS ? AND address IS ?",
+                (org.network_range, org.regional_registry, org.organization, org.address)
+            ).fetchone()
+            if row is None:
+                org_id = self._connection.execute("INSERT INTO orgs (regional_registry, network_range, organization, address) VALUES (?, ?, ?, ?)",
+                                                  key).lastrowid
+            else:
+                org_id = row[0]
+            self._org_ids[key] = org_id
+        return org_id
+
+    def _query(self, sql:str, parameters:tuple) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def traces_through_ixp(self, ix_id:int, since:float=0, until:float=None, snapshot:str=None) -> list[tuple]:
+        """
+        Traces with a hop inside a prefix of an IXP.
+
+        :param snapshot: Name of the snapshot the matches were made with, such as "ixs_202307". By default
+            the latest snapshot each trace was matched against.
+        :return: list of (trace id, target, time, hop number, IP address, IX name, prefix, snapshot), most recent first.
+        """
+        if snapshot is None:
+            condition, parameters = "m.snapshot_id IS t.snapshot_id", ()
+        else:
+            condition, parameters = "s.name = ?", (snapshot,)
+        rows = self._query(
+            f"""
+            SELECT m.trace_id, t.target, m.traced_at, m.number, m.ip, m.name, m.prefix, s.name
+            FROM ixp_matches m JOIN traces t ON t.id = m.trace_id LEFT JOIN snapshots s ON s.id = m.snapshot_id
+            WHERE m.ix_id = ? AND m.traced_at >= ? AND m.traced_at < ? AND {condition}
+            ORDER BY m.traced_at DESC
+            """,
+            (ix_id, since, until or float('inf'), *parameters)
+        )
+        return [(trace_id, target, traced_at, number, ip_from_column(ip), name, prefix, snapshot_name)
+                for trace_id, target, traced_at, number, ip, name, prefix, snapshot_name in rows]
+
+    def snapshots(self) -> list[tuple]:
+        """
+        Snapshots the traces were matched against.
+
+        :return: list of (name, checksum, time first used, number of traces whose latest matches were made with it, number of matches).
+        """
+        return self._query(
+            """
+            SELECT s.name, s.checksum, s.loaded_at,
+                   (SELECT COUNT(*) FROM traces t WHERE t.snapshot_id = s.id),
+                   (SELECT COUNT(*) FROM ixp_matches m WHERE m.snapshot_id = s.id)
+            FROM snapshots s ORDER BY s.loaded_at
+            """,
+            ()
+        )
+
+    def traces_through(self, network:str, since:float=0, until:float=None) -> list[tuple]:
+        """
+        Traces with a hop inside a network, or at an IP address.
+
+        :param network: IP address or CIDR network.
+        :return: list of (trace id, target, time, hop number, IP address, organization), most recent first.
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        first = ip_column(ip_to_int(network.network_address))
+        last = ip_column(ip_to_int(network.broadcast_address))
+        # The unary + keeps SQLite from scanning the traces by time instead of the hops by IP address
+        rows = self._query(
+            """
+            SELECT h.trace_id, t.target, t.traced_at, h.number, h.ip, o.organization
+            FROM hops h JOIN traces t ON t.id = h.trace_id LEFT JOIN orgs o ON o.id = h.org_id
+            WHERE h.ip BETWEEN ? AND ? AND +t.traced_at >= ? AND +t.traced_at < ?
+            ORDER BY t.traced_at DESC
+            """,
+            (first, last, since, until or float('inf'))
+        )
+        return [(trace_id, target, traced_at, number, ip_from_column(ip), organization)
+                for trace_id, target, traced_at, number, ip, organization in rows]
+
+    def traces_of(self, target:str, since:float=0, until:float=None) -> list[tuple]:
+        """
+        Traces of a target.
+
+        :return: list of (trace id, target, time, hop count, download, upload, latency), most recent first.
+        """
+        return self._query(
+            """
+            SELECT id, target, traced_at, hop_count, download, upload, latency FROM traces
+            WHERE target = ? AND traced_at >= ? AND traced_at < ?
+            ORDER BY traced_at DESC
+            """,
+            (target, since, until or float('inf'))
+        )
+
+    def hops_of(self, trace_id:int) -> list[tuple]:
+        """
+        Hops of a trace, in the columns of `util.csv_helper.write_ip_info` preceded by the hop number and RTT.
+
+        :return: list of (hop number, RTT in ms, IP address, location, regional registry, network range, organization, address).
+        """
+        rows = self._query(
+            """
+            SELECT h.number, h.rtt_ms, h.ip, l.location, o.regional_registry, o.network_range, o.organization, o.address
+            FROM hops h LEFT JOIN locations l ON l.id = h.location_id LEFT JOIN orgs o ON o.id = h.org_id
+            WHERE h.trace_id = ? ORDER BY h.number
+            """,
+            (trace_id,)
+        )
+        return [(number, rtt, ip_from_column(ip), *rest) for number, rtt, ip, *rest in rows]
+
+    def stats(self) -> dict[str, int]:
+        counts = {}
+        for table in ('traces', 'hops', 'ixp_matches', 'orgs', 'locations', 'snapshots'):
+            (counts[table],) = self._query(f"SELECT COUNT(*) FROM {table}", ())[0]
+        return counts
+
+
+_DURATION_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)([smhdw])$')
+_DURATION_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_time(value:str) -> float:
+    """
+    Time given on the command line: a duration before now such as "30m", "12h", "7d" or "2w",
+    or an ISO date or date and time such as "2023-11-01" or "2023-11-01T08:00".
+    """
+    match = _DURATION_PATTERN.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * _DURATION_SECONDS[match.group(2)]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _format_time(timestamp:float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat(sep=' ', timespec='seconds')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the trace history recorded by main.py.")
+    parser.add_argument('-d', dest='database', type=str, default="trace_history.sqlite", help="Trace history database")
+    parser.add_argument('--since', type=parse_time, default=0, help="Only traces from this time on, e.g. 7d, 12h or 2023-11-01")
+    parser.add_argument('--until', type=parse_time, default=None, help="Only traces before this time")
+    parser.add_argument('--snapshot', type=str, default=None, help="IXP matches made with this dataset, e.g. ixs_202307, rather than the latest one of each trace")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ixp_parser = subparsers.add_parser('ixp', help="Traces that crossed an IXP")
+    ixp_parser.add_argument('ix_id', type=int, help="ix_id of the IXP in the CAIDA dataset")
+    ip_parser = subparsers.add_parser('ip', help="Traces that went through an IP address or network")
+    ip_parser.add_argument('network', type=str, help="IP address or CIDR network")
+    target_parser = subparsers.add_parser('target', help="Traces of a target")
+    target_parser.add_argument('target', type=str, help="Target URL")
+    hops_parser = subparsers.add_parser('hops', help="Hops of a trace")
+    hops_parser.add_argument('trace_id', type=int, help="Trace id, as listed by the other commands")
+    subparsers.add_parser('snapshots', help="IXP datasets the traces were matched against")
+    subparsers.add_parser('stats', help="Number of traces, hops and IXP matches recorded")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = TraceStore(args.database)
+    writer = csv.writer(sys.stdout)
+    try:
+        if args.command == 'ixp':
+            writer.writerow(['Trace', 'Target', 'Time', 'Hop', 'IP Address', 'IXP', 'Prefix', 'Snapshot'])
+            rows = [(trace_id, target, _format_time(traced_at), *rest)
+                    for trace_id, target, traced_at, *rest in store.traces_through_ixp(args.ix_id, args.since, args.until, args.snapshot)]
+        elif args.command == 'ip':
+            writer.writerow(['Trace', 'Target', 'Time', 'Hop', 'IP Address', 'Organization'])
+            rows = [(trace_id, target, _format_time(traced_at), *rest)
+                    for trace_id, target, traced_at, *rest in store.traces_through(args.network, args.since, args.until)]
+        elif args.command == 'target':
+            writer.writerow(['Trace', 'Target', 'Time', 'Number of Hops', 'Download Speed', 'Upload Speed', 'Average Latency'])
+            rows = [(trace_id, target, _format_time(traced_at), *rest)
+                    for trace_id, target, traced_at, *rest in store.traces_of(args.target, args.since, args.until)]
+        elif args.command == 'snapshots':
+            writer.writerow(['Snapshot', 'Checksum', 'First Used', 'Traces', 'IXP Matches'])
+            rows = [(name, checksum, _format_time(loaded_at), *rest) for name, checksum, loaded_at, *rest in store.snapshots()]
+        elif args.command == 'hops':
+            writer.writerow(['Hop', 'RTT', 'IP Address', 'Location', *ORG_DETAIL_FIELDS])
+            rows = store.hops_of(args.trace_id)
+        else:
+            rows = list(store.stats().items())
+        writer.writerows(rows)
+    finally:
+        store.close()
+    print(f"{len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
@@ -1,13 +1,16 @@
-import subprocess
 import re
 
+from util.timing import timed
+from util.whois_client import whois
 
+
+@timed("whois", "network")
 def whois_lookup(domain_or_ip):
     try:
-        # Execute the whois command and decode the result
-        result = subprocess.check_output(['whois', domain_or_ip], stderr=subprocess.STDOUT).decode('utf-8')
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing whois on {domain_or_ip}.")
+        # Query the whois record, following the referrals from IANA
+        result = whois(domain_or_ip)
+    except OSError as e:
+        print(f"Error querying whois for {domain_or_ip}.")
         return {}
 
     # Use regular expressions to extract the desired details
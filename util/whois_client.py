@@ -0,0 +1,418 @@
+"""
+whois client speaking the protocol over TCP port 43 (RFC 3912), instead of running the whois command.
+
+    python -m util.whois_client 62.115.45.169 38.140.44.154
+"""
+import re
+import time
+import socket
+import logging
+import ipaddress
+import argparse
+import threading
+
+from util.ip_range_index import IPRangeIndex
+from util.timing import span
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+ROOT_SERVER = "whois.iana.org"
+DEFAULT_TIMEOUT = 10  # seconds
+MAX_REFERRALS = 3
+
+# "refer:" of IANA, "ReferralServer: whois://..." of ARIN and the other registries
+REFERRAL_PATTERN = re.compile(r'^(?:refer|whois|ReferralServer):\s*(?:whois://)?([A-Za-z0-9.-]+(?::\d+)?)\s*$', re.MULTILINE | re.IGNORECASE)
+# Range a referral applies to
+REFERRAL_RANGE_PATTERN = re.compile(r'^(?:inetnum|inet6num|NetRange):\s*(.+?)\s*$', re.MULTILINE | re.IGNORECASE)
+# End of a response on a persistent (-k) connection: two empty lines
+KEEP_ALIVE_TERMINATOR = b"\n\n\n"
+
+
+class WhoisError(OSError):
+    pass
+
+
+class WhoisServer:
+    """
+    How to query a whois server.
+
+    :param host, port: Address to connect to, e.g. that of a local stand-in server.
+    :param query_format: Query sent for an IP address or domain, e.g. "n + {query}" for the full network record of ARIN.
+    :param keep_alive: The server keeps the connection open between queries when the first one starts
+        with "-k", as the RIPE database software does. Connections to other servers serve one query.
+    :param max_connections: Queries sent to the server at the same time.
+    """
+
+    def __init__(self, host:str, port:int=43, query_format:str="{query}", keep_alive:bool=False, max_connections:int=4):
+        self.host = host
+        self.port = port
+        self.query_format = query_format
+        self.keep_alive = keep_alive
+        self.max_connections = max_connections
+
+    def request(self, query:str, first_on_connection:bool=True) -> bytes:
+        query = self.query_format.format(query=query)
+        if self.keep_alive and first_on_connection:
+            query = f"-k {query}"
+        return f"{query}\r\n".encode('utf-8')
+
+
+DEFAULT_SERVERS = {
+    "whois.iana.org": WhoisServer("whois.iana.org"),
+    "whois.arin.net": WhoisServer("whois.arin.net", query_format="n + {query}"),
+    "whois.ripe.net": WhoisServer("whois.ripe.net", keep_alive=True),
+    "whois.afrinic.net": WhoisServer("whois.afrinic.net", keep_alive=True),
+    "whois.apnic.net": WhoisServer("whois.apnic.net"),
+    "whois.lacnic.net": WhoisServer("whois.lacnic.net"),
+}
+
+
+def parse_server_option(option:str) -> tuple[str, WhoisServer]:
+    """
+    Parse a NAME=HOST[:PORT] command line option, pointing the whois server NAME to another address.
+    """
+    name, _, address = option.partition('=')
+    host, _, port = address.rpartition(':') if ':' in address else (address, '', '')
+    if not name or not host or not (port or '43').isdigit():
+        raise ValueError(f"Expected NAME=HOST[:PORT], got {option!r}")
+    default = DEFAULT_SERVERS.get(name, WhoisServer(name))
+    return name, WhoisServer(host, int(port) if port else 43, default.query_format, default.keep_alive, default.max_connections)
+
+
+def _root_key(query:str) -> str:
+    """
+    Block IANA refers to a registry as a whole, an IPv4 /8 or an IPv6 /12, or None for a domain.
+    """
+    try:
+        ip = ipaddress.ip_address(query)
+    except ValueError:
+        return None
+    return str(ipaddress.ip_network(f"{ip}/{8 if ip.version == 4 else 12}", strict=False))
+
+
+def _response_complete(buffer:bytes) -> bool:
+    return buffer.endswith(KEEP_ALIVE_TERMINATOR)
+
+
+def _decode(response:bytes, keep_alive:bool=False) -> str:
+    if keep_alive:
+        # Drop the empty lines ending the response, which a connection serving one query does not send
+        response = response[:-(len(KEEP_ALIVE_TERMINATOR) - 1)]
+    return response.decode('utf-8', errors='replace')
+
+
+class WhoisClient:
+    """
+    whois client following the referrals from IANA to the registries.
+
+    A query starts at the most specific server known for the address: the range of every referral is
+    remembered, so that after the first query into an IANA block, the next ones go straight to its
+    registry. Each server is sent at most `max_connections` queries at a time, and the connections of
+    keep-alive servers are kept for the next query. `query` blocks, `aquery` is for asyncio.
+
+    :param servers: Map of server name to WhoisServer, names found in referrals but missing from it are
+        queried on port 43. Tests point it to a local stand-in server.
+    :param timeout: Seconds to wait for a server.
+    :param max_referrals: Referrals followed after the first server.
+    """
+
+    def __init__(self, servers:dict[str, WhoisServer]=None, timeout:float=DEFAULT_TIMEOUT, max_referrals:int=MAX_REFERRALS):
+        self.servers = dict(DEFAULT_SERVERS if servers is None else servers)
+        self.timeout = timeout
+        self.max_referrals = max_referrals
+        self.referrals = IPRangeIndex()
+        self.queries = 0
+        self.connections = 0
+        self.referral_hits = 0
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._idle = {}
+        self._root_queries = {}
+        self._async_state = None
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self) -> dict[str, int]:
+        return {'queries': self.queries, 'connections': self.connections, 'referral_hits': self.referral_hits,
+                'referral_ranges': len(self.referrals)}
+
+    def server(self, name:str) -> WhoisServer:
+        server = self.servers.get(name)
+        if server is None:
+            host, _, port = name.partition(':')
+            server = WhoisServer(host, int(port) if port else 43)
+        return server
+
+    def _first_server(self, query:str) -> str:
+        with self._lock:
+            name = self.referrals.lookup(query)
+            if name is not None:
+                self.referral_hits += 1
+        return name or ROOT_SERVER
+
+    def _follow(self, query:str, name:str, response:str, visited:set) -> str:
+        """
+        Server the response refers to, or None. The range of the referral is remembered.
+        """
+        match = REFERRAL_PATTERN.search(response)
+        if match is None:
+            return None
+        referral = match.group(1).lower()
+        if referral.endswith(":43"):
+            referral = referral[:-3]
+        if referral in visited:
+            return None
+        range_match = REFERRAL_RANGE_PATTERN.search(response)
+        if range_match is not None:
+            with self._lock:
+                if self.referrals.lookup(query) != referral:
+                    self.referrals.insert(range_match.group(1), referral)
+        logger.debug(f"{name} refers to {referral}")
+        return referral
+
+    def query(self, query:str) -> str:
+        """
+        Query the whois record of an IP address or domain, following referrals.
+
+        :return: response of the last server of the referral chain.
+        :raises OSError: if a server cannot be reached.
+        """
+        name = self._first_server(query)
+        key = owned = None
+        if name == ROOT_SERVER:
+            # While IANA is asked about a block, the other queries into it wait for its referral
+            key = _root_key(query)
+            with self._lock:
+                pending = self._root_queries.get(key)
+                if pending is None and key is not None:
+                    owned = self._root_queries[key] = threading.Event()
+            if pending is not None:
+                pending.wait(self.timeout)
+                name = self._first_server(query)
+        try:
+            visited = {name}
+            for _ in range(self.max_referrals + 1):
+                response = self._ask(name, query)
+                referral = self._follow(query, name, response, visited)
+                if referral is None:
+                    break
+                name = referral
+                visited.add(name)
+            return response
+        finally:
+            if owned is not None:
+                with self._lock:
+                    del self._root_queries[key]
+                owned.set()
+
+    def _semaphore(self, name:str, server:WhoisServer) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(name)
+            if semaphore is None:
+                semaphore = self._semaphores[name] = threading.BoundedSemaphore(server.max_connections)
+        return semaphore
+
+    def _ask(self, name:str, query:str) -> str:
+        server = self.server(name)
+        with self._semaphore(name, server), span("whois_query", "network", server=name):
+            with self._lock:
+                self.queries += 1
+            if server.keep_alive:
+                with self._lock:
+                    idle = self._idle.get(name)
+                    connection = idle.pop() if idle else None
+                if connection is not None:
+                    try:
+                        response = self._exchange(connection, server.request(query, False), True)
+                    except OSError:
+                        # The server closed the idle connection, try once with a new one
+                        connection.close()
+                    else:
+                        self._release(name, connection)
+                        return response
+            connection = socket.create_connection((server.host, server.port), timeout=self.timeout)
+            with self._lock:
+                self.connections += 1
+            try:
+                response = self._exchange(connection, server.request(query), server.keep_alive)
+            except BaseException:
+                connection.close()
+                raise
+            if server.keep_alive:
+                self._release(name, connection)
+            else:
+                connection.close()
+            return response
+
+    def _release(self, name:str, connection:socket.socket) -> None:
+        with self._lock:
+            self._idle.setdefault(name, []).append(connection)
+
+    def _exchange(self, connection:socket.socket, request:bytes, keep_alive:bool) -> str:
+        connection.sendall(request)
+        chunks = []
+        received = b""
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                if keep_alive:
+                    raise WhoisError("Connection closed by the whois server")
+                break
+            chunks.append(chunk)
+            if keep_alive:
+                received = received[-len(KEEP_ALIVE_TERMINATOR):] + chunk
+                if _response_complete(received):
+                    break
+        return _decode(b"".join(chunks), keep_alive)
+
+    def _async_state_of(self, loop):
+        # asyncio semaphores and streams belong to the event loop they were created in
+        with self._lock:
+            if self._async_state is None or self._async_state[0] is not loop:
+                self._async_state = (loop, {}, {}, {})
+            return self._async_state
+
+    async def aquery(self, query:str) -> str:
+        """
+        Asynchronous `query`, with asyncio streams.
+        """
+        import asyncio
+        _, _, _, root_queries = self._async_state_of(asyncio.get_running_loop())
+        name = self._first_server(query)
+        key = owned = None
+        if name == ROOT_SERVER:
+            key = _root_key(query)
+            pending = root_queries.get(key)
+            if pending is None and key is not None:
+                owned = root_queries[key] = asyncio.Event()
+            if pending is not None:
+                try:
+                    await asyncio.wait_for(pending.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+                name = self._first_server(query)
+        try:
+            visited = {name}
+            for _ in range(self.max_referrals + 1):
+                response = await self._aask(name, query)
+                referral = self._follow(query, name, response, visited)
+                if referral is None:
+                    break
+                name = referral
+                visited.add(name)
+            return response
+        finally:
+            if owned is not None:
+                del root_queries[key]
+                owned.set()
+
+    async def _aask(self, name:str, query:str) -> str:
+        import asyncio
+        server = self.server(name)
+        _, semaphores, idle, _ = self._async_state_of(asyncio.get_running_loop())
+        semaphore = semaphores.get(name)
+        if semaphore is None:
+            semaphore = semaphores[name] = asyncio.Semaphore(server.max_connections)
+        async with semaphore:
+            with self._lock:
+                self.queries += 1
+            if server.keep_alive and idle.get(name):
+                reader, writer = idle[name].pop()
+                try:
+                    response = await self._aexchange(reader, writer, server.request(query, False), True)
+                except OSError:
+                    writer.close()
+                else:
+                    idle.setdefault(name, []).append((reader, writer))
+                    return response
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(server.host, server.port), self.timeout)
+            with self._lock:
+                self.connections += 1
+            try:
+                response = await self._aexchange(reader, writer, server.request(query), server.keep_alive)
+            except BaseException:
+                writer.close()
+                raise
+            if server.keep_alive:
+                idle.setdefault(name, []).append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    async def _aexchange(self, reader, writer, request:bytes, keep_alive:bool) -> str:
+        import asyncio
+        writer.write(request)
+        await writer.drain()
+        if not keep_alive:
+            return _decode(await asyncio.wait_for(reader.read(), self.timeout))
+        chunks = []
+        received = b""
+        while True:
+            chunk = await asyncio.wait_for(reader.read(65536), self.timeout)
+            if not chunk:
+                raise WhoisError("Connection closed by the whois server")
+            chunks.append(chunk)
+            received = received[-len(KEEP_ALIVE_TERMINATOR):] + chunk
+            if _response_complete(received):
+                return _decode(b"".join(chunks), True)
+
+
+_default_lock = threading.Lock()
+_default_client = None
+
+
+def get_client() -> WhoisClient:
+    """
+    WhoisClient shared by the whois lookups of the program, so that they share its referrals and connections.
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = WhoisClient()
+        return _default_client
+
+
+def set_client(client:WhoisClient) -> WhoisClient:
+    """
+    Use another client for the whois lookups of the program, e.g. one pointed to a local stand-in server.
+
+    :return: the previous client, None if none was created yet.
+    """
+    global _default_client
+    with _default_lock:
+        previous, _default_client = _default_client, client
+    return previous
+
+
+def whois(query:str) -> str:
+    """
+    whois record of an IP address or domain, with the shared client.
+    """
+    return get_client().query(query)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query whois records over TCP port 43, following referrals.")
+    parser.add_argument('queries', nargs='+', help="IP addresses or domains")
+    parser.add_argument('--server', dest='servers', action='append', default=[], metavar='NAME=HOST[:PORT]',
+                        help="Send the queries for whois server NAME to another address, e.g. whois.iana.org=127.0.0.1:4343")
+    args = parser.parse_args()
+
+    servers = dict(DEFAULT_SERVERS)
+    servers.update(parse_server_option(option) for option in args.servers)
+    with WhoisClient(servers) as client:
+        for query in args.queries:
+            started = time.perf_counter()
+            print(client.query(query))
+            print(f"% {query}: {(time.perf_counter() - started) * 1000:.0f} ms, {client.stats()}")
@@ -0,0 +1,198 @@
+import re
+import ipaddress
+import logging
+
+logger:logging.Logger = logging.getLogger(__name__)
+
+# Minimum confidence for a parsed record to be used without asking GPT
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+_FIELD_PATTERN = re.compile(r'^([A-Za-z][\w-]*):[ \t]*(.*)$')
+
+
+def split_objects(whois_result:str) -> list[list[tuple[str, str]]]:
+    """
+    Split a whois response into its objects: blocks of "key: value" lines separated by blank lines.
+    Comment lines (starting with % or #) are dropped.
+
+    :param whois_result: Output of the whois command.
+    :return: List of objects, each a list of (lower case key, value) pairs in order.
+    """
+    objects = []
+    current = []
+    for line in whois_result.splitlines():
+        if not line.strip() or line.startswith(('%', '#')):
+            if current:
+                objects.append(current)
+                current = []
+            continue
+        match = _FIELD_PATTERN.match(line)
+        if match:
+            current.append((match.group(1).lower(), match.group(2).strip()))
+        elif current and line[:1].isspace():
+            # continuation of the previous value
+            key, value = current[-1]
+            current[-1] = (key, f"{value} {line.strip()}".strip())
+    if current:
+        objects.append(current)
+    return objects
+
+
+def _first(obj:list[tuple[str, str]], *keys:str):
+    for key in keys:
+        for field, value in obj:
+            if field == key and value:
+                return value
+    return None
+
+
+def _all(obj:list[tuple[str, str]], key:str) -> list[str]:
+    return [value for field, value in obj if field == key and value]
+
+
+def _expand_lacnic_range(network_range:str) -> str:
+    """
+    LACNIC abbreviates networks, e.g. "200.160/20" for "200.160.0.0/20".
+    """
+    if '/' not in network_range:
+        return network_range
+    address, length = network_range.split('/', 1)
+    octets = address.strip().split('.')
+    if 0 < len(octets) < 4 and all(octet.isdigit() for octet in octets):
+        address = '.'.join(octets + ['0'] * (4 - len(octets)))
+    return f"{address}/{length.strip()}"
+
+
+def _range_bounds(network_range:str):
+    """
+    First and last address of a "start - end" or CIDR network range, or None if invalid.
+    """
+    try:
+        if '-' in network_range:
+            start, end = [part.strip() for part in network_range.split('-', 1)]
+            return ipaddress.ip_address(start), ipaddress.ip_address(end)
+        network = ipaddress.ip_network(network_range.split(',')[0].strip(), strict=False)
+        return network.network_address, network.broadcast_address
+    except ValueError:
+        return None
+
+
+def detect_registry(whois_result:str, objects:list) -> str:
+    """
+    Identify the Regional Internet Registry that served a whois response.
+    """
+    sources = [_first(obj, 'source') for obj in objects]
+    sources = [source.split()[0].upper() for source in sources if source]
+    for registry in ('RIPE', 'APNIC', 'AFRINIC', 'LACNIC', 'ARIN'):
+        if registry in sources:
+            return registry
+    text = whois_result.upper()
+    if 'LACNIC' in text or any(_first(obj, 'owner') for obj in objects):
+        return 'LACNIC'
+    if any(_first(obj, 'netrange') for obj in objects) or 'ARIN WHOIS' in text:
+        return 'ARIN'
+    for registry in ('RIPE', 'APNIC', 'AFRINIC'):
+        if registry in text:
+            return registry
+    return None
+
+
+def _parse_arin(objects:list) -> dict:
+    # Reassignments are listed after their parent allocation, the last network is the most specific
+    network_range = None
+    organization = None
+    address_parts = None
+    for obj in objects:
+        if _first(obj, 'netrange'):
+            network_range = _first(obj, 'netrange')
+            organization = _first(obj, 'organization', 'orgname', 'custname') or organization
+        if _first(obj, 'orgname', 'custname'):
+            organization = _first(obj, 'orgname', 'custname')
+            address_parts = _all(obj, 'address') + [part for part in (
+                _first(obj, 'city'), _first(obj, 'stateprov'), _first(obj, 'postalcode'), _first(obj, 'country')) if part]
+    # "Organization: Name (ID)" carries the handle after the name
+    if organization:
+        organization = re.sub(r'\s*\([A-Z0-9-]+\)$', '', organization)
+    return {
+        'Network Range': network_range,
+        'Organization': organization,
+        'Address': ', '.join(address_parts) if address_parts else None
+    }
+
+
+def _parse_rpsl(objects:list, registry:str) -> dict:
+    # RIPE, APNIC, AFRINIC and LACNIC all use RPSL style objects
+    network_object = None
+    for obj in objects:
+        if obj[0][0] in ('inetnum', 'inet6num'):
+            network_object = obj  # keep the last, most specific, network object
+    if network_object is None:
+        return {'Network Range': None, 'Organization': None, 'Address': None}
+
+    network_range = _first(network_object, 'inetnum', 'inet6num')
+    if registry == 'LACNIC':
+        network_range = _expand_lacnic_range(network_range)
+
+    organization = _first(network_object, 'owner', 'org-name')
+    address_lines = _all(network_object, 'address')
+    org_handle = _first(network_object, 'org', 'owner-id')
+    for obj in objects:
+        if obj[0][0] == 'organisation' and (org_handle is None or obj[0][1] == org_handle):
+            organization = organization or _first(obj, 'org-name')
+            address_lines = address_lines or _all(obj, 'address')
+    organization = organization or _first(network_object, 'descr', 'netname')
+
+    if not address_lines:
+        # fall back on the address of the first role or person object
+        for obj in objects:
+            if obj[0][0] in ('role', 'person', 'irt') and _all(obj, 'address'):
+                address_lines = _all(obj, 'address')
+                break
+    if address_lines and _first(network_object, 'country') and _first(network_object, 'country') not in address_lines:
+        address_lines = address_lines + [_first(network_object, 'country')]
+    return {
+        'Network Range': network_range,
+        'Organization': organization,
+        'Address': ', '.join(address_lines) if address_lines else None
+    }
+
+
+def parse_whois(whois_result:str, ip_address:str=None) -> tuple[dict, float]:
+    """
+    Extract the organization details from a whois response without GPT.
+
+    :param whois_result: Output of the whois command.
+    :param ip_address: IP address queried, used to check that the network range found contains it.
+    :return: (org_detail, confidence)
+        org_detail: Dictionary with the Regional Registry, Network Range (as found in the response),
+            Organization and Address, missing fields being None
+        confidence: Score between 0 and 1 of how complete and consistent the record is
+    """
+    objects = split_objects(whois_result)
+    registry = detect_registry(whois_result, objects)
+    if registry == 'ARIN':
+        org_detail = _parse_arin(objects)
+    elif registry is not None:
+        org_detail = _parse_rpsl(objects, registry)
+    else:
+        org_detail = {'Network Range': None, 'Organization': None, 'Address': None}
+    org_detail = {'Regional Registry': registry, **org_detail}
+
+    confidence = 0.0
+    if registry:
+        confidence += 0.25
+    if org_detail['Organization']:
+        confidence += 0.25
+    if org_detail['Address']:
+        confidence += 0.15
+    bounds = _range_bounds(org_detail['Network Range']) if org_detail['Network Range'] else None
+    if bounds is not None:
+        contains_ip = True
+        if ip_address is not None:
+            try:
+                ip = ipaddress.ip_address(ip_address)
+                contains_ip = ip.version == bounds[0].version and bounds[0] <= ip <= bounds[1]
+            except ValueError:
+                contains_ip = False
+        confidence += 0.35 if contains_ip else 0.1
+    return org_detail, round(confidence, 2)